@@ -11,4 +11,4 @@
 """
 __version__ = '1.5.9'
 
-__all__ = ['genetic', 'functions', 'fitness', 'example']
+__all__ = ['genetic', 'functions', 'fitness', 'example', 'rolling']
@@ -0,0 +1,311 @@
+# -*- coding: utf-8 -*-
+"""
+-------------------------------------------------
+# @Project  :gplearnplus
+# @File     :_cache
+# @Date     :2026/10/18 0018 10:12
+# @Author   :Junzhe Huang
+# @Email    :acejasonhuang@163.com
+# @Software :PyCharm
+-------------------------------------------------
+"""
+import os
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import joblib
+import numpy as np
+
+# 进程内缓存，按fit的token和线程区分，同一进程中只保留最近一次fit的缓存
+_worker_caches = {}
+# 进程内已加载的训练数据，按数据文件路径区分
+_worker_datasets = {}
+# 进程内的适应度记录，按fit的token和线程区分
+_worker_memos = {}
+# 适应度记录的最大条数
+_FITNESS_MEMO_SIZE = 2 ** 17
+# 每个线程的中间结果缓冲池
+_worker_pools = threading.local()
+# 缓冲池中空闲缓冲区的内存上限
+_BUFFER_POOL_BYTES = 2 ** 28
+
+
+class _SubtreeCache(object):
+    """Memory bounded cache of intermediate subtree results.
+
+    Results are keyed by the canonical signature of the subtree that produced
+    them, so that identical subtrees shared between programs (and between
+    generations) are evaluated only once.
+
+    Parameters
+    ----------
+    max_bytes : int
+        The memory budget of the cache. Least recently used results are
+        evicted once the budget is exceeded, results larger than the whole
+        budget are never stored.
+
+    Attributes
+    ----------
+    scope : set or None
+        When set, only results of subtrees whose signature is in the set are
+        stored.
+
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.scope = None
+        self.n_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._results = OrderedDict()
+
+    def __len__(self):
+        return len(self._results)
+
+    def __contains__(self, signature):
+        return signature in self._results
+
+    def get(self, signature):
+        """Return the cached result of a subtree, None if unknown."""
+        result = self._results.get(signature)
+        if result is None:
+            self.misses += 1
+            return None
+        self._results.move_to_end(signature)
+        self.hits += 1
+        return result
+
+    def put(self, signature, result):
+        """Store the result of a subtree, evicting old results if needed.
+
+        Returns whether the result was stored.
+
+        """
+        if self.scope is not None and signature not in self.scope:
+            return False
+        n_bytes = getattr(result, 'nbytes', 0)
+        if n_bytes > self.max_bytes or signature in self._results:
+            return False
+        while self._results and self.n_bytes + n_bytes > self.max_bytes:
+            _, evicted = self._results.popitem(last=False)
+            self.n_bytes -= getattr(evicted, 'nbytes', 0)
+        self._results[signature] = result
+        self.n_bytes += n_bytes
+        return True
+
+    def clear(self):
+        self._results.clear()
+        self.n_bytes = 0
+
+
+class _BufferPool(object):
+    """Free lists of reusable vectors for intermediate results.
+
+    Buffers are handed out by length and dtype and given back once the
+    result they hold has been consumed, so that evaluating programs does not
+    allocate a new vector for every node.
+
+    Parameters
+    ----------
+    max_bytes : int
+        The memory budget of the free buffers, buffers given back beyond it
+        are left to the garbage collector.
+
+    Attributes
+    ----------
+    n_bytes : int
+        The size of the buffers currently handed out.
+
+    peak_bytes : int
+        The largest n_bytes since the last call to `reset_peak`.
+
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.n_bytes = 0
+        self.peak_bytes = 0
+        self.free_bytes = 0
+        self._free = {}
+
+    def get(self, n, dtype):
+        """Hand out an uninitialized buffer of length n."""
+        free = self._free.get((n, dtype))
+        if free:
+            buffer = free.pop()
+            self.free_bytes -= buffer.nbytes
+        else:
+            buffer = np.empty(n, dtype=dtype)
+        self.n_bytes += buffer.nbytes
+        self.peak_bytes = max(self.peak_bytes, self.n_bytes)
+        return buffer
+
+    def release(self, buffer):
+        """Take back a buffer whose content is no longer needed."""
+        self.n_bytes -= buffer.nbytes
+        if self.free_bytes + buffer.nbytes <= self.max_bytes:
+            self._free.setdefault((len(buffer), buffer.dtype), []).append(buffer)
+            self.free_bytes += buffer.nbytes
+
+    def detach(self, buffer):
+        """Give up a buffer that is kept by its user, e.g. a final result."""
+        self.n_bytes -= buffer.nbytes
+
+    def reset_peak(self):
+        self.peak_bytes = self.n_bytes
+
+    def clear(self):
+        self._free.clear()
+        self.free_bytes = 0
+
+
+def _get_buffer_pool(token=None):
+    """Get the buffer pool of the current thread.
+
+    When the token of a fit is given, free buffers left by previous fits are
+    dropped, as their lengths rarely match the new data.
+
+    """
+    pool = getattr(_worker_pools, 'pool', None)
+    if pool is None:
+        pool = _BufferPool(_BUFFER_POOL_BYTES)
+        _worker_pools.pool = pool
+    if token is not None and token != getattr(_worker_pools, 'token', None):
+        pool.clear()
+        _worker_pools.token = token
+    return pool
+
+
+class _FitnessMemo(object):
+    """Bounded table of the raw fitness of programs already evaluated.
+
+    Programs are keyed by the canonical signature of their whole tree, so
+    reproductions, mutations that change nothing and duplicates produced by
+    crossover inherit the fitness of the first evaluation instead of being
+    executed again.
+
+    Parameters
+    ----------
+    max_entries : int
+        The number of programs remembered, least recently used programs are
+        forgotten first.
+
+    """
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._fitness = OrderedDict()
+
+    def __len__(self):
+        return len(self._fitness)
+
+    def __contains__(self, signature):
+        return signature in self._fitness
+
+    def get(self, signature):
+        """Return the raw fitness of a program, None if unknown."""
+        fitness = self._fitness.get(signature)
+        if fitness is None:
+            self.misses += 1
+            return None
+        self._fitness.move_to_end(signature)
+        self.hits += 1
+        return fitness
+
+    def put(self, signature, fitness):
+        """Remember the raw fitness of a program."""
+        self._fitness[signature] = fitness
+        self._fitness.move_to_end(signature)
+        while len(self._fitness) > self.max_entries:
+            self._fitness.popitem(last=False)
+
+
+def _get_fitness_memo(token):
+    """Get the fitness memo of the current thread for one fit."""
+    key = (token, threading.get_ident())
+    memo = _worker_memos.get(key)
+    if memo is None:
+        # 丢弃之前fit的记录，同一fit中其他线程的记录保留
+        for old_key in [old_key for old_key in list(_worker_memos) if old_key[0] != token]:
+            _worker_memos.pop(old_key, None)
+        memo = _FitnessMemo(_FITNESS_MEMO_SIZE)
+        _worker_memos[key] = memo
+    return memo
+
+
+def _get_subtree_cache(token, max_bytes):
+    """Get the subtree cache of the current thread for one fit.
+
+    The cache survives between generations as long as the process (or the
+    thread of the threads backend) is reused, caches of previous fits are
+    dropped to free their memory.
+
+    """
+    if not max_bytes:
+        return None
+    key = (token, threading.get_ident())
+    cache = _worker_caches.get(key)
+    if cache is None:
+        for old_key in [old_key for old_key in list(_worker_caches) if old_key[0] != token]:
+            _worker_caches.pop(old_key, None)
+        cache = _SubtreeCache(max_bytes)
+        _worker_caches[key] = cache
+    return cache
+
+
+@contextmanager
+def _shared_dataset(dataset, n_jobs):
+    """Share the training data of one fit with the worker processes.
+
+    With several jobs the data is dumped once to a temporary folder and the
+    path is handed to the workers instead of the arrays, which then load it
+    as read-only memory maps. The folder is removed when the fit ends.
+
+    """
+    if n_jobs == 1:
+        yield dataset
+        return
+    folder = tempfile.mkdtemp(prefix='gplearnplus_')
+    path = os.path.join(folder, 'dataset.pkl')
+    try:
+        joblib.dump(dataset, path)
+        yield path
+    finally:
+        _worker_datasets.pop(path, None)
+        shutil.rmtree(folder, ignore_errors=True)
+
+
+@contextmanager
+def _migration_folder(n_jobs):
+    """Create the folder in which the jobs of an island-model fit exchange migrants.
+
+    Nothing is created when all islands are evolved by a single job. The
+    folder is removed when the fit ends.
+
+    """
+    if n_jobs == 1:
+        yield None
+        return
+    folder = tempfile.mkdtemp(prefix='gplearnplus_islands_')
+    try:
+        yield folder
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+
+
+def _load_dataset(dataset):
+    """Get the training data in a worker, loading it once per process."""
+    if not isinstance(dataset, str):
+        return dataset
+    loaded = _worker_datasets.get(dataset)
+    if loaded is None:
+        _worker_datasets.clear()
+        loaded = joblib.load(dataset, mmap_mode='r')
+        _worker_datasets[dataset] = loaded
+    return loaded
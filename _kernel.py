@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+"""
+-------------------------------------------------
+# @Project  :gplearnplus
+# @File     :_kernel
+# @Date     :2026/10/18 0018 16:05
+# @Author   :Junzhe Huang
+# @Email    :acejasonhuang@163.com
+# @Software :PyCharm
+-------------------------------------------------
+"""
+import hashlib
+import importlib.util
+import os
+import sys
+import tempfile
+import threading
+
+# 融合内核的默认磁盘缓存目录，每个用户独立，缓存中的代码会被执行，不能放在公共目录
+_KERNEL_CACHE_DIR = os.path.join(os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache'),
+                                 'gplearnplus', 'kernels')
+# 进程内已加载的内核，按源码哈希区分
+_kernels = {}
+# 进程内已检查过的缓存目录
+_checked_dirs = set()
+# 多线程同时加载同一内核时只编译一次
+_kernels_lock = threading.Lock()
+
+_KERNEL_TEMPLATE = '''import math
+
+import numba as nb
+import numpy as np
+
+
+@nb.njit(cache=True, nogil=True, error_model='numpy')
+def kernel({args}):
+    n = a0.shape[0]
+    out = np.empty(n)
+    for r in range(n):
+{body}
+    return out
+'''
+
+
+def _kernel_dir(fuse_kernels):
+    """Get the cache directory of the fuse_kernels option, None if disabled."""
+    if fuse_kernels is None or fuse_kernels is False:
+        return None
+    if fuse_kernels is True:
+        return _KERNEL_CACHE_DIR
+    return os.fspath(fuse_kernels)
+
+
+def _check_kernel_dir(directory):
+    """Create the kernel cache directory, making sure no other user can write to it.
+
+    The sources and the numba cache found in the directory are executed, so
+    a directory owned by another user, or writable by others, is refused.
+
+    """
+    if directory in _checked_dirs:
+        return
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    if hasattr(os, 'getuid'):
+        stat = os.stat(directory)
+        if stat.st_uid != os.getuid() or stat.st_mode & 0o022:
+            raise PermissionError('The kernel cache directory %s should be owned by the current user and not '
+                                  'writable by others, as the kernels found in it are executed.' % directory)
+    _checked_dirs.add(directory)
+
+
+def _kernel_source(n_inputs, lines, result):
+    """Generate the source of a fused elementwise kernel.
+
+    Parameters
+    ----------
+    n_inputs : int
+        The number of input vectors, available as x0, x1, ... in the lines.
+
+    lines : list of str
+        The assignments computing one element of the result, in order.
+
+    result : str
+        The name of the variable holding the element of the result.
+
+    Returns
+    -------
+    source : str
+        The source of a module defining the numba compiled kernel.
+
+    """
+    body = ['x%d = a%d[r]' % (k, k) for k in range(n_inputs)] + lines + ['out[r] = %s' % result]
+    return _KERNEL_TEMPLATE.format(args=', '.join('a%d' % k for k in range(n_inputs)),
+                                   body='\n'.join(' ' * 8 + line for line in body))
+
+
+def _load_kernel(source, directory):
+    """Load a fused kernel, compiling it only if it is not cached yet.
+
+    The source is written to directory under a name derived from its hash, so
+    that numba keeps the compiled kernel next to it and the same expression
+    is not compiled again in later processes. An existing file is only used
+    if it holds the same source.
+
+    Parameters
+    ----------
+    source : str
+        The source generated by _kernel_source.
+
+    directory : str
+        The on-disk cache directory.
+
+    Returns
+    -------
+    key : str
+        The hash of the source.
+
+    kernel : numba dispatcher
+        The compiled kernel.
+
+    """
+    key = hashlib.blake2b(source.encode(), digest_size=16).hexdigest()
+    if key in _kernels:
+        return key, _kernels[key]
+    with _kernels_lock:
+        if key in _kernels:
+            return key, _kernels[key]
+        _check_kernel_dir(directory)
+        name = '_gp_kernel_%s' % key
+        path = os.path.join(directory, name + '.py')
+        if _read_source(path) != source:
+            # 先写入临时文件再改名，避免其他进程读到不完整的源码
+            fd, temp_path = tempfile.mkstemp(suffix='.tmp', dir=directory)
+            with os.fdopen(fd, 'w') as f:
+                f.write(source)
+            os.replace(temp_path, path)
+        spec = importlib.util.spec_from_file_location(name, path)
+        module = importlib.util.module_from_spec(spec)
+        # 注册模块，numba从磁盘缓存加载内核时按模块名查找
+        sys.modules[name] = module
+        spec.loader.exec_module(module)
+        _kernels[key] = module.kernel
+    return key, _kernels[key]
+
+
+def _read_source(path):
+    """Read a cached kernel source, None if it does not exist or cannot be read."""
+    try:
+        with open(path) as f:
+            return f.read()
+    except (OSError, UnicodeDecodeError):
+        return None
@@ -9,13 +9,22 @@
 # @Software :PyCharm
 -------------------------------------------------
 """
-from copy import copy, deepcopy
+from copy import copy
 import numpy as np
 from sklearn.utils.random import sample_without_replacement
 
-from .functions import _Function, _groupby
+from ._cache import _get_buffer_pool
+from ._kernel import _kernel_source, _load_kernel
+from .functions import _Function, _GroupIndex, _segment_apply
 from .utils import check_random_state
 
+# 执行计划中的操作码
+_FEATURE, _CONST, _CALL = 0, 1, 2
+# 紧凑编码中变量和常量节点的编码，函数节点为其在函数表中的位置
+_NODE_FEATURE, _NODE_FLOAT, _NODE_INT = -1, -2, -3
+# 谱系中遗传操作的编码，0表示初代程序
+_GENETIC_METHODS = (None, 'Crossover', 'Subtree Mutation', 'Hoist Mutation', 'Point Mutation', 'Reproduction')
+
 
 class _Program(object):
     """
@@ -40,8 +49,11 @@ class _Program(object):
                  cat_var_number,
                  security_data=None,
                  time_series_data=None,
+                 panel_layout=None,
                  transformer=None,
                  feature_names=None,
+                 simplify=None,
+                 grammar=None,
                  program=None):
 
         self.function_dict = function_dict
@@ -56,10 +68,23 @@ class _Program(object):
         self.data_type = data_type
         self.transformer = transformer
         self.feature_names = feature_names
-        self.program = program
-        self.cat_func_number = cat_var_number
+        # 面板数据的分组索引，每次fit只构建一次
+        if security_data is not None and not isinstance(security_data, _GroupIndex):
+            security_data = _GroupIndex(security_data)
+        if time_series_data is not None and not isinstance(time_series_data, _GroupIndex):
+            time_series_data = _GroupIndex(time_series_data)
         self.security_data = security_data
         self.time_series_data = time_series_data
+        # 稠密面板布局，为None时按长表格式计算
+        self.panel_layout = panel_layout
+        # 化简模式：None不化简，'execute'按化简后的公式执行，'store'直接保存化简后的公式
+        self.simplify = simplify
+        # 函数参数类型的查找表，每次fit只构建一次
+        if grammar is None:
+            grammar = _Grammar(function_dict, arities)
+        self.grammar = grammar
+        self.program = program
+        self.cat_func_number = cat_var_number
 
         self.num_func_number = len(self.function_dict['number'])
         self.cat_func_number = len(self.function_dict['category'])
@@ -70,6 +95,8 @@ class _Program(object):
         else:
             # Create a naive random program
             self.program = self.build_program(random_state)
+        if self.simplify == 'store':
+            self.program = _simplify(self.program, strict=True)
 
         self.raw_fitness_ = None
         self.fitness_ = None
@@ -78,6 +105,82 @@ class _Program(object):
         self._max_samples = None
         self._indices_state = None
 
+    def __getstate__(self):
+        # 执行计划不参与序列化，在使用时重新编译
+        state = self.__dict__.copy()
+        state['_signatures'] = None
+        state['_plan'] = None
+        state['_kernel_plan'] = None
+        return state
+
+    # 紧凑编码
+    def to_compact(self, function_index):
+        """Encode the program as flat arrays.
+
+        Parameters
+        ----------
+        function_index : dict
+            Maps the id of each function in the function table to its code.
+
+        Returns
+        -------
+        codes : array, dtype int32
+            The function code of each node, or a negative code for features,
+            float constants and int constants.
+
+        args : array, dtype int32
+            The feature index of feature nodes and the position in the
+            constant pool of constant nodes.
+
+        constants : array, dtype float64
+            The constant pool of the program.
+
+        """
+        codes = np.empty(len(self.program), dtype=np.int32)
+        args = np.zeros(len(self.program), dtype=np.int32)
+        constants = []
+        for i, node in enumerate(self.program):
+            if isinstance(node, _Function):
+                codes[i] = function_index[id(node)]
+            elif isinstance(node, str):
+                codes[i] = _NODE_FEATURE
+                args[i] = int(node)
+            else:
+                codes[i] = _NODE_INT if isinstance(node, (int, np.integer)) else _NODE_FLOAT
+                args[i] = len(constants)
+                constants.append(node)
+        return codes, args, np.array(constants, dtype=np.float64)
+
+    @classmethod
+    def from_compact(cls, codes, args, constants, function_table, **params):
+        """Build a program from the arrays returned by `to_compact`."""
+        return cls(program=_decode_nodes(codes, args, constants, function_table), random_state=None, **params)
+
+    def with_data(self, security_data=None, time_series_data=None, panel_layout=None):
+        """Get a copy of the program executing on other data.
+
+        The copy shares the tree and signatures with the program, only the
+        panel grouping of its functions is rebuilt for the new data.
+
+        """
+        program = copy(self)
+        program.security_data = security_data
+        program.time_series_data = time_series_data
+        program.panel_layout = panel_layout
+        program._plan = None
+        program._kernel_plan = None
+        return program
+
+    def _get_program(self):
+        return self._program
+
+    def _set_program(self, program):
+        # 修改树结构后原有的执行计划失效
+        self._program = program
+        self._signatures = None
+        self._plan = None
+        self._kernel_plan = None
+
     def build_program(self, random_state):
         """
         参数中无program 初始化方法
@@ -96,54 +199,49 @@ class _Program(object):
         function = random_state.randint(len(self.function_dict['number']))
         function = self.function_dict['number'][function]
 
+        # 栈中保存各函数尚未填充的参数槽位，槽位信息来自预先构建的查找表
+        slots = self.grammar.slots
         program = [function]
-        terminal_stack = [deepcopy(function.param_type)]
+        terminal_stack = [list(slots[function.signature])]
+        n_functions = self.num_func_number + self.cat_func_number
 
         while terminal_stack:
             depth = len(terminal_stack)
-            choice = self.n_features + self.num_func_number + self.cat_func_number
-            choice = random_state.randint(choice)
+            choice = random_state.randint(self.n_features + n_functions)
             # Determine if we are adding a function or terminal
-            if not isinstance(terminal_stack[-1], list):
-                raise ValueError("element in terminal_stack should be list")
-            if not isinstance(terminal_stack[-1][0], dict):
-                raise ValueError("element in terminal_stack'element should be dict")
+            vector, number, category, scalar, constant = terminal_stack[-1][0]
             # 插入函数的情况
-            if ('vector' in terminal_stack[-1][0]) and (depth < max_depth) \
-                    and (method == 'full' or choice <= (self.num_func_number + self.cat_func_number)):
+            if vector and (depth < max_depth) and (method == 'full' or choice <= n_functions):
                 # 必须可接收向量且深度未满
-                _choice = random_state.randint(self.cat_func_number + self.num_func_number)
-                if 'number' in terminal_stack[-1][0]['vector'] and 'category' in terminal_stack[-1][0]['vector']:
+                _choice = random_state.randint(n_functions)
+                if number and category:
                     key = 'number' if _choice < self.num_func_number else 'category'
                 else:
-                    key = 'number' if 'number' in terminal_stack[-1][0]['vector'] else 'category'
+                    key = 'number' if number else 'category'
                 function = self.function_dict[key][_choice %
                                                    (self.num_func_number if key == 'number' else self.cat_func_number)]
                 program.append(function)
-                terminal_stack.append(deepcopy(function.param_type))
+                terminal_stack.append(list(slots[function.signature]))
             else:
                 # 插入变量或者常量
                 terminal = random_state.randint(self.n_features + 1)
                 # 特殊情况调整
-                if terminal == self.n_features and \
-                        ((self.const_range is None) or \
-                        (('scalar') not in terminal_stack[-1][0])):
+                if terminal == self.n_features and ((self.const_range is None) or not scalar):
                     # 只能插入向量的情况
-                    if 'vector' not in terminal_stack[-1][0]:
+                    if not vector:
                         raise ValueError('Error param type {}'.format(terminal_stack[-1][0]))
 
                     terminal = random_state.randint(self.n_features)
-                elif ('vector' not in terminal_stack[-1][0]):
+                elif not vector:
                     # 只能插入常量的情况
                     terminal = self.n_features
 
                 if terminal < self.n_features:
                     # 插入变量
-                    if 'number' in terminal_stack[-1][0]['vector'] and 'category' in terminal_stack[-1][0][
-                        'vector']:
+                    if number and category:
                         key = 'category' if terminal < self.cat_func_number else 'number'
                     else:
-                        key = 'number' if 'number' in terminal_stack[-1][0]['vector'] else 'category'
+                        key = 'number' if number else 'category'
                     if self.cat_func_number == 0 and key == 'category':
                         raise ValueError("There no category var in input features, but it need")
                     candicate_var = (terminal % self.cat_func_number) if key == 'category' else \
@@ -151,12 +249,13 @@ class _Program(object):
                     program.append(str(candicate_var))
                 else:
                     # 插入常量量
-                    if 'float' in terminal_stack[-1][0]['scalar']:
-                        terminal = random_state.uniform(*terminal_stack[-1][0]['scalar']['float'])
-                    elif 'int' in terminal_stack[-1][0]['scalar']:
-                        terminal = random_state.randint(*terminal_stack[-1][0]['scalar']['int'])
-                    else:
+                    if constant is None:
                         raise ValueError('Error param type {}'.format(terminal_stack[-1][0]))
+                    kind, low, high = constant
+                    if kind == 'float':
+                        terminal = random_state.uniform(low, high)
+                    else:
+                        terminal = random_state.randint(low, high)
                     program.append(terminal)
 
                 terminal_stack[-1].pop(0)
@@ -301,8 +400,116 @@ class _Program(object):
         """Calculates the number of functions and terminals in the program."""
         return len(self.program)
 
+    # 计算每个节点对应子树的标识和子树终点，用于子树缓存
+    def _subtree_signatures(self):
+        """Get the canonical signature and end index of each node's subtree.
+
+        Returns
+        -------
+        signatures : list of str
+            The canonical signature of the subtree rooted at each node, built
+            from the function identity, the child signatures and constants.
+
+        ends : list of int
+            The index following the last node of each node's subtree.
+
+        """
+        if self._signatures is None:
+            self._signatures = _signatures(self.program)
+        return self._signatures
+
+    # 编译为后缀执行计划
+    def _compile(self, kernel_dir=None):
+        """Compile the program into a postfix execution plan.
+
+        The plan is cached on the program and is only rebuilt when the
+        program list is replaced.
+
+        Parameters
+        ----------
+        kernel_dir : str, optional (default=None)
+            When given, elementwise subtrees are replaced by fused numba
+            kernels cached in this directory.
+
+        Returns
+        -------
+        codes : list of int
+            The opcode of each step, in postfix order.
+
+        operands : list
+            The column index of feature steps, the value of constant steps and
+            a (function, arity, groups, broadcast) tuple for function steps,
+            where groups is the panel grouping the function is applied over,
+            if any, and broadcast lists the arguments holding scalars that
+            have to be expanded to vectors before the call.
+
+        signatures : list of str
+            The canonical subtree signature of each step.
+
+        skips : list of list
+            For each step, the (signature, next step) pairs of the function
+            subtrees starting at that step, largest first.
+
+        """
+        if kernel_dir is not None:
+            if self._kernel_plan is None or self._kernel_plan[0] != kernel_dir:
+                program = self.program if self.simplify is None else _simplify(self.program)
+                program = _fuse(program, kernel_dir)
+                self._kernel_plan = (kernel_dir, self._build_plan(program, *_signatures(program)))
+            return self._kernel_plan[1]
+        if self._plan is None:
+            if self.simplify is not None:
+                # 按化简后的公式执行
+                program = _simplify(self.program)
+                self._plan = self._build_plan(program, *_signatures(program))
+            else:
+                self._plan = self._build_plan(self.program, *self._subtree_signatures())
+        return self._plan
+
+    def _build_plan(self, program, signatures, ends):
+        """Build the execution plan of a program given its subtree signatures."""
+        # 子树结束位置升序即为后缀顺序，同一位置结束时子节点在前
+        order = sorted(range(len(program)), key=lambda i: (ends[i], -i))
+        codes = []
+        operands = []
+        skips = [[] for _ in order]
+        # 记录每个节点的结果是否为常数
+        scalar = [False] * len(program)
+        for position, i in enumerate(order):
+            node = program[i]
+            if isinstance(node, _Function):
+                # 对于时序和截面函数预先确定分组
+                groups = None
+                if self.data_type == 'panel' and node.function_type == 'section':
+                    groups = (self.time_series_data if self.panel_layout is None
+                              else self.panel_layout.section_groups)
+                elif self.data_type == 'panel' and node.function_type == 'time_series':
+                    groups = (self.security_data if self.panel_layout is None
+                              else self.panel_layout.time_series_groups)
+                # 常数只在函数无法直接接收时才广播为向量
+                children = [i + 1]
+                while len(children) < node.arity:
+                    children.append(ends[children[-1]])
+                broadcast = tuple(k for k, child in enumerate(children)
+                                  if scalar[child] and 'vector' in node.param_type[k]
+                                  and not node.accept_scalar)
+                scalar[i] = (groups is None and node.accept_scalar and
+                             all(scalar[child] for child in children))
+                codes.append(_CALL)
+                operands.append((node, node.arity, groups, broadcast))
+                start = position - (ends[i] - i) + 1
+                skips[start].insert(0, (signatures[i], position + 1))
+            elif isinstance(node, str):
+                codes.append(_FEATURE)
+                operands.append(int(node))
+            else:
+                codes.append(_CONST)
+                operands.append(node)
+                scalar[i] = True
+        return codes, operands, [signatures[i] for i in order], skips
+
     # 计算参数X的函数结果
-    def execute(self, X):
+    def execute(self, X, cache=None, kernel_dir=None, shards=None):
         """Execute the program according to X.
 
         Parameters
@@ -311,51 +518,165 @@ class _Program(object):
             Training vectors, where n_samples is the number of samples and
             n_features is the number of features.
 
+        cache : _SubtreeCache, optional (default=None)
+            A cache of subtree results computed on the same X. Known subtrees
+            are read from it instead of being evaluated and newly evaluated
+            subtrees are added to it.
+
+        kernel_dir : str, optional (default=None)
+            When given, elementwise subtrees are evaluated by fused numba
+            kernels, compiled once and cached in this directory. Results of
+            transcendental functions may differ from numpy in the last bits.
+
+        shards : _PanelShards, optional (default=None)
+            For panel data, the shards of the rows the program is evaluated
+            on, in parallel. The cache is not used in that case.
+
         Returns
         -------
         y_hats : array-like, shape = [n_samples]
             The result of executing the program on X.
 
         """
-        # Check for single-node programs
-        node = self.program[0]
-        # 常数
-        if isinstance(node, (float, int)):
-            return np.repeat(node, X.shape[0])
-        # 变量
-        if isinstance(node, str):
-            return X[:, int(node)]
-
-        apply_stack = []
-        for node in self.program:
-
-            if isinstance(node, _Function):
-                apply_stack.append([node])
+        codes, operands, signatures, skips = self._compile(kernel_dir)
+        n_samples = X.shape[0]
+        n_steps = len(codes)
+        # 单常数公式
+        if n_steps == 1 and codes[0] == _CONST:
+            return np.full(n_samples, operands[0])
+        if self.panel_layout is not None:
+            # 在稠密面板上计算，最后转换回长表
+            X = self.panel_layout.to_dense(X)
+        n_rows = X.shape[0]
+        if shards is not None:
+            if shards.n_rows != n_rows:
+                raise ValueError('The shards cover %d rows, the data has %d.' % (shards.n_rows, n_rows))
+            result = self._execute_sharded(X, shards, codes, operands)
+            if self.panel_layout is not None:
+                result = self.panel_layout.to_long(result)
+            if np.ndim(result) == 0:
+                return np.full(n_samples, result)
+            return result
+        # 中间结果优先写入缓冲池中的缓冲区，owned记录栈上属于缓冲池的结果
+        pool = _get_buffer_pool()
+        owned = set()
+        stack = []
+        i = 0
+        while i < n_steps:
+            if cache is not None and skips[i]:
+                # 命中缓存，跳过整棵子树
+                for signature, next_step in skips[i]:
+                    result = cache.get(signature)
+                    if result is not None:
+                        break
+                if result is not None:
+                    stack.append(result)
+                    i = next_step
+                    continue
+            code = codes[i]
+            if code == _FEATURE:
+                stack.append(X[:, operands[i]])
+            elif code == _CONST:
+                stack.append(operands[i])
             else:
-                # Lazily evaluate later
-                apply_stack[-1].append(node)
-
-            while len(apply_stack[-1]) == apply_stack[-1][0].arity + 1:
-                # Apply functions that have sufficient arguments
-                function = apply_stack[-1][0]
-                terminals = [np.repeat(t, X.shape[0]) if isinstance(t, (float, int))
-                             else (X[:, int(t)] if isinstance(t, str)
-                             else t) for t in apply_stack[-1][1:]]
-                # 对于时序和截面函数加入管道
-                if self.data_type == 'panel' and function.function_type == 'section':
-                    intermediate_result = _groupby(self.time_series_data, function, *terminals)
-                elif self.data_type == 'panel' and function.function_type == 'time_series':
-                    intermediate_result = _groupby(self.security_data, function, *terminals)
-                else:
-                    intermediate_result = function(*terminals)
-                if len(apply_stack) != 1:
-                    apply_stack.pop()
-                    apply_stack[-1].append(intermediate_result)
+                function, arity, groups, broadcast = operands[i]
+                terminals = stack[-arity:]
+                del stack[-arity:]
+                for k in broadcast:
+                    terminals[k] = np.full(n_rows, terminals[k])
+                out = None
+                if groups is None and function.accept_out:
+                    dtype = np.result_type(*terminals)
+                    if dtype.kind == 'f' and any(np.ndim(terminal) for terminal in terminals):
+                        # 直接覆盖不再需要的参数，否则从缓冲池中取
+                        out = next((terminal for terminal in terminals if id(terminal) in owned
+                                    and terminal.dtype == dtype), None)
+                        if out is None:
+                            out = pool.get(n_rows, dtype)
+                            owned.add(id(out))
+                if out is not None:
+                    result = function(*terminals, out=out)
+                elif groups is None:
+                    result = function(*terminals)
                 else:
-                    return intermediate_result
-
-        # We should never get here
-        return None
+                    result = _segment_apply(groups, function, *terminals)
+                # 参数的生命周期在此结束，归还缓冲区
+                for terminal in terminals:
+                    if id(terminal) in owned and terminal is not result:
+                        owned.discard(id(terminal))
+                        if np.may_share_memory(terminal, result):
+                            # 自定义函数返回了参数的视图
+                            pool.detach(terminal)
+                        else:
+                            pool.release(terminal)
+                if cache is not None and cache.put(signatures[i], result) and id(result) in owned:
+                    # 缓存中的结果不能再被覆盖
+                    owned.discard(id(result))
+                    pool.detach(result)
+                stack.append(result)
+            i += 1
+
+        result = stack[-1]
+        if id(result) in owned:
+            if self.panel_layout is not None:
+                dense = result
+                result = self.panel_layout.to_long(dense)
+                pool.release(dense)
+            else:
+                # 最终结果交给调用方
+                pool.detach(result)
+        elif self.panel_layout is not None:
+            result = self.panel_layout.to_long(result)
+        if np.ndim(result) == 0:
+            # 全部由常数构成的公式
+            return np.full(n_samples, result)
+        return result
+
+    def _execute_sharded(self, X, shards, codes, operands):
+        """Execute a compiled program shard by shard, see `_PanelShards`."""
+        kinds = _shard_kinds(codes, operands)
+        # 栈上的元素为(分片类型, 值)，完整向量和常数的分片类型为None
+        stack = []
+        for i, code in enumerate(codes):
+            if code == _FEATURE:
+                stack.append((None, X[:, operands[i]]))
+                continue
+            if code == _CONST:
+                stack.append((None, operands[i]))
+                continue
+            function, arity, groups, broadcast = operands[i]
+            terminals = stack[-arity:]
+            del stack[-arity:]
+            if groups is None and not broadcast and all(kind is None and np.ndim(value) == 0
+                                                        for kind, value in terminals):
+                # 只含常数的子树
+                stack.append((None, function(*[value for _, value in terminals])))
+                continue
+            # 逐元素函数沿用参数的分片方式
+            kind = kinds[i] or next((kind for kind, _ in terminals if kind is not None), 'section')
+            parts = []
+            for k, (terminal_kind, value) in enumerate(terminals):
+                if terminal_kind is not None and terminal_kind != kind:
+                    # 在时序和截面函数之间切换，重新分片
+                    value = shards.gather(value, terminal_kind)
+                    shards.n_reshuffles += 1
+                    terminal_kind = None
+                if terminal_kind is None:
+                    value = shards.split(value, kind, broadcast=k in broadcast)
+                parts.append(value)
+            local_groups = [local for _, local in shards.shards[kind]]
+
+            def task(shard, function=function, groups=groups, parts=parts, local_groups=local_groups):
+                args = [part[shard] for part in parts]
+                if groups is None:
+                    return function(*args)
+                return _segment_apply(local_groups[shard], function, *args)
+
+            stack.append((kind, shards.map(task, kind, getattr(function, 'thread_safe', True))))
+        kind, result = stack[-1]
+        if kind is not None:
+            result = shards.gather(result, kind)
+        return result
 
     # 选择部分样本
     def get_all_indices(self, n_samples=None, max_samples=None,
@@ -411,7 +732,7 @@ class _Program(object):
         return self.get_all_indices()[0]
 
     # 原始适应度
-    def raw_fitness(self, X, y, sample_weight):
+    def raw_fitness(self, X, y, sample_weight, cache=None, shards=None):
         """Evaluate the raw fitness of the program according to X, y.
 
         Parameters
@@ -426,19 +747,70 @@ class _Program(object):
         sample_weight : array-like, shape = [n_samples]
             Weights applied to individual samples.
 
+        cache : _SubtreeCache, optional (default=None)
+            A cache of subtree results computed on the same X.
+
+        shards : _PanelShards, optional (default=None)
+            The shards to evaluate panel data in parallel, see `execute`.
+
         Returns
         -------
         raw_fitness : float
             The raw fitness of the program.
 
         """
-        y_pred = self.execute(X)
+        y_pred = self.execute(X, cache, shards=shards)
         if self.transformer:
             y_pred = self.transformer(y_pred)
+        if self.metric.panel:
+            # 面板指标按日期计算
+            return self.metric(y, y_pred, sample_weight, self.time_series_data)
         raw_fitness = self.metric(y, y_pred, sample_weight)
 
         return raw_fitness
 
+    # 样本内外适应度共用一次计算结果
+    def raw_fitness_oob(self, X, y, sample_weight, oob_sample_weight, cache=None, shards=None):
+        """Evaluate the in-sample and out-of-bag raw fitness from one execution.
+
+        Parameters
+        ----------
+        X : {array-like}, shape = [n_samples, n_features]
+            Training vectors, where n_samples is the number of samples and
+            n_features is the number of features.
+
+        y : array-like, shape = [n_samples]
+            Target values.
+
+        sample_weight : array-like, shape = [n_samples]
+            Weights of the in-sample rows, zero for out-of-bag rows.
+
+        oob_sample_weight : array-like, shape = [n_samples]
+            Weights of the out-of-bag rows, zero for in-sample rows.
+
+        cache : _SubtreeCache, optional (default=None)
+            A cache of subtree results computed on the same X.
+
+        shards : _PanelShards, optional (default=None)
+            The shards to evaluate panel data in parallel, see `execute`.
+
+        Returns
+        -------
+        raw_fitness : float
+            The raw fitness of the program on the in-sample rows.
+
+        oob_fitness : float
+            The raw fitness of the program on the out-of-bag rows.
+
+        """
+        y_pred = self.execute(X, cache, shards=shards)
+        if self.transformer:
+            y_pred = self.transformer(y_pred)
+        if self.metric.panel:
+            return (self.metric(y, y_pred, sample_weight, self.time_series_data),
+                    self.metric(y, y_pred, oob_sample_weight, self.time_series_data))
+        return self.metric(y, y_pred, sample_weight), self.metric(y, y_pred, oob_sample_weight)
+
     # todo 引入非线性适应度
     # 惩罚后适应度 对函数长度进行惩罚
     def fitness(self, parsimony_coefficient=None):
@@ -626,9 +998,8 @@ class _Program(object):
         tag = np.array([True] * len(mutate))
         for i, node in enumerate(mutate):
             if isinstance(program[node], _Function):
-                arity = program[node].arity
                 # Find a valid replacement with same arity
-                replacement_list = [func_ for func_ in self.arities[arity] if program[node].is_point_mutation(func_)]
+                replacement_list = self.grammar.replacements[program[node].signature]
                 if len(replacement_list) == 0:
                     # 没有满足条件的变异
                     tag[i] = False
@@ -647,6 +1018,666 @@ class _Program(object):
             mutate = mutate[tag]
         return program, list(mutate)
 
+    program = property(_get_program, _set_program)
     depth_ = property(_depth)
     length_ = property(_length)
     indices_ = property(_indices)
+
+
+class _Grammar(object):
+    """Type constraints of a function set compiled into lookup tables.
+
+    Parameters
+    ----------
+    function_dict : dict
+        The 'number' and 'category' functions of the fit, with their
+        constant ranges already added.
+
+    arities : dict
+        The functions of the fit grouped by arity.
+
+    Attributes
+    ----------
+    slots : dict
+        For each function signature, one (vector, number, category, scalar,
+        constant) tuple per parameter: whether the parameter accepts vectors,
+        number vectors, category vectors and scalars, and the (kind, low,
+        high) range constants are drawn from, None if it takes no constant.
+
+    replacements : dict
+        For each function signature, the functions of the same arity it can
+        be replaced by in a point mutation, in the order of arities.
+
+    """
+
+    def __init__(self, function_dict, arities):
+        functions = function_dict['number'] + function_dict['category']
+        self.slots = {function.signature: tuple(_slot(param_type) for param_type in function.param_type)
+                      for function in functions}
+        self.replacements = {function.signature: [candidate for candidate in arities[function.arity]
+                                                  if function.is_point_mutation(candidate)]
+                             for function in functions}
+
+
+def _slot(param_type):
+    vector = param_type.get('vector', {})
+    scalar = param_type.get('scalar')
+    constant = None
+    if scalar is not None and 'float' in scalar:
+        constant = ('float',) + tuple(scalar['float'])
+    elif scalar is not None and 'int' in scalar:
+        constant = ('int',) + tuple(scalar['int'])
+    return 'vector' in param_type, 'number' in vector, 'category' in vector, scalar is not None, constant
+
+
+def _shard_kinds(codes, operands):
+    """Get the kind of shards each function step of a compiled program runs on.
+
+    Section and time series functions need shards of whole dates or whole
+    securities. Elementwise functions take the kind of the nearest such
+    function consuming their result, so that the arguments of that function
+    are already split the right way, or None when there is none.
+
+    """
+    consumers = [None] * len(codes)
+    stack = []
+    for i, code in enumerate(codes):
+        if code == _CALL:
+            arity = operands[i][1]
+            for child in stack[-arity:]:
+                consumers[child] = i
+            del stack[-arity:]
+        stack.append(i)
+    kinds = [None] * len(codes)
+    for i in reversed(range(len(codes))):
+        if codes[i] != _CALL:
+            continue
+        function, _, groups, _ = operands[i]
+        if groups is not None:
+            kinds[i] = function.function_type
+        elif consumers[i] is not None:
+            kinds[i] = kinds[consumers[i]]
+    return kinds
+
+
+def _signatures(program):
+    """Get the canonical signature and end index of each node's subtree."""
+    signatures = [None] * len(program)
+    ends = [None] * len(program)
+    # 逆序遍历，栈顶为当前函数的第一个参数
+    stack = []
+    for i in range(len(program) - 1, -1, -1):
+        node = program[i]
+        if isinstance(node, _Function):
+            children = [stack.pop() for _ in range(node.arity)]
+            signatures[i] = '%s(%s)' % (node.signature,
+                                        ','.join(signatures[c] for c in children))
+            ends[i] = ends[children[-1]]
+        else:
+            if isinstance(node, str):
+                signatures[i] = 'X%s' % node
+            else:
+                signatures[i] = repr(node)
+            ends[i] = i + 1
+        stack.append(i)
+    return signatures, ends
+
+
+def _simplify(program, strict=False):
+    """Simplify a program with the algebraic rules declared on its functions.
+
+    Constant subtrees of elementwise functions accepting scalars are folded,
+    commutative arguments are sorted by signature, and involutions,
+    idempotent functions, self values of constant arguments and composable
+    functions are collapsed, bottom up, so that the simplified program gives
+    the same output, nan and infinite values included.
+
+    Parameters
+    ----------
+    program : list
+        The flattened tree representation of the program.
+
+    strict : bool, optional (default=False)
+        Whether the result has to remain a valid program to evolve: the root
+        stays a function, constants only replace subtrees in parameters
+        accepting scalars and composed int parameters stay within range.
+
+    Returns
+    -------
+    program : list
+        The flattened tree representation of the simplified program.
+
+    """
+    # 子树表示为(节点, 子树列表, 标识)，同时保留化简前后的子树
+    stack = []
+    for node in reversed(program):
+        if not isinstance(node, _Function):
+            leaf = (node, [], 'X%s' % node if isinstance(node, str) else repr(node))
+            stack.append((leaf, leaf))
+            continue
+        children = [stack.pop() for _ in range(node.arity)]
+        original = (node, [child[1] for child in children],
+                    '%s(%s)' % (node.signature, ','.join(child[1][2] for child in children)))
+        stack.append((_simplify_node(node, children, strict), original))
+    root = stack[0][0]
+    if strict and not isinstance(root[0], _Function):
+        return program
+    result = []
+    stack = [root]
+    while stack:
+        node, children, _ = stack.pop()
+        result.append(node)
+        stack.extend(reversed(children))
+    return result
+
+
+def _is_constant(subtree):
+    return not isinstance(subtree[0], (_Function, str))
+
+
+def _simplify_node(function, children, strict):
+    """Simplify one function node given its (simplified, original) children."""
+    if strict:
+        # 不接受常数的参数保留化简前的子树
+        children = [simplified if not _is_constant(simplified) or 'scalar' in param_type
+                    or _is_constant(original) else original
+                    for (simplified, original), param_type in zip(children, function.param_type)]
+    else:
+        children = [simplified for simplified, _ in children]
+    if all(_is_constant(child) for child in children) and function.accept_scalar \
+            and function.function_type == 'all':
+        # 常数折叠，与执行时按常数计算的结果一致
+        with np.errstate(all='ignore'):
+            value = function(*[child[0] for child in children])
+        if np.ndim(value) == 0 and np.isfinite(value):
+            value = float(value)
+            return value, [], repr(value)
+    if function.commutative:
+        children = sorted(children, key=lambda child: child[2])
+    if function.arity == 1 and children[0][0] is function:
+        if function.involution:
+            return children[0][1][0]
+        if function.idempotent:
+            return children[0]
+    if function.arity == 2 and children[0][2] == children[1][2]:
+        # x为nan或inf时f(x, x)一般为nan，只对常数参数取其值
+        if function.self_value is not None and _is_constant(children[0]):
+            value = float(function.self_value)
+            return value, [], repr(value)
+        if function.idempotent:
+            return children[0]
+    if function.compose == 'add' and children[0][0] is function:
+        inner, d_inner = children[0][1]
+        d = int(d_inner[0]) + int(children[1][0])
+        low, high = function.param_type[1]['scalar']['int']
+        if not strict or ((low is None or d >= low) and (high is None or d <= high)):
+            children = [inner, (d, [], repr(d))]
+    return (function, children,
+            '%s(%s)' % (function.signature, ','.join(child[2] for child in children)))
+
+
+def _fuse(program, kernel_dir):
+    """Replace the elementwise subtrees of a program by fused kernels.
+
+    Every maximal subtree of at least two functions declaring a kernel
+    expression is compiled into a single numba kernel, which makes one pass
+    over the rows without allocating intermediate arrays. Its inputs are the
+    distinct features and other subtrees it reads, which are evaluated as
+    before.
+
+    Parameters
+    ----------
+    program : list
+        The flattened tree representation of the program.
+
+    kernel_dir : str
+        The on-disk cache directory of the compiled kernels.
+
+    Returns
+    -------
+    program : list
+        The flattened tree representation of the program, where the fused
+        subtrees are replaced by _Function nodes calling the kernels.
+
+    """
+    signatures, ends = _signatures(program)
+
+    def children(i):
+        positions = [i + 1]
+        while len(positions) < program[i].arity:
+            positions.append(ends[positions[-1]])
+        return positions
+
+    def fusible(i):
+        return isinstance(program[i], _Function) and program[i].kernel is not None
+
+    def literal(i):
+        node = program[i]
+        return (not isinstance(node, (_Function, str)) and np.ndim(node) == 0
+                and np.isfinite(node))
+
+    def generate(i, lines, inputs):
+        # 生成子树每个元素的计算语句，返回结果变量名
+        args = []
+        for child in children(i):
+            if fusible(child):
+                args.append(generate(child, lines, inputs))
+            elif literal(child):
+                node = program[child]
+                args.append(repr(int(node) if isinstance(node, (int, np.integer)) else float(node)))
+            else:
+                # 相同的输入只读取一次
+                inputs.setdefault(signatures[child], (len(inputs), child))
+                args.append('x%d' % inputs[signatures[child]][0])
+        lines.append('v%d = %s' % (len(lines), program[i].kernel.format(*args)))
+        return 'v%d' % (len(lines) - 1)
+
+    result = []
+
+    def emit(i):
+        if fusible(i):
+            lines, inputs = [], {}
+            variable = generate(i, lines, inputs)
+            # 只融合至少两个函数且读取向量的子树
+            if len(lines) > 1 and inputs:
+                key, kernel = _load_kernel(_kernel_source(len(inputs), lines, variable), kernel_dir)
+                result.append(_Function(function=kernel, name='fused_%s' % key,
+                                        arity=len(inputs), accept_scalar=False))
+                for _, child in sorted(inputs.values()):
+                    emit(child)
+                return
+        result.append(program[i])
+        if isinstance(program[i], _Function):
+            for child in children(i):
+                emit(child)
+
+    emit(0)
+    return result
+
+
+def _function_table(function_dict):
+    """Get the functions of a fit in the fixed order used by the compact encoding."""
+    return function_dict['number'] + function_dict['category']
+
+
+def _decode_nodes(codes, args, constants, function_table):
+    """Decode the arrays of `_Program.to_compact` into a program list."""
+    program = []
+    for code, arg in zip(codes.tolist(), args.tolist()):
+        if code >= 0:
+            program.append(function_table[code])
+        elif code == _NODE_FEATURE:
+            program.append(str(arg))
+        elif code == _NODE_INT:
+            program.append(int(constants[arg]))
+        else:
+            program.append(float(constants[arg]))
+    return program
+
+
+class _Genealogy(object):
+    """Array storage of how the programs of one generation were bred.
+
+    The genome dicts of the programs (method, parent and donor index, and the
+    nodes of the parent and donor that did not make it into the offspring)
+    are kept as a few flat arrays, the nodes as ranges of consecutive node
+    indices. Genomes are rebuilt as dicts when accessed by index.
+
+    Parameters
+    ----------
+    genomes : iterable of dict or None
+        The `parents` attribute of each program, None for programs of the
+        initial generation.
+
+    Attributes
+    ----------
+    method : array, dtype int8
+        The position of the genetic operation in _GENETIC_METHODS.
+
+    parent, donor : array, dtype int32
+        The index of the parent and donor in the previous generation, -1 if
+        none.
+
+    """
+
+    def __init__(self, genomes):
+        method = []
+        parent = []
+        donor = []
+        node_ranges = {'parent': [], 'donor': []}
+        for genome in genomes:
+            genome = genome or {}
+            method.append(_GENETIC_METHODS.index(genome.get('method')))
+            parent.append(genome.get('parent_idx', -1))
+            donor.append(genome.get('donor_idx', -1))
+            for role in ('parent', 'donor'):
+                node_ranges[role].append(_node_ranges(genome.get(role + '_nodes', ())))
+        self.method = np.array(method, dtype=np.int8)
+        self.parent = np.array(parent, dtype=np.int32)
+        self.donor = np.array(donor, dtype=np.int32)
+        for role in ('parent', 'donor'):
+            ranges = node_ranges[role]
+            setattr(self, role + '_offsets', np.cumsum([0] + [len(r) for r in ranges]).astype(np.int64))
+            setattr(self, role + '_ranges', np.array([bound for r in ranges for bound in r],
+                                                     dtype=np.int32).reshape(-1, 2))
+
+    def __len__(self):
+        return len(self.method)
+
+    def __getitem__(self, index):
+        method = _GENETIC_METHODS[self.method[index]]
+        if method is None:
+            return None
+        genome = {'method': method,
+                  'parent_idx': int(self.parent[index]),
+                  'parent_nodes': self._nodes('parent', index)}
+        if self.donor[index] >= 0:
+            genome['donor_idx'] = int(self.donor[index])
+            genome['donor_nodes'] = self._nodes('donor', index)
+        return genome
+
+    def _nodes(self, role, index):
+        offsets = getattr(self, role + '_offsets')
+        ranges = getattr(self, role + '_ranges')[offsets[index]:offsets[index + 1]]
+        return [node for start, end in ranges.tolist() for node in range(start, end)]
+
+    def subset(self, indices):
+        """Get the genealogy of some programs, in the given order."""
+        genealogy = copy(self)
+        genealogy.method = self.method[indices]
+        genealogy.parent = self.parent[indices]
+        genealogy.donor = self.donor[indices]
+        for role in ('parent', 'donor'):
+            offsets = getattr(self, role + '_offsets')
+            ranges = getattr(self, role + '_ranges')
+            pieces = [ranges[offsets[index]:offsets[index + 1]] for index in indices]
+            setattr(genealogy, role + '_offsets',
+                    np.cumsum([0] + [len(piece) for piece in pieces]).astype(np.int64))
+            setattr(genealogy, role + '_ranges', np.concatenate([ranges[:0]] + pieces))
+        return genealogy
+
+    def shift(self, offset):
+        """Move the parent and donor indices, for programs bred from a slice of the previous generation."""
+        self.parent[self.parent >= 0] += offset
+        self.donor[self.donor >= 0] += offset
+
+    @classmethod
+    def concatenate(cls, genealogies):
+        """Join the genealogies of consecutive groups of programs."""
+        genealogy = copy(genealogies[0])
+        genealogy.method = np.concatenate([g.method for g in genealogies])
+        genealogy.parent = np.concatenate([g.parent for g in genealogies])
+        genealogy.donor = np.concatenate([g.donor for g in genealogies])
+        for role in ('parent', 'donor'):
+            offsets = [getattr(g, role + '_offsets') for g in genealogies]
+            ranges = [getattr(g, role + '_ranges') for g in genealogies]
+            setattr(genealogy, role + '_offsets',
+                    np.concatenate([offsets[0][:1]] + [o[1:] + sum(len(r) for r in ranges[:i])
+                                                       for i, o in enumerate(offsets)]))
+            setattr(genealogy, role + '_ranges', np.concatenate(ranges))
+        return genealogy
+
+    def reference_counts(self, indices, n_parents):
+        """Count how many of the given programs were bred from each program of the previous generation."""
+        counts = np.zeros(n_parents, dtype=np.int32)
+        for related in (self.parent[indices], self.donor[indices]):
+            counts += np.bincount(related[related >= 0], minlength=n_parents).astype(np.int32)
+        return counts
+
+
+def _node_ranges(nodes):
+    """Encode node indices as (start, end) pairs of consecutive indices."""
+    if isinstance(nodes, range):
+        return [(nodes.start, nodes.stop)] if len(nodes) else []
+    ranges = []
+    for node in sorted(nodes):
+        if ranges and ranges[-1][1] == node:
+            ranges[-1] = (ranges[-1][0], node + 1)
+        else:
+            ranges.append((node, node + 1))
+    return ranges
+
+
+def _prune_ancestors(generations):
+    """Prune the programs of earlier generations without descendants in the last one.
+
+    Every population counts how many programs of the next generation were
+    bred from each of its programs. Only the counts of the generation before
+    the last one are computed from scratch, earlier counts are decreased by
+    the programs just pruned, going back until a generation loses no program.
+    The genealogy of pruned programs is kept.
+
+    Parameters
+    ----------
+    generations : list of _Population or None
+        All generations of the fit, None for generations that are not kept.
+
+    """
+    pruned = None
+    for gen in range(len(generations) - 1, 0, -1):
+        children, parents = generations[gen], generations[gen - 1]
+        if parents is None:
+            break
+        if pruned is None:
+            parents._references = children.genealogy.reference_counts(np.flatnonzero(children._alive),
+                                                                       len(parents))
+        elif getattr(parents, '_references', None) is None:
+            break
+        else:
+            parents._references -= children.genealogy.reference_counts(pruned, len(parents))
+        pruned = np.flatnonzero(parents._alive & (parents._references == 0))
+        if not len(pruned):
+            break
+        parents.prune(pruned)
+
+
+class _Population(object):
+    """Contiguous array storage of the programs of one generation.
+
+    The programs are kept in their compact encoding, concatenated into a few
+    flat arrays together with their fitness, and are only rebuilt as
+    `_Program` objects when accessed by index. Pruned programs read as None,
+    the genealogy of all programs is kept in `genealogy`.
+
+    Parameters
+    ----------
+    programs : list of _Program
+        The evaluated programs.
+
+    function_table : list of _Function
+        The function table of the fit, see `_function_table`.
+
+    program_params : dict, optional (default=None)
+        The constructor parameters of the programs other than `program` and
+        `random_state`, needed to rebuild programs by index.
+
+    """
+
+    def __init__(self, programs, function_table, program_params=None):
+        self.function_table = function_table
+        self.program_params = program_params
+        function_index = {id(function): code for code, function in enumerate(function_table)}
+        encoded = [program.to_compact(function_index) for program in programs]
+        self.codes = np.concatenate([codes for codes, _, _ in encoded])
+        self.args = np.concatenate([args for _, args, _ in encoded])
+        self.constants = np.concatenate([constants for _, _, constants in encoded])
+        self.offsets = np.cumsum([0] + [len(codes) for codes, _, _ in encoded]).astype(np.int64)
+        self.const_offsets = np.cumsum([0] + [len(constants) for _, _, constants in encoded]).astype(np.int64)
+        self.raw_fitness_ = np.array([program.raw_fitness_ for program in programs], dtype=np.float64)
+        self.fitness_ = np.array([program.fitness_ for program in programs], dtype=np.float64)
+        self.oob_fitness_ = np.array([getattr(program, 'oob_fitness_', np.nan) for program in programs],
+                                     dtype=np.float64)
+        self.genealogy = _Genealogy(program.parents for program in programs)
+        # 下一代中由各程序繁殖的程序数，用于剪除没有后代的程序
+        self._references = None
+        # 每个程序执行所用的秒数，沿用已知适应度而未执行的为nan
+        self.eval_time_ = np.array([getattr(program, 'eval_time_', np.nan) for program in programs],
+                                   dtype=np.float64)
+        # 各任务所在的进程及其运行秒数
+        self.busy_times = []
+        # 沿用已知适应度而未执行的程序数
+        self.n_fitness_reused = 0
+        # 语义上与其他程序等价而未执行的程序数
+        self.n_clones = 0
+        # 被竞速淘汰的程序，其适应度只是数据子集上截断后的值
+        self.eliminated = np.zeros(len(programs), dtype=bool)
+        # 各程序在探针样本上的语义指纹，不计算指纹时为None
+        self.fingerprints = None
+        # 执行时中间结果缓冲区的峰值字节数，多个任务时取最大值
+        self.peak_buffer_bytes = 0
+        self._alive = np.ones(len(programs), dtype=bool)
+        self._n_samples = programs[0]._n_samples
+        self._max_samples = programs[0]._max_samples
+        # 只在抽样时保存随机状态，用于恢复样本内外的索引，剪除个体时一并释放
+        self._indices_states = None
+        if self.has_oob:
+            self._indices_states = [program._indices_state for program in programs]
+
+    @classmethod
+    def concatenate(cls, populations):
+        """Join populations built by different jobs, keeping their order."""
+        population = copy(populations[0])
+        population.codes = np.concatenate([p.codes for p in populations])
+        population.args = np.concatenate([p.args for p in populations])
+        population.constants = np.concatenate([p.constants for p in populations])
+        population.offsets = np.concatenate([populations[0].offsets[:1]] +
+                                            [p.offsets[1:] + sum(len(q.codes) for q in populations[:i])
+                                             for i, p in enumerate(populations)])
+        population.const_offsets = np.concatenate([populations[0].const_offsets[:1]] +
+                                                  [p.const_offsets[1:] + sum(len(q.constants)
+                                                                             for q in populations[:i])
+                                                   for i, p in enumerate(populations)])
+        population.raw_fitness_ = np.concatenate([p.raw_fitness_ for p in populations])
+        population.fitness_ = np.concatenate([p.fitness_ for p in populations])
+        population.oob_fitness_ = np.concatenate([p.oob_fitness_ for p in populations])
+        population.genealogy = _Genealogy.concatenate([p.genealogy for p in populations])
+        population._references = None
+        population.eval_time_ = np.concatenate([p.eval_time_ for p in populations])
+        population.busy_times = [busy for p in populations for busy in p.busy_times]
+        population.n_fitness_reused = sum(p.n_fitness_reused for p in populations)
+        population.n_clones = sum(p.n_clones for p in populations)
+        population.eliminated = np.concatenate([p.eliminated for p in populations])
+        population.fingerprints = None
+        if all(p.fingerprints is not None for p in populations):
+            population.fingerprints = [fingerprint for p in populations for fingerprint in p.fingerprints]
+        population.peak_buffer_bytes = max(p.peak_buffer_bytes for p in populations)
+        population._alive = np.concatenate([p._alive for p in populations])
+        if population._indices_states is not None:
+            population._indices_states = [state for p in populations for state in p._indices_states]
+        return population
+
+    def subset(self, indices):
+        """Get a population made of some programs of this one, in the given order."""
+        indices = np.asarray(indices, dtype=np.int64)
+        population = copy(self)
+        pieces = [self.compact(index) for index in indices]
+        population.codes = np.concatenate([self.codes[:0]] + [codes for codes, _, _ in pieces])
+        population.args = np.concatenate([self.args[:0]] + [args for _, args, _ in pieces])
+        population.constants = np.concatenate([self.constants[:0]] + [constants for _, _, constants in pieces])
+        population.offsets = np.cumsum([0] + [len(codes) for codes, _, _ in pieces]).astype(np.int64)
+        population.const_offsets = np.cumsum([0] + [len(constants) for _, _, constants in pieces]).astype(np.int64)
+        population.raw_fitness_ = self.raw_fitness_[indices]
+        population.fitness_ = self.fitness_[indices]
+        population.oob_fitness_ = self.oob_fitness_[indices]
+        if self.genealogy is not None:
+            population.genealogy = self.genealogy.subset(indices)
+        population._references = None
+        if self.eval_time_ is not None:
+            population.eval_time_ = self.eval_time_[indices]
+        population.busy_times = []
+        population.n_fitness_reused = 0
+        population.n_clones = 0
+        population.eliminated = self.eliminated[indices]
+        if self.fingerprints is not None:
+            population.fingerprints = [self.fingerprints[index] for index in indices]
+        population.peak_buffer_bytes = 0
+        population._alive = self._alive[indices]
+        if self._indices_states is not None:
+            population._indices_states = [self._indices_states[index] for index in indices]
+        return population
+
+    def for_selection(self):
+        """Get a light copy holding only the trees and fitness, for tournaments."""
+        population = copy(self)
+        population.function_table = None
+        population.program_params = None
+        population.genealogy = None
+        population._references = None
+        population._indices_states = None
+        population.eval_time_ = None
+        return population
+
+    @property
+    def has_oob(self):
+        return self._max_samples is not None and self._max_samples < self._n_samples
+
+    @property
+    def length_(self):
+        return np.diff(self.offsets)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+    def compact(self, index):
+        """Get the (codes, args, constants) arrays of one program."""
+        start, end = self.offsets[index], self.offsets[index + 1]
+        const_start, const_end = self.const_offsets[index], self.const_offsets[index + 1]
+        return self.codes[start:end], self.args[start:end], self.constants[const_start:const_end]
+
+    def nodes(self, index):
+        """Get the program list of one program."""
+        return _decode_nodes(*self.compact(index), self.function_table)
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        if not self._alive[index]:
+            return None
+        program = _Program.from_compact(*self.compact(index), self.function_table, **self.program_params)
+        program.raw_fitness_ = self.raw_fitness_[index]
+        program.fitness_ = self.fitness_[index]
+        if self.has_oob:
+            program.oob_fitness_ = self.oob_fitness_[index]
+        program.parents = self.genealogy[index]
+        program._n_samples = self._n_samples
+        program._max_samples = self._max_samples
+        if self._indices_states is not None:
+            program._indices_state = self._indices_states[index]
+        elif self._n_samples is not None:
+            # 不抽样时样本外索引为空，任意随机状态结果相同
+            program._indices_state = check_random_state(0).get_state()
+        return program
+
+    def __setitem__(self, index, value):
+        # 只支持剪除个体
+        if value is not None:
+            raise ValueError('Programs of a population can only be pruned, got %r.' % value)
+        self.prune([index])
+
+    def prune(self, indices):
+        """Prune some programs, keeping their fitness and genealogy.
+
+        The trees of pruned programs are dropped from the storage arrays once
+        they take more than half of them.
+
+        """
+        self._alive[indices] = False
+        if self._indices_states is not None:
+            for index in np.atleast_1d(indices):
+                self._indices_states[index] = None
+        if np.sum(self.length_[self._alive]) * 2 >= len(self.codes):
+            return
+        # 剪除的程序节点数记为0
+        lengths = np.where(self._alive, self.length_, 0)
+        const_lengths = np.where(self._alive, np.diff(self.const_offsets), 0)
+        keep = np.repeat(self._alive, self.length_)
+        const_keep = np.repeat(self._alive, np.diff(self.const_offsets))
+        self.codes = self.codes[keep]
+        self.args = self.args[keep]
+        self.constants = self.constants[const_keep]
+        self.offsets = np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64)
+        self.const_offsets = np.concatenate([[0], np.cumsum(const_lengths)]).astype(np.int64)
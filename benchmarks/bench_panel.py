@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+"""
+-------------------------------------------------
+# @Project  :gplearnplus
+# @File     :bench_panel
+# @Date     :2026/10/18 0018 23:40
+# @Author   :Junzhe Huang
+# @Email    :acejasonhuang@163.com
+# @Software :PyCharm
+-------------------------------------------------
+"""
+#####
+# 大面板数据上的耗时测试，默认5000个日期 x 1000只个股共500万行
+# 1. 常数按标量传递与按向量广播的执行耗时对比
+# 2. 多进程演化每代的耗时，以及每个任务传递的数据量与只写入一次的共享数据量
+# 运行：python benchmarks/bench_panel.py [日期数] [个股数] [进程数]
+###
+import os
+import pickle
+import sys
+from time import perf_counter
+
+import numpy as np
+
+_package = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [os.path.dirname(_package), _package]
+
+from gplearnplus import rolling
+from gplearnplus._program import _Program
+from gplearnplus.fitness import _fitness_map
+from gplearnplus.functions import _function_map
+from gplearnplus.genetic import SymbolicRegressor
+
+
+def _best_time(function, repeat=3):
+    # 取多次运行的最短耗时
+    times = []
+    for _ in range(repeat):
+        start = perf_counter()
+        function()
+        times.append(perf_counter() - start)
+    return min(times)
+
+
+def _panel(n_dates, n_securities):
+    rng = np.random.RandomState(0)
+    X = rng.normal(size=(n_dates * n_securities, 4))
+    dates = np.repeat(np.arange(n_dates), n_securities)
+    securities = np.tile(np.arange(n_securities), n_dates)
+    return X, dates, securities
+
+
+def bench_constants(X, dates, securities):
+    """Time a program with constants passed as scalars and as repeated vectors."""
+    functions = [_function_map[name] for name in ('add', 'mul', 'div')] + [rolling.MA, rolling.ts_stddev]
+    function_dict = {'number': functions, 'category': []}
+    arities = {}
+    for function in functions:
+        arities.setdefault(function.arity, []).append(function)
+    add, mul, div, ma, std = functions
+    # add(mul(MA(X0, 10), 0.5), div(ts_stddev(X1, 20), 3.0))
+    nodes = [add, mul, ma, '0', 10, 0.5, div, std, '1', 20, 3.0]
+    # 旧版执行方式：每个常数先用np.repeat扩展为完整向量，数值参数的常数作为额外的列传入，
+    # 只接受标量的窗口参数在函数调用时再还原为标量，这里只计入其分配
+    constants = [node for node in nodes if isinstance(node, (int, float))]
+    repeated, k = [], X.shape[1]
+    for node in nodes:
+        if isinstance(node, float):
+            repeated.append(str(k))
+            k += 1
+        else:
+            repeated.append(node)
+
+    X_repeat = np.hstack([X] + [np.full((X.shape[0], 1), c) for c in constants if isinstance(c, float)])
+
+    def _repeat():
+        return [np.repeat(float(c), X.shape[0]) for c in constants]
+
+    params = dict(function_dict=function_dict, arities=arities, init_depth=(2, 4), init_method='grow',
+                  const_range=(1., 30.), metric=_fitness_map['mse'], p_point_replace=0.05,
+                  parsimony_coefficient=0.001, random_state=None, data_type='panel', cat_var_number=0,
+                  security_data=securities, time_series_data=dates)
+    scalar = _Program(n_features=X.shape[1], program=nodes, **params)
+    vector = _Program(n_features=k, program=repeated, **params)
+    scalar.execute(X)
+    vector.execute(X_repeat)
+    scalar_time = _best_time(lambda: scalar.execute(X))
+    vector_time = _best_time(lambda: (_repeat(), vector.execute(X_repeat)))
+    print('constants: scalars %.3fs, repeated vectors %.3fs (%.1fx)'
+          % (scalar_time, vector_time, vector_time / scalar_time))
+
+
+def bench_parallel(X, dates, securities, n_jobs):
+    """Time the generations of a fit and the data sent to its workers."""
+    import pandas as pd
+    df = pd.DataFrame(X, columns=list('abcd'))
+    df['date'] = dates
+    df['security'] = securities
+    y = X[:, 0] + 0.5 * X[:, 1] + np.random.RandomState(1).normal(size=len(X))
+    for jobs in (1, n_jobs):
+        est = SymbolicRegressor(population_size=40, generations=3, n_jobs=jobs, random_state=0,
+                                data_type='panel', time_series_index='date', security_index='security',
+                                feature_names=list('abcd'), metric='mean ic', stopping_criteria=1.,
+                                function_set=['add', 'sub', 'mul', rolling.MA], const_range=(3, 20))
+        start = perf_counter()
+        est.fit(df.copy(), y)
+        print('n_jobs=%d: fit %.1fs, generations %s' % (jobs, perf_counter() - start,
+                                                         np.round(est.run_details_['generation_time'], 2)))
+    # 每代每个任务只传递父代的紧凑编码，训练数据在fit开始时写入一次
+    parents = len(pickle.dumps(est._programs[-1].for_selection()))
+    print('per task: parents %.1f KB, shared dataset written once: %.1f MB'
+          % (parents / 2 ** 10, (X.nbytes + y.nbytes + dates.nbytes + securities.nbytes) / 2 ** 20))
+
+
+def main(n_dates=5000, n_securities=1000, n_jobs=2):
+    X, dates, securities = _panel(n_dates, n_securities)
+    print('panel of %d rows' % len(X))
+    bench_constants(X, dates, securities)
+    bench_parallel(X, dates, securities, n_jobs)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
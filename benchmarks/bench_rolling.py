@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+"""
+-------------------------------------------------
+# @Project  :gplearnplus
+# @File     :bench_rolling
+# @Date     :2026/10/18 0018 21:30
+# @Author   :Junzhe Huang
+# @Email    :acejasonhuang@163.com
+# @Software :PyCharm
+-------------------------------------------------
+"""
+#####
+# 滚动窗口函数与example中逐窗口计算版本的耗时对比，窗口3到30
+# 运行：python benchmarks/bench_rolling.py [样本数]
+###
+import os
+import sys
+from time import perf_counter
+
+import numpy as np
+
+# 导入gplearnplus包，以及example.py所需的同目录functions模块
+_package = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [os.path.dirname(_package), _package]
+
+from gplearnplus import example, rolling
+
+WINDOWS = (3, 5, 10, 20, 30)
+UNARY = ('ts_min', 'ts_max', 'ts_argmax', 'ts_rank', 'ts_stddev', 'MIDPOINT', 'MA', 'KAMA', 'LINEARREG_SLOPE')
+BINARY = ('ts_corr', 'BETA')
+
+
+def _best_time(function, args, repeat=3):
+    # 取多次运行的最短耗时
+    times = []
+    for _ in range(repeat):
+        start = perf_counter()
+        function(*args)
+        times.append(perf_counter() - start)
+    return min(times)
+
+
+def main(n_samples=200000):
+    rng = np.random.RandomState(0)
+    Y = rng.randn(n_samples)
+    Z = 0.5 * Y + rng.randn(n_samples)
+    # example中的ts_corr不支持nan，双变量函数使用不含nan的序列
+    X = np.where(rng.uniform(size=n_samples) < 0.05, np.nan, Y)
+    print('%-16s' % 'function' + ''.join('%18s' % ('d=%d' % d) for d in WINDOWS))
+    for name in UNARY + BINARY:
+        naive, fast = getattr(example, '_' + name), getattr(rolling, '_' + name)
+        cells = []
+        for d in WINDOWS:
+            args = (X, d) if name in UNARY else (Y, Z, d)
+            # 先在短序列上完成编译
+            short = [arg[:100] if isinstance(arg, np.ndarray) else arg for arg in args]
+            naive(*short)
+            fast(*short)
+            naive_time, fast_time = _best_time(naive, args), _best_time(fast, args)
+            cells.append('%6.1fms %5.1fx' % (1000 * fast_time, naive_time / fast_time))
+        print('%-16s' % name + ''.join('%18s' % cell for cell in cells))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
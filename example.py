@@ -76,7 +76,7 @@ def _delay(X, d):
 
 delay = functions.make_function(function=_delay, name='delay', arity=2, function_type='time_series',
                                 param_type=[{'vector': {'number': (None, None)}},
-                                            {'scalar': {'int':(3, 30)}}])
+                                            {'scalar': {'int':(3, 30)}}], compose='add')
 
 @jit(nopython=True)
 def _delta(X, d):
@@ -418,40 +418,55 @@ LINEARREG_INTERCEPT = functions.make_function(function=_LINEARREG_INTERCEPT, nam
 
 #### SECTION FUNCTION ####
 
+def _section_segment(kernel):
+    # 截面函数的分段版本，一次调用处理面板数据中所有日期
+    @nb.jit(nopython=True)
+    def _segment_kernel(offsets, X):
+        res = np.empty(len(X), dtype=np.float64)
+        for i in range(len(offsets) - 1):
+            res[offsets[i]:offsets[i + 1]] = kernel(X[offsets[i]:offsets[i + 1]])
+        return res
+    return _segment_kernel
+
 @nb.jit(nopython=True)
 def _MAX_SECTION(X: np.ndarray) -> np.ndarray:
     return np.full_like(X, np.max(X))
 
 sec_max = functions.make_function(function=_MAX_SECTION, name='sec_max', arity=1, function_type='section',
-                                  param_type=[{'vector': {'number': (None, None)}}])
+                                  param_type=[{'vector': {'number': (None, None)}}],
+                                  segment_function=_section_segment(_MAX_SECTION))
 
 @nb.jit(nopython=True)
 def _MIN_SECTION(X):
     return np.full_like(X, np.min(X))
 
 sec_min = functions.make_function(function=_MIN_SECTION, name='sec_min', arity=1, function_type='section',
-                                  param_type=[{'vector': {'number': (None, None)}}])
+                                  param_type=[{'vector': {'number': (None, None)}}],
+                                  segment_function=_section_segment(_MIN_SECTION))
 
 @nb.jit(nopython=True)
 def _MEAN_SECTION(X):
     return np.full_like(X, np.mean(X))
 
 sec_mean = functions.make_function(function=_MEAN_SECTION, name='sec_mean', arity=1, function_type='section',
-                                   param_type=[{'vector': {'number': (None, None)}}])
+                                   param_type=[{'vector': {'number': (None, None)}}],
+                                   segment_function=_section_segment(_MEAN_SECTION))
 
 @nb.jit(nopython=True)
 def _MEDIAN_SECTION(X):
     return np.full_like(X, np.median(X))
 
 sec_median = functions.make_function(function=_MEDIAN_SECTION, name='sec_median', arity=1, function_type='section',
-                                     param_type=[{'vector': {'number': (None, None)}}])
+                                     param_type=[{'vector': {'number': (None, None)}}],
+                                     segment_function=_section_segment(_MEDIAN_SECTION))
 
 @nb.jit(nopython=True)
 def _STD_SECTION(X):
     return np.full_like(X, np.std(X))
 
 sec_std = functions.make_function(function=_STD_SECTION, name='sec_std', arity=1, function_type='section',
-                                  param_type=[{'vector': {'number': (None, None)}}])
+                                  param_type=[{'vector': {'number': (None, None)}}],
+                                  segment_function=_section_segment(_STD_SECTION))
 
 @nb.jit(nopython=True)
 def _RANK_SECTION(X):
@@ -462,7 +477,8 @@ def _RANK_SECTION(X):
     return rank
 
 sec_rank = functions.make_function(function=_RANK_SECTION, name='sec_rank', arity=1, function_type='section',
-                                   param_type=[{'vector': {'number': (None, None)}}])
+                                   param_type=[{'vector': {'number': (None, None)}}],
+                                   segment_function=_section_segment(_RANK_SECTION))
 
 @nb.jit(nopython=True)
 def _NEUTRALIZE_SECTION(X):
@@ -473,7 +489,8 @@ def _NEUTRALIZE_SECTION(X):
     return (X - mean) / np.repeat(std, len(X))
 
 sec_neutralize = functions.make_function(function=_NEUTRALIZE_SECTION, name='sec_neutralize', arity=1,
-                                         function_type='section', param_type=[{'vector': {'number': (None, None)}}])
+                                         function_type='section', param_type=[{'vector': {'number': (None, None)}}],
+                                         segment_function=_section_segment(_NEUTRALIZE_SECTION))
 
 @no_numpy_warning
 def _FREQ_SECTION(X):
@@ -12,6 +12,7 @@
 
 import numbers
 
+import numba as nb
 import numpy as np
 from joblib import wrap_non_picklable_objects
 from scipy.stats import rankdata
@@ -40,16 +41,118 @@ class _Fitness(object):
         general this would be False for metrics indicating the magnitude of
         the error, and True for metrics indicating the quality of fit.
 
+    batch_function : callable, optional (default=None)
+        A function with signature batch_function(target, y_pred,
+        sample_weight) scoring a block of predictions, one row per program.
+
+    panel : bool, optional (default=False)
+        Whether the metric is computed date by date on panel data. The
+        function then takes the _GroupIndex of the dates as a fourth
+        argument.
+
     """
 
-    def __init__(self, function, greater_is_better):
+    def __init__(self, function, greater_is_better, batch_function=None, panel=False):
         self.function = function
         self.greater_is_better = greater_is_better
         self.sign = 1 if greater_is_better else -1
+        self.batch_function = batch_function
+        self.panel = panel
 
     def __call__(self, *args):
         return self.function(*args)
 
+    def batch(self, target, y_pred, sample_weight):
+        """Score a block of programs' predictions at once.
+
+        Parameters
+        ----------
+        target : _Target
+            The target vector with the statistics shared by the whole fit.
+
+        y_pred : array-like, shape = [n_programs, n_samples]
+            The predicted values of each program, one row per program.
+
+        sample_weight : array-like, shape = [n_samples] or [n_programs, n_samples]
+            The weights shared by every program, or the weights of each program.
+
+        Returns
+        -------
+        scores : array, shape = [n_programs]
+            The score of each program.
+
+        """
+        if self.batch_function is not None:
+            return self.batch_function(target, y_pred, sample_weight)
+        # 自定义指标没有批量实现，逐行计算
+        if sample_weight.ndim == 1:
+            return np.array([self.function(target.y, row, sample_weight) for row in y_pred])
+        return np.array([self.function(target.y, row, w) for row, w in zip(y_pred, sample_weight)])
+
+
+class _Target(object):
+
+    """The target vector of a fit and the statistics shared by its programs.
+
+    The statistics only depend on `y` and on the weights shared by every
+    program, so they are computed once and reused by each batch of programs.
+
+    Parameters
+    ----------
+    y : array-like, shape = [n_samples]
+        The target values.
+
+    sample_weight : array-like, shape = [n_samples], optional
+        The weights applied to individual samples, None for unit weights.
+
+    groups : _GroupIndex, optional
+        The dates of panel data, required by the panel metrics.
+
+    """
+
+    def __init__(self, y, sample_weight=None, groups=None):
+        self.y = y
+        if sample_weight is None:
+            sample_weight = np.ones(len(y))
+        self.sample_weight = sample_weight
+        self.groups = groups
+        self._ranked = None
+        self._demeaned = {}
+        self._panel = None
+
+    def sort(self, x):
+        """Reorder the last axis of x so that each date is contiguous."""
+        if self.groups.order is None:
+            return x
+        return np.take(x, self.groups.order, axis=-1)
+
+    @property
+    def panel_stats(self):
+        """The sorted y and weights, and the ranks of y within each date."""
+        if self._panel is None:
+            y = np.ascontiguousarray(self.sort(self.y), dtype=np.float64)
+            w = np.ascontiguousarray(self.sort(self.sample_weight), dtype=np.float64)
+            y_rank, n_valid = _segment_target_rank(self.groups.offsets, y, w)
+            self._panel = (y, w, y_rank, n_valid)
+        return self._panel
+
+    @property
+    def ranked(self):
+        """The ranks of `y`."""
+        if self._ranked is None:
+            self._ranked = rankdata(self.y)
+        return self._ranked
+
+    def demeaned(self, w, ranked=False):
+        """Get `y` (or its ranks) minus its weighted mean under `w`."""
+        values = self.ranked if ranked else self.y
+        if w is not self.sample_weight:
+            return values - _batch_average(values, w)[..., np.newaxis]
+        # 所有程序共用的权重只计算一次
+        if ranked not in self._demeaned:
+            self._demeaned[ranked] = values - _batch_average(values, w)
+        return self._demeaned[ranked]
+
 
 def make_fitness(*, function, greater_is_better, wrap=True):
     """Make a fitness measure, a metric scoring the quality of a program's fit.
@@ -148,22 +251,245 @@ def _log_loss(y, y_pred, w):
     return np.average(-score, weights=w)
 
 
+# 批量版本，每行对应一个程序，与逐个计算的运算顺序一致，结果相同
+def _batch_average(values, w):
+    """Calculate the weighted average along the last axis."""
+    return np.sum(values * w, axis=-1) / np.sum(w, axis=-1)
+
+
+def _batch_correlation(a_demean, b_demean, w):
+    """Calculate the weighted correlation of demeaned rows."""
+    w_sum = np.sum(w, axis=-1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        corr = ((np.sum(w * a_demean * b_demean, axis=-1) / w_sum) /
+                np.sqrt((np.sum(w * a_demean ** 2, axis=-1) *
+                         np.sum(w * b_demean ** 2, axis=-1)) /
+                        (w_sum ** 2)))
+    return np.where(np.isfinite(corr), np.abs(corr), 0.)
+
+
+def _batch_pearson(target, y_pred, w):
+    """Calculate the weighted Pearson correlation of each row."""
+    with np.errstate(invalid='ignore'):
+        y_pred_demean = y_pred - _batch_average(y_pred, w)[:, np.newaxis]
+    return _batch_correlation(y_pred_demean, target.demeaned(w), w)
+
+
+def _batch_spearman(target, y_pred, w):
+    """Calculate the weighted Spearman correlation of each row."""
+    y_pred_ranked = rankdata(y_pred, axis=1)
+    with np.errstate(invalid='ignore'):
+        y_pred_demean = y_pred_ranked - _batch_average(y_pred_ranked, w)[:, np.newaxis]
+    # _weighted_spearman中预测值的秩处于y的位置
+    return _batch_correlation(target.demeaned(w, ranked=True), y_pred_demean, w)
+
+
+def _batch_mean_absolute_error(target, y_pred, w):
+    """Calculate the mean absolute error of each row."""
+    return _batch_average(np.abs(y_pred - target.y), w)
+
+
+def _batch_mean_square_error(target, y_pred, w):
+    """Calculate the mean square error of each row."""
+    return _batch_average((y_pred - target.y) ** 2, w)
+
+
+def _batch_root_mean_square_error(target, y_pred, w):
+    """Calculate the root mean square error of each row."""
+    return np.sqrt(_batch_average((y_pred - target.y) ** 2, w))
+
+
+def _batch_log_loss(target, y_pred, w):
+    """Calculate the log loss of each row."""
+    eps = 1e-15
+    inv_y_pred = np.clip(1 - y_pred, eps, 1 - eps)
+    y_pred = np.clip(y_pred, eps, 1 - eps)
+    score = target.y * np.log(y_pred) + (1 - target.y) * np.log(inv_y_pred)
+    return _batch_average(-score, w)
+
+
+#### PANEL ####
+
+@nb.jit(nopython=True, nogil=True)
+def _average_rank(x, index):
+    # x[index]的秩（从1开始），并列取平均
+    values = x[index]
+    order = np.argsort(values, kind='mergesort')
+    ranks = np.empty(len(index), dtype=np.float64)
+    i = 0
+    while i < len(order):
+        j = i
+        while j + 1 < len(order) and values[order[j + 1]] == values[order[i]]:
+            j += 1
+        for k in range(i, j + 1):
+            ranks[order[k]] = (i + j) / 2. + 1.
+        i = j + 1
+    return ranks
+
+
+@nb.jit(nopython=True, nogil=True)
+def _weighted_corr(a, b, w):
+    # 任一序列为常数时相关系数无定义
+    if a.min() == a.max() or b.min() == b.max():
+        return np.nan
+    w_sum = w.sum()
+    a_demean = a - (a * w).sum() / w_sum
+    b_demean = b - (b * w).sum() / w_sum
+    var = (w * a_demean ** 2).sum() * (w * b_demean ** 2).sum()
+    if var <= 0:
+        return np.nan
+    return (w * a_demean * b_demean).sum() / np.sqrt(var)
+
+
+@nb.jit(nopython=True, nogil=True)
+def _segment_target_rank(offsets, y, w):
+    # 全部权重下每日y的秩，只在样本有效（y有限且权重为正）时有值
+    y_rank = np.full(len(y), np.nan)
+    n_valid = np.zeros(len(offsets) - 1, dtype=np.int64)
+    for g in range(len(offsets) - 1):
+        index = np.empty(offsets[g + 1] - offsets[g], dtype=np.int64)
+        m = 0
+        for k in range(offsets[g], offsets[g + 1]):
+            if w[k] > 0 and np.isfinite(y[k]):
+                index[m] = k
+                m += 1
+        y_rank[index[:m]] = _average_rank(y, index[:m])
+        n_valid[g] = m
+    return y_rank, n_valid
+
+
+@nb.jit(nopython=True, nogil=True)
+def _segment_ic(offsets, y, y_pred, w, rank, y_rank, n_valid):
+    # 每个程序（行）每日的加权IC，只使用y和预测值都有限且权重为正的样本
+    # w只有一行时为所有程序共用的权重
+    n_groups = len(offsets) - 1
+    ic = np.full((y_pred.shape[0], n_groups), np.nan)
+    for r in range(y_pred.shape[0]):
+        w_row = w[min(r, w.shape[0] - 1)]
+        pred = y_pred[r]
+        for g in range(n_groups):
+            index = np.empty(offsets[g + 1] - offsets[g], dtype=np.int64)
+            m = 0
+            for k in range(offsets[g], offsets[g + 1]):
+                if w_row[k] > 0 and np.isfinite(y[k]) and np.isfinite(pred[k]):
+                    index[m] = k
+                    m += 1
+            if m < 2:
+                continue
+            index = index[:m]
+            if rank:
+                # 权重只会在全部权重的基础上置零，有效样本数相同即为同一组样本，沿用y的秩
+                if m == n_valid[g]:
+                    a = y_rank[index]
+                else:
+                    a = _average_rank(y, index)
+                b = _average_rank(pred, index)
+            else:
+                a = y[index]
+                b = pred[index]
+            ic[r, g] = _weighted_corr(a, b, w_row[index])
+    return ic
+
+
+def _batch_panel_ic(target, y_pred, w, rank):
+    """Calculate the IC of each row on each date of panel data."""
+    y, w_full, y_rank, n_valid = target.panel_stats
+    if w is target.sample_weight:
+        w = w_full[np.newaxis]
+    else:
+        w = np.ascontiguousarray(target.sort(np.atleast_2d(w)), dtype=np.float64)
+    y_pred = np.ascontiguousarray(target.sort(y_pred), dtype=np.float64)
+    return _segment_ic(target.groups.offsets, y, y_pred, w, rank, y_rank, n_valid)
+
+
+def _ic_mean(ic):
+    """Summarize the daily IC of each row by its absolute mean."""
+    valid = np.isfinite(ic)
+    n_valid = valid.sum(axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean = np.where(valid, ic, 0.).sum(axis=1) / n_valid
+    return np.where(n_valid > 0, np.abs(mean), 0.)
+
+
+def _ic_ir(ic):
+    """Summarize the daily IC of each row by the absolute ratio of its mean to its std."""
+    valid = np.isfinite(ic)
+    n_valid = valid.sum(axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean = np.where(valid, ic, 0.).sum(axis=1) / n_valid
+        std = np.sqrt(np.where(valid, (ic - mean[:, np.newaxis]) ** 2, 0.).sum(axis=1) / (n_valid - 1))
+        ir = np.abs(mean / std)
+    return np.where(np.isfinite(ir), ir, 0.)
+
+
+def _batch_mean_ic(target, y_pred, w):
+    """Calculate the mean daily IC of each row."""
+    return _ic_mean(_batch_panel_ic(target, y_pred, w, False))
+
+
+def _batch_mean_rank_ic(target, y_pred, w):
+    """Calculate the mean daily rank IC of each row."""
+    return _ic_mean(_batch_panel_ic(target, y_pred, w, True))
+
+
+def _batch_icir(target, y_pred, w):
+    """Calculate the ICIR of the daily IC of each row."""
+    return _ic_ir(_batch_panel_ic(target, y_pred, w, False))
+
+
+def _mean_ic(y, y_pred, w, groups):
+    """Calculate the mean daily IC of panel data."""
+    return _batch_mean_ic(_Target(y, w, groups), np.atleast_2d(y_pred), w)[0]
+
+
+def _mean_rank_ic(y, y_pred, w, groups):
+    """Calculate the mean daily rank IC of panel data."""
+    return _batch_mean_rank_ic(_Target(y, w, groups), np.atleast_2d(y_pred), w)[0]
+
+
+def _icir(y, y_pred, w, groups):
+    """Calculate the ICIR of the daily IC of panel data."""
+    return _batch_icir(_Target(y, w, groups), np.atleast_2d(y_pred), w)[0]
+
+
 weighted_pearson = _Fitness(function=_weighted_pearson,
-                            greater_is_better=True)
+                            greater_is_better=True,
+                            batch_function=_batch_pearson)
 weighted_spearman = _Fitness(function=_weighted_spearman,
-                             greater_is_better=True)
+                             greater_is_better=True,
+                             batch_function=_batch_spearman)
 mean_absolute_error = _Fitness(function=_mean_absolute_error,
-                               greater_is_better=False)
+                               greater_is_better=False,
+                               batch_function=_batch_mean_absolute_error)
 mean_square_error = _Fitness(function=_mean_square_error,
-                             greater_is_better=False)
+                             greater_is_better=False,
+                             batch_function=_batch_mean_square_error)
 root_mean_square_error = _Fitness(function=_root_mean_square_error,
-                                  greater_is_better=False)
+                                  greater_is_better=False,
+                                  batch_function=_batch_root_mean_square_error)
 log_loss = _Fitness(function=_log_loss,
-                    greater_is_better=False)
+                    greater_is_better=False,
+                    batch_function=_batch_log_loss)
+
+mean_ic = _Fitness(function=_mean_ic,
+                   greater_is_better=True,
+                   batch_function=_batch_mean_ic,
+                   panel=True)
+mean_rank_ic = _Fitness(function=_mean_rank_ic,
+                        greater_is_better=True,
+                        batch_function=_batch_mean_rank_ic,
+                        panel=True)
+icir = _Fitness(function=_icir,
+                greater_is_better=True,
+                batch_function=_batch_icir,
+                panel=True)
 
 _fitness_map = {'pearson': weighted_pearson,
                 'spearman': weighted_spearman,
                 'mean absolute error': mean_absolute_error,
                 'mse': mean_square_error,
                 'rmse': root_mean_square_error,
-                'log loss': log_loss}
\ No newline at end of file
+                'log loss': log_loss,
+                'mean ic': mean_ic,
+                'mean rank ic': mean_rank_ic,
+                'icir': icir}
\ No newline at end of file
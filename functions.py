@@ -9,6 +9,8 @@
 # @Software :PyCharm
 -------------------------------------------------
 """
+from concurrent.futures import ThreadPoolExecutor
+
 import numpy as np
 from joblib import wrap_non_picklable_objects
 
@@ -40,10 +42,66 @@ class _Function(object):
                   }
     function_type : 'all', 'section', 'time_series‘
 
+    accept_scalar : bool, optional
+        Whether the function broadcasts scalars passed to its vector
+        parameters by itself, so that constants can be passed without being
+        expanded to full vectors. Defaults to True for numpy ufuncs.
+
+    segment_function : callable, optional
+        A kernel with signature segment_function(offsets, x1, *args) applying
+        the function to every group of a panel at once, where the vector
+        arguments are sorted by group and offsets holds the start of each
+        group followed by the total length.
+
+    commutative : bool, optional (default=False)
+        Whether the arguments can be given in any order, f(x, y) = f(y, x).
+
+    involution : bool, optional (default=False)
+        Whether the unary function undoes itself, f(f(x)) = x.
+
+    idempotent : bool, optional (default=False)
+        Whether f(f(x)) = f(x) for a unary function, or f(x, x) = x for a
+        binary function.
+
+    self_value : float, optional (default=None)
+        The constant value of f(x, x) for a binary function and a finite x,
+        if any.
+
+    compose : 'add', optional (default=None)
+        For a function f(x, d) of a vector and an int scalar, 'add' declares
+        that f(f(x, a), b) = f(x, a + b).
+
+    accept_out : bool, optional
+        Whether the function can write its result into a given float buffer,
+        passed as the ``out`` keyword argument. Defaults to True for numpy
+        ufuncs with a single output.
+
+    kernel : str, optional (default=None)
+        For an elementwise function, the scalar expression computing one
+        element of the result, with {0}, {1}, ... standing for the arguments,
+        e.g. '({0} + {1})'. The expression may use the math module and is
+        compiled by numba into fused kernels of whole elementwise subtrees.
+
+    thread_safe : bool, optional (default=True)
+        Whether the function can be called from several threads at once, as
+        required by the threads backend of the estimators.
+
     """
 
-    def __init__(self, function, name, arity, param_type=None, return_type='number', function_type='all'):
+    def __init__(self, function, name, arity, param_type=None, return_type='number', function_type='all',
+                 accept_scalar=None, segment_function=None, commutative=False, involution=False,
+                 idempotent=False, self_value=None, compose=None, kernel=None, accept_out=None,
+                 thread_safe=True):
         self.function = function
+        self.segment_function = segment_function
+        # 逐元素计算的表达式模板，用于生成融合内核
+        self.kernel = kernel
+        # 化简规则
+        self.commutative = commutative
+        self.involution = involution
+        self.idempotent = idempotent
+        self.self_value = self_value
+        self.compose = compose
         self.name = name
         self.arity = arity
         if param_type is None:
@@ -55,12 +113,22 @@ class _Function(object):
             raise ValueError("return_type of function {} should be number or category, NOT {}".format(name, return_type))
         self.return_type = return_type
         self.function_type = function_type
-
-    def __call__(self, *args):
-        for _param, _param_type in zip(args, self.param_type):
-            if len(_param_type) == 1 and 'scalar' in _param_type and isinstance(_param, (list, np.ndarray)):
-                _param = _param[0]
-        return self.function(*args)
+        if accept_scalar is None:
+            accept_scalar = isinstance(function, np.ufunc)
+        self.accept_scalar = accept_scalar
+        if accept_out is None:
+            accept_out = isinstance(function, np.ufunc) and function.nout == 1
+        self.accept_out = accept_out
+        self.thread_safe = thread_safe
+        # 函数标识，用于子树缓存，避免不同函数同名时混淆
+        self.signature = '%s:%s' % (name, getattr(function, '__name__', ''))
+
+    def __call__(self, *args, **kwargs):
+        # 只接收常数的参数若已被广播为向量，则还原为常数
+        args = [_param[0] if len(_param_type) == 1 and 'scalar' in _param_type
+                and isinstance(_param, (list, np.ndarray)) and np.ndim(_param) > 0 else _param
+                for _param, _param_type in zip(args, self.param_type)]
+        return self.function(*args, **kwargs)
 
     def add_range(self, const_range):
         # 替换掉参数中没有约束的范围
@@ -127,7 +195,9 @@ class _Function(object):
 
 
 # warp 用于多进程序列化，会降低进化效率
-def make_function(*, function, name, arity, param_type=None, wrap=True, return_type='number', function_type='all'):
+def make_function(*, function, name, arity, param_type=None, wrap=True, return_type='number', function_type='all',
+                  accept_scalar=False, segment_function=None, commutative=False, involution=False,
+                  idempotent=False, self_value=None, compose=None, kernel=None, thread_safe=False):
     """
        Parameters
        ----------
@@ -140,6 +210,39 @@ def make_function(*, function, name, arity, param_type=None, wrap=True, return_t
        param_type : [{type: (, ), type: (, )}, ........]
 
        wrap : bool, optional (default=True)
+
+       accept_scalar : bool, optional (default=False)
+           Whether constants given to parameters accepting both vectors and
+           scalars may be passed as scalars instead of full vectors.
+           Parameters only accepting scalars always get scalars.
+
+       segment_function : callable, optional (default=None)
+           Segment-aware version of a section or time_series function, with
+           signature segment_function(offsets, x1, *args). The vector
+           arguments are sorted by group and offsets holds the start index of
+           every group plus the total length, so that all groups of a panel
+           are processed in a single call. Without it the function is called
+           once per group.
+
+       commutative, involution, idempotent, self_value, compose : optional
+           Algebraic rules of the function used to simplify programs, see
+           _Function. Simplified programs replace the original ones during
+           execution, so the rules should hold exactly, nan and infinite
+           inputs included. As sub(x, x) is nan where x is nan or infinite,
+           self_value rules are only applied to constant arguments.
+
+       kernel : str, optional (default=None)
+           Scalar expression template of an elementwise function, see
+           _Function. It should give the same results as the function itself.
+
+       thread_safe : bool, optional (default=False)
+           Declares that the function (and segment_function) may be called
+           concurrently from several threads, which is required to use it with
+           backend='threads'. This holds for functions that only read their
+           arguments and return new arrays, e.g. numpy expressions or numba
+           kernels; compile numba kernels with nogil=True so that the threads
+           actually run in parallel. Functions keeping state between calls,
+           or calling non thread-safe libraries, should not declare it.
        """
 
     if not isinstance(arity, int):
@@ -148,6 +251,35 @@ def make_function(*, function, name, arity, param_type=None, wrap=True, return_t
         raise ValueError('name must be a string, got %s' % type(name))
     if not isinstance(wrap, bool):
         raise ValueError('wrap must be an bool, got %s' % type(wrap))
+    if not isinstance(accept_scalar, bool):
+        raise ValueError('accept_scalar must be an bool, got %s' % type(accept_scalar))
+    if segment_function is not None and not callable(segment_function):
+        raise ValueError('segment_function must be callable, got %s' % type(segment_function))
+    for rule, value in (('commutative', commutative), ('involution', involution), ('idempotent', idempotent)):
+        if not isinstance(value, bool):
+            raise ValueError('%s must be an bool, got %s' % (rule, type(value)))
+    if (commutative or self_value is not None) and arity != 2:
+        raise ValueError('commutative and self_value only apply to functions of arity 2')
+    if involution and arity != 1:
+        raise ValueError('involution only applies to functions of arity 1')
+    if idempotent and arity not in (1, 2):
+        raise ValueError('idempotent only applies to functions of arity 1 or 2')
+    if compose not in (None, 'add'):
+        raise ValueError("compose must be None or 'add', got %r" % (compose,))
+    if compose is not None and (arity != 2 or param_type is None or param_type[1] is None or
+                                'int' not in param_type[1].get('scalar', {}) or 'vector' in param_type[1]):
+        raise ValueError('compose only applies to functions f(x, d) of a vector and an int scalar')
+    if not isinstance(thread_safe, bool):
+        raise ValueError('thread_safe must be an bool, got %s' % type(thread_safe))
+    if kernel is not None:
+        if not isinstance(kernel, str):
+            raise ValueError('kernel must be a string, got %s' % type(kernel))
+        if function_type != 'all':
+            raise ValueError('kernel only applies to elementwise functions')
+        try:
+            kernel.format(*['x%d' % i for i in range(arity)])
+        except (IndexError, KeyError, ValueError):
+            raise ValueError('kernel %r does not support arity of %d.' % (kernel, arity))
 
     # check out param_type vector > scalar int > float
     if param_type is None:
@@ -301,13 +433,32 @@ def make_function(*, function, name, arity, param_type=None, wrap=True, return_t
                          arity=arity,
                          param_type=param_type,
                          return_type=return_type,
-                         function_type=function_type)
+                         function_type=function_type,
+                         accept_scalar=accept_scalar,
+                         segment_function=(None if segment_function is None
+                                           else wrap_non_picklable_objects(segment_function)),
+                         commutative=commutative,
+                         involution=involution,
+                         idempotent=idempotent,
+                         self_value=self_value,
+                         compose=compose,
+                         kernel=kernel,
+                         thread_safe=thread_safe)
     return _Function(function=function,
                      name=name,
                      arity=arity,
                      param_type=param_type,
                      return_type=return_type,
-                     function_type=function_type)
+                     function_type=function_type,
+                     accept_scalar=accept_scalar,
+                     segment_function=segment_function,
+                     commutative=commutative,
+                     involution=involution,
+                     idempotent=idempotent,
+                     self_value=self_value,
+                     compose=compose,
+                     kernel=kernel,
+                     thread_safe=thread_safe)
 
 
 def _protected_division(x1, x2):
@@ -338,33 +489,290 @@ def _sigmoid(x1):
     with np.errstate(over='ignore', under='ignore'):
         return 1 / (1 + np.exp(-x1))
 
+class _GroupIndex(object):
+    """Sort permutation and segment offsets of a group key.
+
+    Built once per fit for the security and time index of panel data, so that
+    section and time series functions can be applied group by group without
+    sorting and splitting the data on each call.
+
+    Parameters
+    ----------
+    keys : array-like, shape = [n_samples]
+        The group of each sample. Samples of the same group keep their
+        original relative order.
+
+    """
+
+    def __init__(self, keys):
+        keys = np.asarray(keys)
+        self.n_samples = len(keys)
+        order = np.argsort(keys, kind='stable')
+        keys_sorted = keys[order]
+        starts = np.flatnonzero(keys_sorted[1:] != keys_sorted[:-1]) + 1
+        self.offsets = np.concatenate(([0], starts, [self.n_samples])).astype(np.int64)
+        self.n_groups = len(self.offsets) - 1
+        # 已按分组排序时无需重排
+        if np.array_equal(order, np.arange(self.n_samples)):
+            order = None
+        self.order = order
+
+    @classmethod
+    def uniform(cls, n_groups, group_size, order=None):
+        """Build the index of groups of equal size.
+
+        Parameters
+        ----------
+        n_groups : int
+            The number of groups.
+
+        group_size : int
+            The number of samples of every group.
+
+        order : array-like, shape = [n_groups * group_size], optional
+            The permutation making each group contiguous, None if the samples
+            are already sorted by group.
+
+        """
+        groups = cls.__new__(cls)
+        groups.n_samples = n_groups * group_size
+        groups.offsets = np.arange(0, groups.n_samples + 1, group_size, dtype=np.int64)
+        groups.n_groups = n_groups
+        groups.order = order
+        return groups
+
+    def sort(self, x):
+        """Reorder a vector so that each group is contiguous."""
+        if self.order is None or np.ndim(x) == 0:
+            return x
+        return x[self.order]
+
+    def unsort(self, x):
+        """Restore the original order of a vector sorted by group."""
+        if self.order is None:
+            return x
+        result = np.empty_like(x)
+        result[self.order] = x
+        return result
+
+
+class _PanelLayout(object):
+    """Dense (n_dates, n_securities) layout of long format panel data.
+
+    Each vector is held as a flattened date-major matrix padded with NaN for
+    missing (date, security) pairs. Section functions then run over the
+    contiguous rows of the matrix and time series functions over its
+    columns, as groups of equal size.
+
+    The layout is only equivalent to the long format for balanced panels.
+    With missing pairs the NaN padding would reach section reductions and
+    time series windows, which are not NaN aware, see `balanced`.
+
+    Parameters
+    ----------
+    time_series_data : array-like, shape = [n_samples]
+        The date of each sample.
+
+    security_data : array-like, shape = [n_samples]
+        The security of each sample.
+
+    """
+
+    def __init__(self, time_series_data, security_data):
+        _, date_code = np.unique(time_series_data, return_inverse=True)
+        _, security_code = np.unique(security_data, return_inverse=True)
+        self.n_dates = int(date_code.max()) + 1
+        self.n_securities = int(security_code.max()) + 1
+        self.n_samples = len(date_code)
+        self.n_cells = self.n_dates * self.n_securities
+        # 每个样本在展开矩阵中的位置
+        self.cells = date_code * self.n_securities + security_code
+        # 每个(日期, 个股)恰有一个样本
+        self.balanced = (self.n_samples == self.n_cells and
+                         bool(np.all(np.bincount(self.cells, minlength=self.n_cells) == 1)))
+        self.section_groups = _GroupIndex.uniform(self.n_dates, self.n_securities)
+        # 按个股排列即为矩阵转置
+        transpose = np.arange(self.n_cells).reshape(self.n_dates, self.n_securities).T.ravel()
+        self.time_series_groups = _GroupIndex.uniform(self.n_securities, self.n_dates, transpose)
+        # 最近一次转换的(X, 稠密特征)，作为一个元组整体替换，多线程同时读写时不会错配
+        self._dense = None
+
+    def __getstate__(self):
+        # 稠密特征在使用时重新生成
+        state = self.__dict__.copy()
+        state['_dense'] = None
+        return state
+
+    def to_dense(self, X):
+        """Scatter the columns of long format X into the dense layout.
+
+        The result of the last call is reused when X is the same object.
+        Concurrent calls from several threads are safe.
+
+        """
+        dense = self._dense
+        if dense is not None and dense[0] is X:
+            return dense[1]
+        X_dense = np.full((self.n_cells, X.shape[1]), np.nan, dtype=X.dtype, order='F')
+        X_dense[self.cells] = X
+        self._dense = (X, X_dense)
+        return X_dense
+
+    def to_long(self, x):
+        """Gather a dense vector back to the long format samples."""
+        if np.ndim(x) == 0:
+            return x
+        return x[self.cells]
+
+
+class _PanelShards(object):
+    """Split of the rows of panel data into shards of whole dates or securities.
+
+    Section functions only need the samples of one date at a time and time
+    series functions those of one security, so that a single program can be
+    evaluated shard by shard on several threads. Results are gathered and
+    split again only where the program switches between the two kinds.
+
+    Use as a context manager, which holds the thread pool.
+
+    Parameters
+    ----------
+    section_groups : _GroupIndex
+        The grouping of the rows by date.
+
+    time_series_groups : _GroupIndex
+        The grouping of the rows by security.
+
+    n_workers : int
+        The number of threads, and the number of shards of each kind.
+
+    Attributes
+    ----------
+    n_reshuffles : int
+        The number of results gathered and split again to switch kind.
+
+    """
+
+    def __init__(self, section_groups, time_series_groups, n_workers):
+        self.n_rows = section_groups.n_samples
+        self.n_workers = n_workers
+        self.shards = {'section': self._split(section_groups, n_workers),
+                       'time_series': self._split(time_series_groups, n_workers)}
+        self.n_reshuffles = 0
+        self._executor = None
+
+    @staticmethod
+    def _split(groups, n_shards):
+        # 按样本数均衡地将连续的分组划分为若干片，每片至少一个分组，片内样本已按分组排列
+        n_shards = min(n_shards, groups.n_groups)
+        starts = [0]
+        for k in range(1, n_shards):
+            start = int(np.searchsorted(groups.offsets[1:], groups.n_samples * k / n_shards))
+            starts.append(min(max(start, starts[-1] + 1), groups.n_groups - (n_shards - k)))
+        starts.append(groups.n_groups)
+        shards = []
+        for begin, end in zip(starts[:-1], starts[1:]):
+            row_begin, row_end = int(groups.offsets[begin]), int(groups.offsets[end])
+            # 无需重排时为连续的切片，取分片时不复制
+            rows = slice(row_begin, row_end) if groups.order is None else groups.order[row_begin:row_end]
+            local = _GroupIndex.__new__(_GroupIndex)
+            local.n_samples = row_end - row_begin
+            local.offsets = groups.offsets[begin:end + 1] - row_begin
+            local.n_groups = end - begin
+            local.order = None
+            shards.append((rows, local))
+        return shards
+
+    def __enter__(self):
+        if self.n_workers > 1:
+            self._executor = ThreadPoolExecutor(self.n_workers)
+        return self
+
+    def __exit__(self, *exc_info):
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_executor'] = None
+        return state
+
+    def split(self, x, kind, broadcast=False):
+        """Split a full vector (or a scalar) into the shards of one kind."""
+        if np.ndim(x) == 0:
+            if broadcast:
+                return [np.full(local.n_samples, x) for _, local in self.shards[kind]]
+            return [x] * len(self.shards[kind])
+        return [x[rows] for rows, _ in self.shards[kind]]
+
+    def gather(self, parts, kind):
+        """Gather the shards of one kind into a full vector."""
+        result = np.empty(self.n_rows, dtype=np.result_type(*parts))
+        for (rows, _), part in zip(self.shards[kind], parts):
+            result[rows] = part
+        return result
+
+    def map(self, task, kind, parallel=True):
+        """Run task(shard) for every shard of one kind, on the threads if parallel."""
+        shards = range(len(self.shards[kind]))
+        if self._executor is None or not parallel:
+            return [task(shard) for shard in shards]
+        return list(self._executor.map(task, shards))
+
+
+def _segment_apply(groups, function, *args, **kwargs):
+    """Apply a function to every group of a _GroupIndex.
+
+    Scalars are passed unchanged to every call. A function with a
+    segment_function processes all groups at once, other callables are
+    called once per group on contiguous slices of the sorted arguments.
+
+    """
+    args = [groups.sort(arg) for arg in args]
+    segment_function = getattr(function, 'segment_function', None)
+    if segment_function is not None and not kwargs:
+        result = segment_function(groups.offsets, *args)
+    else:
+        vector_position = [i for i, arg in enumerate(args) if np.ndim(arg) > 0]
+        result_list = []
+        for start, end in zip(groups.offsets[:-1], groups.offsets[1:]):
+            _args = list(args)
+            for i in vector_position:
+                _args[i] = args[i][start:end]
+            result_list.append(function(*_args, **kwargs))
+        result = np.hstack(result_list)
+    return groups.unsort(result)
+
+
 def _groupby(gbx, func, *args, **kwargs):
-    indices = np.argsort(gbx)
-    gbx_sorted = gbx[indices]
-    X = np.column_stack((np.arange(len(gbx)), gbx_sorted, *args))
-    splits = np.split(X, np.unique(gbx_sorted, return_index=True)[1][1:])
-    result_list = [func(*(split[:, 2:].T), **kwargs) for split in splits]
-    result = np.hstack(result_list)
-    return result[indices.argsort()]
-
-
-
-
-add2 = _Function(function=np.add, name='add', arity=2)
-sub2 = _Function(function=np.subtract, name='sub', arity=2)
-mul2 = _Function(function=np.multiply, name='mul', arity=2)
-div2 = _Function(function=_protected_division, name='div', arity=2)
-sqrt1 = _Function(function=_protected_sqrt, name='sqrt', arity=1)
-log1 = _Function(function=_protected_log, name='log', arity=1)
-neg1 = _Function(function=np.negative, name='neg', arity=1)
-inv1 = _Function(function=_protected_inverse, name='inv', arity=1)
-abs1 = _Function(function=np.abs, name='abs', arity=1)
-max2 = _Function(function=np.maximum, name='max', arity=2)
-min2 = _Function(function=np.minimum, name='min', arity=2)
+    """Apply func to the args of each group of gbx, the result keeps the order of gbx."""
+    return _segment_apply(_GroupIndex(gbx), func, *args, **kwargs)
+
+
+add2 = _Function(function=np.add, name='add', arity=2, commutative=True, kernel='({0} + {1})')
+sub2 = _Function(function=np.subtract, name='sub', arity=2, self_value=0., kernel='({0} - {1})')
+mul2 = _Function(function=np.multiply, name='mul', arity=2, commutative=True, kernel='({0} * {1})')
+div2 = _Function(function=_protected_division, name='div', arity=2, accept_scalar=True, self_value=1.,
+                 kernel='({0} / {1} if abs({1}) > 0.001 else 1.)')
+sqrt1 = _Function(function=_protected_sqrt, name='sqrt', arity=1, accept_scalar=True, kernel='math.sqrt(abs({0}))')
+log1 = _Function(function=_protected_log, name='log', arity=1, accept_scalar=True,
+                 kernel='(math.log(abs({0})) if abs({0}) > 0.001 else 0.)')
+neg1 = _Function(function=np.negative, name='neg', arity=1, involution=True, kernel='(-{0})')
+inv1 = _Function(function=_protected_inverse, name='inv', arity=1, accept_scalar=True,
+                 kernel='(1. / {0} if abs({0}) > 0.001 else 0.)')
+abs1 = _Function(function=np.abs, name='abs', arity=1, idempotent=True, kernel='abs({0})')
+# 与np.maximum和np.minimum一致，任一参数为nan时结果为nan
+max2 = _Function(function=np.maximum, name='max', arity=2, commutative=True, idempotent=True,
+                 kernel='({0} if {0} >= {1} or {0} != {0} else {1})')
+min2 = _Function(function=np.minimum, name='min', arity=2, commutative=True, idempotent=True,
+                 kernel='({0} if {0} <= {1} or {0} != {0} else {1})')
+# numpy的三角函数经过向量化，比融合内核中逐元素调用更快，不提供内核
 sin1 = _Function(function=np.sin, name='sin', arity=1)
 cos1 = _Function(function=np.cos, name='cos', arity=1)
 tan1 = _Function(function=np.tan, name='tan', arity=1)
-sig1 = _Function(function=_sigmoid, name='sig', arity=1)
+sig1 = _Function(function=_sigmoid, name='sig', arity=1, accept_scalar=True,
+                 kernel='(1. / (1. + math.exp(-{0})))')
 
 _function_map = {'add': add2,
                  'sub': sub2,
@@ -9,11 +9,17 @@
 # @Software :PyCharm
 -------------------------------------------------
 """
-import itertools
+import hashlib
+import os
+import pickle
+import tempfile
+import threading
+import uuid
 from abc import ABCMeta, abstractmethod
-from time import time
+from contextlib import nullcontext
+from time import sleep, time
 from warnings import warn
-from copy import deepcopy
+from copy import copy, deepcopy
 
 import numpy as np
 import pandas as pd
@@ -27,29 +33,36 @@ from sklearn.utils.validation import check_array, _check_sample_weight
 from sklearn.utils.multiclass import check_classification_targets
 from sklearn.preprocessing import LabelEncoder
 
-from ._program import _Program
-from .fitness import _fitness_map, _Fitness
-from .functions import _function_map, _Function, sig1 as sigmoid
-from .utils import _partition_estimators
+from ._cache import _SubtreeCache, _get_buffer_pool, _get_fitness_memo, _get_subtree_cache, _load_dataset
+from ._cache import _migration_folder, _shared_dataset
+from ._cache import _worker_caches, _worker_memos
+from ._kernel import _kernel_dir
+from ._program import _Grammar, _Program, _Population, _function_table, _prune_ancestors
+from .fitness import _fitness_map, _Fitness, _Target
+from .functions import _function_map, _Function, _GroupIndex, _PanelLayout, _PanelShards, sig1 as sigmoid
+from .utils import _get_n_jobs, _partition_costs, _partition_estimators
 from .utils import check_random_state
 
 __all__ = ['SymbolicRegressor', 'SymbolicClassifier', 'SymbolicTransformer']
 
 MAX_INT = np.iinfo(np.int32).max
+# 面板数据按日期计算的指标
+_panel_metrics = ('mean ic', 'mean rank ic', 'icir')
+# 批量计算适应度时一个块的缓冲区大小上限
+_FITNESS_BLOCK_BYTES = 2 ** 20
+# 多进程时每个进程平均分到的批次数，批次由空闲的进程依次领取
+_BATCHES_PER_JOB = 4
 
 # 并行实现子树交叉，变异
-def _parallel_evolve(n_programs, parents, X, y, security_data, time_series_data, sample_weight, seeds, params):
+def _parallel_evolve(n_programs, parents, dataset, seeds, params):
     """
 
     Parameters
     ----------
     n_programs: 遗传代数
-    parents：父辈个体集合
-    X：原始特征
-    y：预测label
-    security_data：个体标记， 时序数据为none
-    time_series_data：时间标记， 界面数据为none
-    sample_weight：抽样比例
+    parents：父辈种群_Population，只包含树结构和适应度，第一代为None
+    dataset：训练数据字典，包括X, target, security_data, time_series_data, panel_layout，
+             多进程时为共享数据文件的路径
     seeds：随机种子
     params：参数
 
@@ -59,40 +72,138 @@ def _parallel_evolve(n_programs, parents, X, y, security_data, time_series_data,
     """
 
     """Private function used to build a batch of programs within a job."""
+    start_time = time()
+    dataset = _load_dataset(dataset)
+    X = dataset['X']
+    target = dataset['target']
+    sample_weight = target.sample_weight
     n_samples, n_features = X.shape
     # Unpack parameters
     tournament_size = params['tournament_size']
     function_dict = params['function_dict']
-    arities = params['arities']
-    init_depth = params['init_depth']
-    init_method = params['init_method']
-    const_range = params['const_range']
     metric = params['_metric']
-    transformer = params['_transformer']
-    parsimony_coefficient = params['parsimony_coefficient']
     method_probs = params['method_probs']
-    data_type = params['data_type']
-    p_point_replace = params['p_point_replace']
     max_samples = params['max_samples']
-    feature_names = params['feature_names']
-    cat_var_number = params['cat_var_number']
-    data_type = params['data_type']
 
     max_samples = int(max_samples * n_samples)
+    # 子树缓存跨代保留在进程中
+    cache = _get_subtree_cache(params['_cache_token'],
+                               int(params['subtree_cache_size'] * 2 ** 20))
+    # 同一父代的子代共享未改变子树的中间结果，只在本代内保留
+    # 跨代的子树缓存已包含这部分结果
+    lineage = None
+    if cache is None and params['lineage_cache_size']:
+        lineage = _SubtreeCache(int(params['lineage_cache_size'] * 2 ** 20))
+        cache = lineage
+    # 记录本批程序执行时中间结果占用的缓冲区峰值
+    pool = _get_buffer_pool(params['_cache_token'])
+    pool.reset_peak()
+    # 全样本评估时适应度只取决于树结构，已知的程序直接沿用
+    memo = _get_fitness_memo(params['_cache_token']) if max_samples == n_samples else None
+    memo_hits = memo.hits if memo is not None else 0
+    program_params = _program_params(params, n_features, dataset)
+    function_table = _function_table(function_dict)
+
+    # 父代以紧凑编码传入，被锦标赛选中时才构建_Program
+    if parents is not None:
+        # 线程池中各任务共享同一父代对象
+        parent_population = copy(parents)
+        parent_population.function_table = function_table
+        parents = {}
+
+    # 语义等价（探针样本上结果相同）的程序沿用代表程序的适应度，同样只用于全样本评估。
+    # 已知的指纹只取自父代，所有任务相同，结果不受批次划分和进程的影响
+    semantic = None
+    if memo is not None and params['fingerprint_size']:
+        semantic = {}
+        if parents is not None and parent_population.fingerprints is not None:
+            for fingerprint, raw, eliminated in zip(parent_population.fingerprints,
+                                                    parent_population.raw_fitness_,
+                                                    parent_population.eliminated):
+                if fingerprint and not eliminated:
+                    semantic.setdefault(fingerprint, raw)
 
     def _tournament():
         # 从所有父代中随机选择tournament_size个，取其中最优个体子代
         """Find the fittest individual from a sub-population."""
-        contenders = random_state.randint(0, len(parents), tournament_size)
-        fitness = [parents[p].fitness_ for p in contenders]
+        contenders = random_state.randint(0, len(parent_population), tournament_size)
+        fitness = parent_population.fitness_[contenders]
         if metric.greater_is_better:
             parent_index = contenders[np.argmax(fitness)]
         else:
             parent_index = contenders[np.argmin(fitness)]
+        if parent_index not in parents:
+            parents[parent_index] = _Program(random_state=None,
+                                             program=parent_population.nodes(parent_index),
+                                             **program_params)
+            # 竞速淘汰的父代适应度不是全部数据上的值，不能沿用
+            if memo is not None and not parent_population.eliminated[parent_index]:
+                memo.put(parents[parent_index]._subtree_signatures()[0][0],
+                         parent_population.raw_fitness_[parent_index])
         return parents[parent_index], parent_index
 
+    # 适应度按块批量计算，块内预测值和样本权重的缓冲区在所有程序间复用
+    subsample = max_samples < n_samples
+    block_size = max(1, min(n_programs, _FITNESS_BLOCK_BYTES // ((3 if subsample else 1) * 8 * n_samples)))
+    block_pred = np.empty((block_size, n_samples))
+    if subsample:
+        in_bag = np.empty(n_samples, dtype=bool)
+        block_weight = np.empty((block_size, n_samples))
+        block_oob_weight = np.empty((block_size, n_samples))
+    # 块中等待计算适应度的程序，全样本时相同结构的程序只计算一次
+    pending = {}
+    n_pending_reused = 0
+
+    def _score_block():
+        n_rows = len(pending)
+        if subsample:
+            raw_fitness = metric.batch(target, block_pred[:n_rows], block_weight[:n_rows])
+            oob_fitness = metric.batch(target, block_pred[:n_rows], block_oob_weight[:n_rows])
+            for (program, ), raw, oob in zip(pending.values(), raw_fitness, oob_fitness):
+                program.raw_fitness_, program.oob_fitness_ = raw, oob
+        else:
+            raw_fitness = metric.batch(target, block_pred[:n_rows], sample_weight)
+            for (signature, waiting), raw in zip(pending.items(), raw_fitness):
+                memo.put(signature, raw)
+                for program in waiting:
+                    program.raw_fitness_ = raw
+        pending.clear()
+
+    def _race(candidates, subset):
+        # 在数据子集上按块计算候选程序的适应度
+        subset_target = subset['target']
+        n_rows = subset['X'].shape[0]
+        size = max(1, _FITNESS_BLOCK_BYTES // ((2 if subsample else 1) * 8 * n_rows))
+        scores = np.empty(len(candidates))
+        for begin in range(0, len(candidates), size):
+            block = candidates[begin:begin + size]
+            pred = np.empty((len(block), n_rows))
+            weight = np.empty((len(block), n_rows)) if subsample else subset_target.sample_weight
+            for row, i in enumerate(block):
+                program = programs[i].with_data(subset['security_data'],
+                                                subset['time_series_data'],
+                                                subset['panel_layout'])
+                eval_start = time()
+                y_pred = program.execute(subset['X'])
+                if program.transformer:
+                    y_pred = program.transformer(y_pred)
+                pred[row] = y_pred
+                eval_time[i] = np.nan_to_num(eval_time[i]) + time() - eval_start
+                if subsample:
+                    # 子集上只使用程序的样本内数据
+                    _, not_indices = programs[i].get_all_indices(n_samples, max_samples, random_states[i])
+                    in_bag.fill(True)
+                    in_bag[not_indices] = False
+                    np.multiply(subset_target.sample_weight, in_bag[subset['rows']], out=weight[row])
+            scores[begin:begin + len(block)] = metric.batch(subset_target, pred, weight)
+        return scores
+
     # Build programs
     programs = []
+    random_states = []
+    scopes = []
+    # 每个程序执行所用的时间，用于估计下一代子代的计算代价
+    eval_time = np.full(n_programs, np.nan)
 
     for i in range(n_programs):
 
@@ -140,46 +251,518 @@ def _parallel_evolve(n_programs, parents, X, y, security_data, time_series_data,
                           'parent_idx': parent_index,
                           'parent_nodes': []}
 
-        program = _Program(function_dict=function_dict,
-                           arities=arities,
-                           init_depth=init_depth,
-                           init_method=init_method,
-                           n_features=n_features,
-                           metric=metric,
-                           transformer=transformer,
-                           const_range=const_range,
-                           p_point_replace=p_point_replace,
-                           parsimony_coefficient=parsimony_coefficient,
-                           data_type=data_type,
-                           feature_names=feature_names,
-                           random_state=random_state,
-                           cat_var_number = cat_var_number,
-                           program=program)
+        program = _Program(random_state=random_state, program=program, **program_params)
+
+        if lineage is not None:
+            # 只保存取自父代和供体的子树结果，其余子树不会被同代的其他子代复用
+            scope = set()
+            if genome is not None:
+                scope.update(parent._subtree_signatures()[0])
+                if 'donor_idx' in genome:
+                    scope.update(donor._subtree_signatures()[0])
+            scopes.append(scope)
 
         program.parents = genome
+        programs.append(program)
+        random_states.append(random_state)
+
+    # 探针样本上结果相同的程序只评估第一个作为代表，其余的克隆沿用其适应度。
+    # 所有程序都计算指纹，克隆是否沿用代表的适应度与适应度记录的内容无关
+    clones = {}
+    fingerprints = None
+    if semantic is not None:
+        fingerprints = [_fingerprint(program, dataset['probe']) for program in programs]
+        representatives = {}
+        for i, (program, fingerprint) in enumerate(zip(programs, fingerprints)):
+            program.raw_fitness_ = semantic.get(fingerprint)
+            if program.raw_fitness_ is not None:
+                clones[i] = None
+            elif fingerprint in representatives:
+                clones[i] = representatives[fingerprint]
+            else:
+                representatives[fingerprint] = i
+
+    # 竞速评估：先在较小的数据子集上评估，排名靠前的程序晋级到更大的子集，
+    # 只有最终的幸存者在全部数据上计算适应度
+    eliminated = {}
+    if params['racing_schedule'] is not None:
+        candidates = [i for i in range(n_programs) if i not in clones and
+                      (memo is None or programs[i]._subtree_signatures()[0][0] not in memo)]
+        for (_, keep), subset in zip(params['racing_schedule'], dataset['racing']):
+            if not candidates:
+                break
+            scores = _race(candidates, subset)
+            # nan视为最差
+            ranking = np.where(np.isnan(scores), -np.inf, scores * metric.sign)
+            order = np.argsort(-ranking, kind='stable')
+            n_keep = max(1, int(np.ceil(keep * len(candidates))))
+            for j in order[n_keep:]:
+                eliminated[candidates[j]] = scores[j]
+            candidates = [candidates[j] for j in np.sort(order[:n_keep])]
+
+    for i, program in enumerate(programs):
+        if i in eliminated or i in clones:
+            continue
+
+        if lineage is not None:
+            lineage.scope = scopes[i]
 
         # Draw samples, using sample weights, and then fit
-        if sample_weight is None:
-            curr_sample_weight = np.ones((n_samples,))
-        else:
-            curr_sample_weight = sample_weight.copy()
-        oob_sample_weight = curr_sample_weight.copy()
-
         indices, not_indices = program.get_all_indices(n_samples,
                                                        max_samples,
-                                                       random_state)
+                                                       random_states[i])
+
+        if subsample:
+            # 样本内外的权重由同一掩码得到，程序只计算一次
+            row = len(pending)
+            in_bag.fill(True)
+            in_bag[not_indices] = False
+            np.multiply(sample_weight, in_bag, out=block_weight[row])
+            np.subtract(sample_weight, block_weight[row], out=block_oob_weight[row])
+            pending[i] = [program]
+        else:
+            signature = program._subtree_signatures()[0][0]
+            program.raw_fitness_ = memo.get(signature)
+            if program.raw_fitness_ is not None:
+                continue
+            if signature in pending:
+                pending[signature].append(program)
+                n_pending_reused += 1
+                continue
+            row = len(pending)
+            pending[signature] = [program]
+
+        eval_start = time()
+        y_pred = program.execute(X, cache)
+        if program.transformer:
+            y_pred = program.transformer(y_pred)
+        block_pred[row] = y_pred
+        eval_time[i] = np.nan_to_num(eval_time[i]) + time() - eval_start
+        if len(pending) == block_size:
+            _score_block()
+
+    if pending:
+        _score_block()
+
+    for i, representative in clones.items():
+        if representative is None:
+            continue
+        if representative in eliminated:
+            eliminated[i] = eliminated[representative]
+        else:
+            programs[i].raw_fitness_ = programs[representative].raw_fitness_
+
+    if eliminated:
+        # 淘汰的程序沿用子集上的适应度，但排在所有幸存者之后
+        survivors = [program.raw_fitness_ for i, program in enumerate(programs) if i not in eliminated]
+        if metric.greater_is_better:
+            bound = np.nextafter(np.nanmin(survivors), -np.inf)
+            cap = np.fmin
+        else:
+            bound = np.nextafter(np.nanmax(survivors), np.inf)
+            cap = np.fmax
+        for i, score in eliminated.items():
+            programs[i].raw_fitness_ = float(cap(score, bound))
+            if subsample:
+                programs[i].oob_fitness_ = np.nan
+
+    # 以紧凑编码传回主进程
+    for program, seconds in zip(programs, eval_time):
+        program.eval_time_ = seconds
+    population = _Population(programs, function_table)
+    population.n_fitness_reused = memo.hits - memo_hits + n_pending_reused if memo is not None else 0
+    population.n_clones = len(clones)
+    population.fingerprints = fingerprints
+    population.eliminated[list(eliminated)] = True
+    population.peak_buffer_bytes = pool.peak_bytes
+    population.busy_times = [((os.getpid(), threading.get_ident()), time() - start_time)]
+    return population
+
+
+def _program_params(params, n_features, dataset):
+    """Get the constructor parameters shared by all programs of a fit."""
+    return {'function_dict': params['function_dict'],
+            'arities': params['arities'],
+            'init_depth': params['init_depth'],
+            'init_method': params['init_method'],
+            'n_features': n_features,
+            'metric': params['_metric'],
+            'transformer': params['_transformer'],
+            'const_range': params['const_range'],
+            'p_point_replace': params['p_point_replace'],
+            'parsimony_coefficient': params['parsimony_coefficient'],
+            'data_type': params['data_type'],
+            'feature_names': params['feature_names'],
+            'cat_var_number': params['cat_var_number'],
+            'security_data': dataset['security_data'],
+            'time_series_data': dataset['time_series_data'],
+            'panel_layout': dataset['panel_layout'],
+            'simplify': params['simplify'],
+            'grammar': params['_grammar']}
+
+
+def _share_clone_fitness(population):
+    """Give every clone the fitness of the first program with its fingerprint.
+
+    Each job only knows the clones within its own batch, so across batches
+    the representative of a fingerprint is the program with the lowest index
+    in the generation, whatever the number of jobs.
 
-        curr_sample_weight[not_indices] = 0
-        oob_sample_weight[indices] = 0
+    """
+    if population.fingerprints is None:
+        return
+    representatives = {}
+    for i, fingerprint in enumerate(population.fingerprints):
+        representative = representatives.setdefault(fingerprint, i)
+        if representative != i:
+            population.raw_fitness_[i] = population.raw_fitness_[representative]
+            population.eliminated[i] = population.eliminated[representative]
+
+
+def _offspring_costs(population, seeds, params):
+    """Estimate the cost of building and evaluating each offspring.
+
+    The tournament of every offspring is replayed from its seed, without
+    building any program, to find the parent it is derived from. An offspring
+    is expected to take as long to evaluate as its parent did, and parents
+    whose fitness was reused are costed by their length at the average time
+    per node of the generation, so that function costs, window sizes and the
+    data size are all accounted for by the measured times. Reproductions on
+    all samples reuse the fitness of their parent and only cost the overhead
+    per program measured in the generation.
+
+    Racing ranks offspring within each batch, so with a racing schedule the
+    batches must not depend on timings: parents are then costed by their
+    length only, plus one node of overhead per program.
 
-        program.raw_fitness_ = program.raw_fitness(X, y, curr_sample_weight)
-        if max_samples < n_samples:
-            # Calculate OOB fitness
-            program.oob_fitness_ = program.raw_fitness(X, y, oob_sample_weight)
+    """
+    length = population.length_
+    if params['racing_schedule'] is not None:
+        parent_cost = length.astype(np.float64)
+        overhead = 1.
+    else:
+        eval_time = population.eval_time_
+        measured = ~np.isnan(eval_time)
+        per_node = np.sum(eval_time[measured]) / max(np.sum(length[measured]), 1)
+        parent_cost = np.where(measured, eval_time, per_node * length)
+        busy = sum(seconds for _, seconds in population.busy_times)
+        overhead = max(busy - np.sum(eval_time[measured]), 0.) / len(population)
+    metric = params['_metric']
+    reproduce = params['method_probs'][3]
+    reused = params['max_samples'] >= 1.0
+    costs = np.empty(len(seeds))
+    for i, seed in enumerate(seeds):
+        # 与_parallel_evolve中相同的随机数序列
+        random_state = check_random_state(seed)
+        method = random_state.uniform()
+        contenders = random_state.randint(0, len(population), params['tournament_size'])
+        fitness = population.fitness_[contenders]
+        parent = contenders[np.argmax(fitness) if metric.greater_is_better else np.argmin(fitness)]
+        costs[i] = overhead + (0. if reused and method >= reproduce else parent_cost[parent])
+    return costs
+
+
+def _rescore(population, n_finalists, X, target, metric, shard_workers=None):
+    """Re-score the best programs of a population on float64 data.
+
+    The n_finalists programs with the best raw fitness are evaluated again on
+    X, on the same in-sample rows as during the search, and their fitness in
+    the population is updated. Panel data is split across shard_workers
+    threads, see `_panel_shards`.
 
-        programs.append(program)
+    Returns
+    -------
+    fitness : array, shape = [len(population)]
+        The new raw fitness of the finalists, the other programs get the worst
+        possible value so that only finalists are selected.
 
-    return programs
+    """
+    raw_fitness = population.raw_fitness_
+    ranking = np.where(np.isnan(raw_fitness), -np.inf, raw_fitness * metric.sign)
+    finalists = np.argsort(-ranking, kind='stable')[:n_finalists]
+    with _panel_shards(population[finalists[0]], shard_workers) as shards:
+        for i in finalists:
+            program = population[i]
+            if population.has_oob:
+                _, not_indices = program.get_all_indices()
+                oob_sample_weight = np.zeros(len(target.y))
+                oob_sample_weight[not_indices] = target.sample_weight[not_indices]
+                raw, population.oob_fitness_[i] = program.raw_fitness_oob(
+                    X, target.y, target.sample_weight - oob_sample_weight, oob_sample_weight, shards=shards)
+            else:
+                raw = program.raw_fitness(X, target.y, target.sample_weight, shards=shards)
+            population.fitness_[i] += raw - raw_fitness[i]
+            raw_fitness[i] = raw
+    fitness = np.full(len(population), -np.inf * metric.sign)
+    fitness[finalists] = raw_fitness[finalists]
+    return fitness
+
+
+def _evolve_islands(islands, populations, dataset, seeds, migrations, folder, params):
+    """Evolve some of the islands of an island-model fit within one job.
+
+    Every island evolves its own sub-population for all generations of the
+    fit, and after the generations listed in migrations its best programs
+    replace the worst programs of the islands it is a source of. The islands
+    of other jobs are reached through small files in folder, so that jobs
+    only wait for each other at migrations and never send whole populations.
+
+    Parameters
+    ----------
+    islands : list of int
+        The islands evolved by this job.
+
+    populations : list of _Population or None
+        The last generation of each island, None when starting from scratch.
+
+    dataset : dict or str
+        The training data, see `_parallel_evolve`.
+
+    seeds : list of array, shape = [n_generations, island_size]
+        The random seeds of the programs of each island per generation.
+
+    migrations : dict
+        The sources of the immigrants of every island, by the generation
+        (counted from the start of this call) after which they migrate.
+
+    folder : str or None
+        The folder through which migrants are exchanged with other jobs, None
+        if this job evolves all islands.
+
+    params : dict
+        The parameters of the fit.
+
+    Returns
+    -------
+    populations : list of _Population
+        The last generation of each island, with the parents of its programs
+        indexed in the previous generation of the whole population.
+
+    records : list of list of dict
+        The summary of every generation of each island.
+
+    """
+    metric = params['_metric']
+    n_islands = params['n_islands']
+    n_migrants = params['migration_size']
+    # 各岛屿在整个种群中的起始位置，父代索引换算为整个种群中的位置，迁移后仍然有效
+    _, _, island_starts = _partition_estimators(params['population_size'], n_islands)
+    populations = list(populations)
+    records = [[] for _ in islands]
+    # 本进程的岛屿是否已达到停止条件，在下次迁移时通知所有岛屿
+    stop = False
+    try:
+        for generation in range(len(seeds[0])):
+            start_time = time()
+            for k in range(len(islands)):
+                parents = None if populations[k] is None else populations[k].for_selection()
+                population = _parallel_evolve(len(seeds[k][generation]), parents, dataset,
+                                              seeds[k][generation], params)
+                population.genealogy.shift(island_starts[islands[k]])
+                fitness = population.raw_fitness_
+                length = population.length_
+                parsimony_coefficient = params['parsimony_coefficient']
+                if parsimony_coefficient == 'auto':
+                    parsimony_coefficient = np.cov(length, fitness)[1, 0] / np.var(length)
+                population.fitness_ = fitness - parsimony_coefficient * length * metric.sign
+                populations[k] = population
+
+                best = np.argmax(fitness) if metric.greater_is_better else np.argmin(fitness)
+                records[k].append({'length': np.sum(length),
+                                   'fitness': np.sum(fitness),
+                                   'best_length': int(length[best]),
+                                   'best_fitness': fitness[best],
+                                   'best_oob_fitness': population.oob_fitness_[best],
+                                   'n_fitness_reused': population.n_fitness_reused,
+                                   'n_clones': population.n_clones,
+                                   'peak_buffer_bytes': population.peak_buffer_bytes,
+                                   'busy_times': population.busy_times})
+                if metric.greater_is_better:
+                    stop |= fitness[best] >= params['stopping_criteria']
+                else:
+                    stop |= fitness[best] <= params['stopping_criteria']
+
+            if generation in migrations:
+                # 迁出各岛屿选择适应度最优的程序，nan视为最差
+                emigrants = {}
+                for k, island in enumerate(islands):
+                    ranking = np.where(np.isnan(populations[k].fitness_), -np.inf,
+                                       populations[k].fitness_ * metric.sign)
+                    emigrants[island] = (populations[k].subset(np.argsort(-ranking, kind='stable')[:n_migrants]),
+                                         stop)
+                    emigrants[island][0].function_table = None
+                emigrants = _exchange_migrants(emigrants, n_islands, generation, folder)
+                # 任一岛屿达到停止条件时，所有岛屿在本次迁移后一起停止
+                stop = any(flag for _, flag in emigrants.values())
+                if not stop and n_migrants:
+                    for k, island in enumerate(islands):
+                        pool = _Population.concatenate([emigrants[source][0] for source in migrations[generation][island]])
+                        ranking = np.where(np.isnan(pool.fitness_), -np.inf, pool.fitness_ * metric.sign)
+                        immigrants = pool.subset(np.argsort(-ranking, kind='stable')[:n_migrants])
+                        # 迁入的程序替换本岛屿适应度最差的程序
+                        ranking = np.where(np.isnan(populations[k].fitness_), -np.inf,
+                                           populations[k].fitness_ * metric.sign)
+                        keep = np.sort(np.argsort(-ranking, kind='stable')[:len(ranking) - len(immigrants)])
+                        populations[k] = _Population.concatenate([populations[k].subset(keep), immigrants])
+
+            generation_time = time() - start_time
+            for k in range(len(islands)):
+                records[k][-1]['generation_time'] = generation_time
+            if stop and generation in migrations:
+                break
+    except BaseException:
+        # 通知其他进程停止等待本进程的迁移
+        if folder is not None:
+            open(os.path.join(folder, 'abort'), 'w').close()
+        raise
+
+    return populations, records
+
+
+def _exchange_migrants(emigrants, n_islands, generation, folder):
+    """Publish the migrants of the islands of this job and collect those of all islands."""
+    if folder is None:
+        return emigrants
+    for island, message in emigrants.items():
+        # 先写入临时文件再改名，避免其他进程读到不完整的文件
+        fd, temp_path = tempfile.mkstemp(suffix='.tmp', dir=folder)
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump(message, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_path, os.path.join(folder, 'migrants_%d_%d.pkl' % (generation, island)))
+    collected = dict(emigrants)
+    delay = 1e-3
+    while True:
+        for island in range(n_islands):
+            path = os.path.join(folder, 'migrants_%d_%d.pkl' % (generation, island))
+            if island not in collected and os.path.exists(path):
+                with open(path, 'rb') as f:
+                    collected[island] = pickle.load(f)
+        if len(collected) == n_islands:
+            return collected
+        if os.path.exists(os.path.join(folder, 'abort')):
+            raise RuntimeError('Another job of the island-model fit failed.')
+        sleep(delay)
+        delay = min(2 * delay, 0.05)
+
+
+def _check_signature(signatures, function):
+    """Reject a function whose signature is already used by another function of the set.
+
+    The same function may be listed several times, but different functions
+    sharing a signature, e.g. two lambdas given the same name, would share
+    cached results, fitness records and parameter types.
+
+    """
+    if signatures.setdefault(function.signature, function) is not function:
+        raise ValueError('Different functions with the signature %s found in `function_set`, '
+                         'give each function a distinct name.' % function.signature)
+
+
+def _panel_shards(program, shard_workers):
+    """Get the shards to evaluate programs on the panel data of a program.
+
+    The dates and securities of the data are split across shard_workers
+    threads, in joblib convention. Returns a null context, giving None, for
+    other data or a single worker.
+
+    """
+    if program.data_type != 'panel' or shard_workers is None or _get_n_jobs(shard_workers) == 1:
+        return nullcontext()
+    if program.panel_layout is not None:
+        return _PanelShards(program.panel_layout.section_groups, program.panel_layout.time_series_groups,
+                            _get_n_jobs(shard_workers))
+    return _PanelShards(program.time_series_data, program.security_data, _get_n_jobs(shard_workers))
+
+
+def _subset_dataset(rows, X, y, sample_weight, data_type, metric, time_series_data, security_data,
+                    panel_layout, time_series_keys, security_keys):
+    """Get the training data restricted to some rows, with its own panel grouping."""
+    subset = {'X': X[rows],
+              'security_data': None,
+              'time_series_data': None,
+              'panel_layout': None}
+    if data_type == 'panel':
+        subset['time_series_data'] = _GroupIndex(time_series_keys[rows])
+        subset['security_data'] = _GroupIndex(security_keys[rows])
+        if panel_layout is not None:
+            subset['panel_layout'] = _PanelLayout(time_series_keys[rows], security_keys[rows])
+    else:
+        if time_series_data is not None:
+            subset['time_series_data'] = time_series_data[rows]
+        if security_data is not None:
+            subset['security_data'] = security_data[rows]
+    subset['target'] = _Target(y[rows],
+                               sample_weight[rows] if sample_weight is not None else None,
+                               subset['time_series_data'] if metric.panel else None)
+    return subset
+
+
+def _racing_subset(fraction, X, y, sample_weight, data_type, metric, time_series_data, security_data,
+                   panel_layout, time_series_keys, security_keys):
+    """Get the most recent part of the training data used by one racing stage.
+
+    Panel data is cut at whole dates, so that time series functions see
+    every security over the same contiguous block of dates, whatever the
+    order of the rows.
+
+    """
+    n_samples = X.shape[0]
+    rows = None
+    if data_type == 'panel':
+        n_dates = max(1, int(np.ceil(fraction * time_series_data.n_groups)))
+        start = int(time_series_data.offsets[-1 - n_dates])
+        if time_series_data.order is not None:
+            # 偏移量是按日期排序后的位置，需映射回原始行号
+            rows = np.sort(time_series_data.order[start:])
+    else:
+        start = n_samples - max(2, int(np.ceil(fraction * n_samples)))
+    if rows is None:
+        rows = slice(start, n_samples)
+    subset = _subset_dataset(rows, X, y, sample_weight, data_type, metric,
+                             time_series_data, security_data, panel_layout, time_series_keys, security_keys)
+    subset['rows'] = rows
+    return subset
+
+
+def _probe_dataset(size, max_window, X, y, sample_weight, data_type, metric, time_series_data, security_data,
+                   panel_layout, time_series_keys, security_keys):
+    """Get the fixed probe rows on which programs are fingerprinted.
+
+    Section data uses a fixed random sample of rows. Time series data uses
+    its most recent rows and panel data the most recent dates of a few
+    securities, always covering at least twice the longest time series
+    window so that different windows give different results.
+
+    """
+    n_samples = X.shape[0]
+    if data_type == 'section':
+        rows = np.sort(np.random.RandomState(0).choice(n_samples, min(size, n_samples), replace=False))
+    elif data_type == 'time_series':
+        rows = np.arange(max(0, n_samples - max(size, 2 * max_window)), n_samples)
+    else:
+        securities = np.unique(security_keys)
+        securities = securities[np.linspace(0, len(securities) - 1, min(len(securities), 8)).astype(int)]
+        dates = np.unique(time_series_keys)
+        dates = dates[-max(int(np.ceil(size / len(securities))), 2 * max_window):]
+        rows = np.flatnonzero(np.isin(security_keys, securities) & np.isin(time_series_keys, dates))
+    return _subset_dataset(rows, X, y, sample_weight, data_type, metric,
+                           time_series_data, security_data, panel_layout, time_series_keys, security_keys)
+
+
+def _fingerprint(program, probe):
+    """Hash the output of a program on the probe rows.
+
+    Programs with the same fingerprint are treated as semantically
+    equivalent. The output is rounded to float32, so programs differing
+    only by floating point error share a fingerprint.
+
+    """
+    y_pred = program.with_data(probe['security_data'],
+                               probe['time_series_data'],
+                               probe['panel_layout']).execute(probe['X'])
+    # 加0使-0与0相同
+    y_pred = np.broadcast_to(np.asarray(y_pred, dtype=np.float32), (probe['X'].shape[0],)) + np.float32(0.)
+    return hashlib.blake2b(y_pred.tobytes(), digest_size=16).digest()
 
 
 class BaseSymbolic(BaseEstimator, metaclass=ABCMeta):
@@ -189,6 +772,21 @@ class BaseSymbolic(BaseEstimator, metaclass=ABCMeta):
     Warning: This class should not be used directly.
     Use derived classes instead.
 
+    Notes
+    -----
+    The evaluation caches are off by default, their budgets are in megabytes
+    and apply to every worker, i.e. every process of the processes backend,
+    every thread of the threads backend and every island job:
+
+    subtree_cache_size : float, optional (default=0)
+        Results of subtrees shared between programs, kept across
+        generations.
+
+    lineage_cache_size : float, optional (default=0)
+        Used when subtree_cache_size is 0, results of the subtrees of the
+        parents of the current batch, reused by their offspring. Up to the
+        whole budget is held while a batch is evaluated.
+
     """
 
     @abstractmethod
@@ -221,9 +819,23 @@ class BaseSymbolic(BaseEstimator, metaclass=ABCMeta):
                  category_features=None,
                  warm_start=False,
                  low_memory=False,
+                 subtree_cache_size=0,
+                 lineage_cache_size=0,
+                 racing_schedule=None,
+                 fingerprint_size=0,
+                 simplify=None,
+                 fuse_kernels=False,
+                 dtype='float64',
+                 n_islands=None,
+                 migration_interval=5,
+                 migration_size=1,
+                 migration_topology='ring',
                  n_jobs=1,
+                 backend='processes',
+                 shard_workers=None,
                  verbose=0,
                  data_type='section',
+                 panel_layout='long',
                  random_state=None):
 
         self.population_size = population_size
@@ -252,10 +864,24 @@ class BaseSymbolic(BaseEstimator, metaclass=ABCMeta):
         self.security_index = security_index
         self.warm_start = warm_start
         self.low_memory = low_memory
+        self.subtree_cache_size = subtree_cache_size
+        self.lineage_cache_size = lineage_cache_size
+        self.racing_schedule = racing_schedule
+        self.fingerprint_size = fingerprint_size
+        self.simplify = simplify
+        self.fuse_kernels = fuse_kernels
+        self.dtype = dtype
+        self.n_islands = n_islands
+        self.migration_interval = migration_interval
+        self.migration_size = migration_size
+        self.migration_topology = migration_topology
         self.n_jobs = n_jobs
+        self.backend = backend
+        self.shard_workers = shard_workers
         self.verbose = verbose
         self.random_state = random_state
         self.data_type = data_type
+        self.panel_layout = panel_layout
         self.tolerable_corr = tolerable_corr
 
     # 打印训练日志
@@ -336,9 +962,19 @@ class BaseSymbolic(BaseEstimator, metaclass=ABCMeta):
             if not isinstance(X, pd.DataFrame):
                 raise ValueError('with security ot time index, data structure should be DataFrame')
 
+        # 检查面板数据的存储方式
+        if self.panel_layout not in ('long', 'dense'):
+            raise ValueError('Valid panel_layout methods include "long" and "dense". Given %s.'
+                             % self.panel_layout)
+        if self.panel_layout == 'dense' and self.data_type != 'panel':
+            raise ValueError('panel_layout "dense" is only valid for panel data.')
+
         # 检查时间index和个股index， 对于截面，时序和面板数据分别检查
         security_data = None
         time_series_data = None
+        panel_layout = None
+        time_series_keys = None
+        security_keys = None
         if self.data_type == 'section':
             if self.time_series_index is not None:
                 raise ValueError('For Section Data, time_series_index should be None')
@@ -412,6 +1048,19 @@ class BaseSymbolic(BaseEstimator, metaclass=ABCMeta):
             X, y = X_combine.loc[:, self.feature_names], X_combine.loc[:, '_label']
             time_series_data = X.index.get_level_values(self.time_series_index).values
             security_data = X.index.get_level_values(self.security_index).values
+            # 稠密布局下时序函数沿日期计算，截面函数沿个股计算，缺失位置补nan
+            if self.panel_layout == 'dense':
+                panel_layout = _PanelLayout(time_series_data, security_data)
+                if not panel_layout.balanced:
+                    # 补齐的nan会进入截面函数和时序窗口，结果与长表格式不同
+                    raise ValueError('panel_layout "dense" requires every date to have exactly one sample '
+                                     'of every security, got %d samples for %d dates x %d securities. '
+                                     'Use panel_layout "long" for unbalanced panels.'
+                                     % (panel_layout.n_samples, panel_layout.n_dates, panel_layout.n_securities))
+            # 分组索引只构建一次，供所有时序和截面函数复用
+            time_series_keys, security_keys = time_series_data, security_data
+            time_series_data = _GroupIndex(time_series_data)
+            security_data = _GroupIndex(security_data)
 
         # 检查category_features是否与全包含在feature_names中
         # 当存在分类数据时，输入数据类型必须为pd。DataFrame
@@ -501,16 +1150,21 @@ class BaseSymbolic(BaseEstimator, metaclass=ABCMeta):
         self._function_dict = {'number': [], 'category': []}
         # 检验是否存在接受分类变量参数的函数
         _cat_func_flag = False
+        # 函数标识用作子树缓存、适应度记录和查找表的键，不同函数的标识不能相同
+        _signatures = {}
         for function in self.function_set:
             # 类型检验
             if isinstance(function, str):
                 if function not in _function_map:
                     raise ValueError('invalid function name %s found in '
                                      '`function_set`.' % function)
-                function = deepcopy(_function_map[function])
+                function = _function_map[function]
+                _check_signature(_signatures, function)
+                function = deepcopy(function)
                 function.add_range(self.const_range)
                 self._function_dict['number'].append(function)
             elif isinstance(function, _Function):
+                _check_signature(_signatures, function)
                 function = deepcopy(function)
                 # 添加常数范围
                 function.add_range(self.const_range)
@@ -549,7 +1203,7 @@ class BaseSymbolic(BaseEstimator, metaclass=ABCMeta):
             self._metric = self.metric
         elif isinstance(self, RegressorMixin):
             if self.metric not in ('mean absolute error', 'mse', 'rmse',
-                                   'pearson', 'spearman'):
+                                   'pearson', 'spearman') + _panel_metrics:
                 raise ValueError('Unsupported metric: %s' % self.metric)
             self._metric = _fitness_map[self.metric]
         elif isinstance(self, ClassifierMixin):
@@ -557,9 +1211,12 @@ class BaseSymbolic(BaseEstimator, metaclass=ABCMeta):
                 raise ValueError('Unsupported metric: %s' % self.metric)
             self._metric = _fitness_map[self.metric]
         elif isinstance(self, TransformerMixin):
-            if self.metric not in ('pearson', 'spearman'):
+            if self.metric not in ('pearson', 'spearman') + _panel_metrics:
                 raise ValueError('Unsupported metric: %s' % self.metric)
             self._metric = _fitness_map[self.metric]
+        # 面板指标按日期分组计算
+        if self._metric.panel and self.data_type != 'panel':
+            raise ValueError('Metric %s is only valid for panel data.' % self.metric)
 
         # 检查概率参数
         # todo 增加交叉变异方法后需要修改此处
@@ -587,6 +1244,88 @@ class BaseSymbolic(BaseEstimator, metaclass=ABCMeta):
             raise ValueError('init_depth should be in increasing numerical '
                              'order: (min_depth, max_depth).')
 
+        # 检查子树缓存大小
+        if not isinstance(self.subtree_cache_size, (int, float)) or self.subtree_cache_size < 0:
+            raise ValueError('subtree_cache_size should be a non-negative number '
+                             'of megabytes, got %r.' % self.subtree_cache_size)
+        if not isinstance(self.lineage_cache_size, (int, float)) or self.lineage_cache_size < 0:
+            raise ValueError('lineage_cache_size should be a non-negative number '
+                             'of megabytes, got %r.' % self.lineage_cache_size)
+
+        # 检查竞速评估的晋级计划
+        if self.racing_schedule is not None:
+            schedule = list(self.racing_schedule)
+            if not schedule or not all(isinstance(stage, (tuple, list)) and len(stage) == 2 for stage in schedule):
+                raise ValueError('racing_schedule should be a non-empty sequence of '
+                                 '(data_fraction, keep_fraction) pairs, got %r.' % (self.racing_schedule,))
+            fractions = [stage[0] for stage in schedule]
+            if not all(0 < fraction < 1 for fraction in fractions) or fractions != sorted(set(fractions)):
+                raise ValueError('The data fractions of racing_schedule should be '
+                                 'increasing and in (0, 1), got %r.' % (self.racing_schedule,))
+            if not all(0 < stage[1] <= 1 for stage in schedule):
+                raise ValueError('The keep fractions of racing_schedule should be '
+                                 'in (0, 1], got %r.' % (self.racing_schedule,))
+
+        # 检查语义指纹的探针样本数
+        if not isinstance(self.fingerprint_size, (int, np.integer)) or self.fingerprint_size < 0:
+            raise ValueError('fingerprint_size should be a non-negative integer, got %r.'
+                             % self.fingerprint_size)
+
+        # 检查化简模式
+        if self.simplify not in (None, 'execute', 'store'):
+            raise ValueError('Valid simplify modes include None, "execute" and "store". Given %s.'
+                             % self.simplify)
+
+        # 检查融合内核的缓存目录
+        if not isinstance(self.fuse_kernels, (bool, str)):
+            raise ValueError('fuse_kernels should be a bool or a cache directory, got %r.'
+                             % (self.fuse_kernels,))
+
+        # 检查搜索阶段的数据精度
+        try:
+            search_dtype = None if self.dtype is None else np.dtype(self.dtype)
+        except TypeError:
+            search_dtype = None
+        if search_dtype not in (np.float32, np.float64):
+            raise ValueError("dtype should be 'float32' or 'float64', got %r." % (self.dtype,))
+
+        # 检查并行方式，线程池中只能使用声明为线程安全的函数
+        if self.backend not in ('processes', 'threads'):
+            raise ValueError('Valid backend methods include "processes" and "threads". Given %s.'
+                             % self.backend)
+        if self.backend == 'threads':
+            unsafe = [function.name for function in self._function_dict['number'] + self._function_dict['category']
+                      if not getattr(function, 'thread_safe', True)]
+            if isinstance(self.transformer, _Function) and not getattr(self.transformer, 'thread_safe', True):
+                unsafe.append(self.transformer.name)
+            if unsafe:
+                raise ValueError('Functions %s are not declared thread-safe, create them with '
+                                 'make_function(..., thread_safe=True) or use backend="processes".'
+                                 % ', '.join(unsafe))
+
+        # 检查单个程序分片计算的线程数
+        if self.shard_workers is not None and (not isinstance(self.shard_workers, (int, np.integer)) or
+                                               self.shard_workers == 0):
+            raise ValueError('shard_workers should be None or a non-zero integer, got %r.'
+                             % (self.shard_workers,))
+
+        # 检查岛屿模型的参数
+        n_islands = 1 if self.n_islands is None else self.n_islands
+        if not isinstance(n_islands, (int, np.integer)) or not 1 <= n_islands <= self.population_size:
+            raise ValueError('n_islands should be None or an integer between 1 and population_size, '
+                             'got %r.' % (self.n_islands,))
+        if n_islands > 1:
+            if not isinstance(self.migration_interval, (int, np.integer)) or self.migration_interval < 1:
+                raise ValueError('migration_interval should be a positive integer, got %r.'
+                                 % (self.migration_interval,))
+            if (not isinstance(self.migration_size, (int, np.integer)) or
+                    not 0 <= self.migration_size < self.population_size // n_islands):
+                raise ValueError('migration_size should be a non-negative integer smaller than the '
+                                 'size of an island, got %r.' % (self.migration_size,))
+            if self.migration_topology not in ('ring', 'random', 'complete'):
+                raise ValueError('Valid migration_topology methods include "ring", "random" and '
+                                 '"complete". Given %s.' % self.migration_topology)
+
         # 初始化transformer函数
         if self.transformer is not None:
             if isinstance(self.transformer, _Function):
@@ -609,8 +1348,13 @@ class BaseSymbolic(BaseEstimator, metaclass=ABCMeta):
             params['_transformer'] = None
         params['function_dict'] = self._function_dict
         params['arities'] = self._arities
+        # 函数参数类型的查找表，供生成和变异程序时使用
+        params['_grammar'] = _Grammar(self._function_dict, self._arities)
         params['method_probs'] = self._method_probs
         params['cat_var_number'] = len(self.category_features) if self.category_features is not None else 0
+        params['n_islands'] = n_islands
+        # 每次fit使用新的缓存
+        params['_cache_token'] = uuid.uuid4().hex
 
         # 清空_program
         if not self.warm_start or not hasattr(self, '_programs'):
@@ -622,6 +1366,11 @@ class BaseSymbolic(BaseEstimator, metaclass=ABCMeta):
                                  'best_length': [],
                                  'best_fitness': [],
                                  'best_oob_fitness': [],
+                                 'fitness_reuse_rate': [],
+                                 'clone_rate': [],
+                                 'peak_buffer_bytes': [],
+                                 'worker_busy_time': [],
+                                 'worker_utilization': [],
                                  'generation_time': []}
 
         prior_generations = len(self._programs)
@@ -632,7 +1381,7 @@ class BaseSymbolic(BaseEstimator, metaclass=ABCMeta):
                              'len(_programs)=%d when warm_start==True'
                              % (self.generations, len(self._programs)))
         elif n_more_generations == 0:
-            fitness = [program.raw_fitness_ for program in self._programs[-1]]
+            fitness = self._programs[-1].raw_fitness_
             warn('Warm-start fitting without increasing n_estimators does not '
                  'fit new programs.')
 
@@ -646,100 +1395,233 @@ class BaseSymbolic(BaseEstimator, metaclass=ABCMeta):
             # Print header fields
             self._verbose_reporter()
 
-        for gen in range(prior_generations, self.generations):
-            start_time = time()
-
-            if gen == 0:
-                parents = None
-            else:
-                try:
-                    parents = self._programs[gen - 1]
-                except:
-                    print(len(self._programs))
-                    print(gen)
-
-                    exit()
-            # Parallel loop
-            # 将population_size分配给n_job个进程
-            n_jobs, n_programs, starts = _partition_estimators(self.population_size, self.n_jobs)
-            seeds = random_state.randint(MAX_INT, size=self.population_size)
-
-            population = Parallel(n_jobs=n_jobs,
-                                  verbose=int(self.verbose > 1))(
-                delayed(_parallel_evolve)(n_programs[i],
-                                          parents,
-                                          X,
-                                          y,
-                                          security_data,
-                                          time_series_data,
-                                          sample_weight,
-                                          seeds[starts[i]:starts[i + 1]],
-                                          params)
-                for i in range(n_jobs))
-
-            # Reduce, maintaining order across different n_jobs
-            population = list(itertools.chain.from_iterable(population))
-
-            fitness = [program.raw_fitness_ for program in population]
-            length = [program.length_ for program in population]
-
-            # 惩罚系数
-            parsimony_coefficient = None
-            if self.parsimony_coefficient == 'auto':
-                parsimony_coefficient = (np.cov(length, fitness)[1, 0] /
-                                         np.var(length))
-            for program in population:
-                program.fitness_ = program.fitness(parsimony_coefficient)
-
-            self._programs.append(population)
-
-            # 去除没有进入下一代的父辈种群
-            if not self.low_memory:
-                for old_gen in np.arange(gen, 0, -1):
-                    indices = []
-                    for program in self._programs[old_gen]:
-                        if program is not None:
-                            for idx in program.parents:
-                                if 'idx' in idx:
-                                    indices.append(program.parents[idx])
-                    indices = set(indices)
-                    for idx in range(self.population_size):
-                        if idx not in indices:
-                            self._programs[old_gen - 1][idx] = None
-            elif gen > 0:
-                # 在low_memory的情况下，去除所有
-                self._programs[gen - 1] = None
-
-            # 记录运行细节
-            if self._metric.greater_is_better:
-                best_program = population[np.argmax(fitness)]
-            else:
-                best_program = population[np.argmin(fitness)]
-
-            self.run_details_['generation'].append(gen)
-            self.run_details_['average_length'].append(np.mean(length))
-            self.run_details_['average_fitness'].append(np.mean(fitness))
-            self.run_details_['best_length'].append(best_program.length_)
-            self.run_details_['best_fitness'].append(best_program.raw_fitness_)
-            oob_fitness = np.nan
-            if self.max_samples < 1.0:
-                oob_fitness = best_program.oob_fitness_
-            self.run_details_['best_oob_fitness'].append(oob_fitness)
-            generation_time = time() - start_time
-            self.run_details_['generation_time'].append(generation_time)
-
-            if self.verbose:
-                self._verbose_reporter(self.run_details_)
+        # 将population_size分配给n_job个进程，进程池和共享数据在整个fit中复用
+        n_jobs, n_programs, starts = _partition_estimators(self.population_size, self.n_jobs)
+        function_table = _function_table(self._function_dict)
+        # 搜索阶段的数据按dtype存储，中间结果随之采用相同精度
+        X_search = X if search_dtype == np.float64 else X.astype(search_dtype)
+        dataset = {'X': X_search,
+                   'target': _Target(y, sample_weight, time_series_data if self._metric.panel else None),
+                   'security_data': security_data,
+                   'time_series_data': time_series_data,
+                   'panel_layout': panel_layout}
+        if self.racing_schedule is not None:
+            # 每一轮竞速使用的数据子集，面板数据为连续的日期块
+            dataset['racing'] = [_racing_subset(fraction, X_search, y, sample_weight, self.data_type, self._metric,
+                                                time_series_data, security_data, panel_layout,
+                                                time_series_keys, security_keys)
+                                 for fraction, _ in self.racing_schedule]
+        if self.fingerprint_size:
+            # 语义指纹的探针样本，覆盖最长时序窗口的两倍
+            max_window = max([param['scalar']['int'][1]
+                              for function in self._function_dict['number'] + self._function_dict['category']
+                              if function.function_type == 'time_series'
+                              for param in function.param_type
+                              if 'int' in param.get('scalar', {})] + [0])
+            dataset['probe'] = _probe_dataset(self.fingerprint_size, max_window, X_search, y, sample_weight,
+                                              self.data_type, self._metric, time_series_data, security_data,
+                                              panel_layout, time_series_keys, security_keys)
+        program_params = _program_params(params, X.shape[1], dataset)
+        # 线程池直接共享进程内的数据，不需要序列化
+        threads = self.backend == 'threads'
+        with Parallel(n_jobs=n_jobs, backend='threading' if threads else None,
+                      verbose=int(self.verbose > 1)) as parallel, \
+                _shared_dataset(dataset, 1 if threads else n_jobs) as shared_dataset:
+            if n_islands > 1 and n_more_generations > 0:
+                # 岛屿模型：每个岛屿的子种群在一个进程中连续进化，
+                # 进程之间只在每migration_interval代时交换少数最优程序
+                _, _, island_starts = _partition_estimators(self.population_size, n_islands)
+                n_tasks, _, task_starts = _partition_estimators(n_islands, n_jobs)
+                seeds = random_state.randint(MAX_INT, size=(n_more_generations, self.population_size))
+                migrations = {}
+                for generation in range(n_more_generations - 1):
+                    if (prior_generations + generation + 1) % self.migration_interval:
+                        continue
+                    if self.migration_topology == 'complete':
+                        migrations[generation] = [[j for j in range(n_islands) if j != i] for i in range(n_islands)]
+                    else:
+                        # 环形拓扑迁往下一个岛屿，随机拓扑每次随机旋转环的偏移
+                        shift = 1 if self.migration_topology == 'ring' else random_state.randint(1, n_islands)
+                        migrations[generation] = [[(i - shift) % n_islands] for i in range(n_islands)]
+                if prior_generations == 0:
+                    populations = [None] * n_islands
+                else:
+                    parents = self._programs[-1].for_selection()
+                    parents.fingerprints = None
+                    populations = [parents.subset(np.arange(island_starts[i], island_starts[i + 1]))
+                                   for i in range(n_islands)]
+                # 所有任务同时运行，任务数不超过进程数
+                with _migration_folder(n_tasks) as folder:
+                    results = parallel(
+                        delayed(_evolve_islands)(list(range(task_starts[i], task_starts[i + 1])),
+                                                 populations[task_starts[i]:task_starts[i + 1]],
+                                                 shared_dataset,
+                                                 [seeds[:, island_starts[j]:island_starts[j + 1]]
+                                                  for j in range(task_starts[i], task_starts[i + 1])],
+                                                 migrations,
+                                                 folder,
+                                                 params)
+                        for i in range(n_tasks))
+                populations = [population for task_populations, _ in results for population in task_populations]
+                records = [island_records for _, task_records in results for island_records in task_records]
+
+                # 记录运行细节，中间代的种群不返回主进程
+                for generation in range(len(records[0])):
+                    summaries = [island_records[generation] for island_records in records]
+                    best_fitness = np.array([summary['best_fitness'] for summary in summaries])
+                    best = summaries[np.argmax(best_fitness) if self._metric.greater_is_better
+                                     else np.argmin(best_fitness)]
+                    self.run_details_['generation'].append(prior_generations + generation)
+                    self.run_details_['average_length'].append(
+                        sum(summary['length'] for summary in summaries) / self.population_size)
+                    self.run_details_['average_fitness'].append(
+                        sum(summary['fitness'] for summary in summaries) / self.population_size)
+                    self.run_details_['best_length'].append(best['best_length'])
+                    self.run_details_['best_fitness'].append(best['best_fitness'])
+                    self.run_details_['best_oob_fitness'].append(
+                        best['best_oob_fitness'] if self.max_samples < 1.0 else np.nan)
+                    self.run_details_['fitness_reuse_rate'].append(
+                        sum(summary['n_fitness_reused'] for summary in summaries) / self.population_size)
+                    self.run_details_['clone_rate'].append(
+                        sum(summary['n_clones'] for summary in summaries) / self.population_size)
+                    self.run_details_['peak_buffer_bytes'].append(
+                        max(summary['peak_buffer_bytes'] for summary in summaries))
+                    busy = {}
+                    for summary in summaries:
+                        for worker, seconds in summary['busy_times']:
+                            busy[worker] = busy.get(worker, 0.) + seconds
+                    busy = [busy[worker] for worker in sorted(busy)]
+                    generation_time = max(summary['generation_time'] for summary in summaries)
+                    self.run_details_['worker_busy_time'].append(busy)
+                    self.run_details_['worker_utilization'].append(sum(busy) / (n_tasks * generation_time))
+                    self.run_details_['generation_time'].append(generation_time)
+                    self._programs.append(None)
+
+                    if self.verbose:
+                        self._verbose_reporter(self.run_details_)
+
+                population = _Population.concatenate(populations)
+                population.function_table = function_table
+                population.program_params = program_params
+                self._programs[-1] = population
+                fitness = population.raw_fitness_
+                # 中间代不保存，只有续训的第一代能剪除上一次fit的最后一代
+                if not self.low_memory:
+                    _prune_ancestors(self._programs)
+                elif prior_generations > 0:
+                    self._programs[prior_generations - 1] = None
 
-            # 是否进入停止条件
-            if self._metric.greater_is_better:
-                best_fitness = fitness[np.argmax(fitness)]
-                if best_fitness >= self.stopping_criteria:
-                    break
             else:
-                best_fitness = fitness[np.argmin(fitness)]
-                if best_fitness <= self.stopping_criteria:
-                    break
+                for gen in range(prior_generations, self.generations):
+                    start_time = time()
+
+                    if gen == 0:
+                        parents = None
+                    else:
+                        try:
+                            parents = self._programs[gen - 1]
+                        except:
+                            print(len(self._programs))
+                            print(gen)
+
+                            exit()
+                        # 只向子进程传递树结构和适应度
+                        parents = parents.for_selection()
+                        if gen == prior_generations:
+                            # 之前fit的指纹在其探针样本上计算，不再沿用
+                            parents.fingerprints = None
+                    # Parallel loop
+                    seeds = random_state.randint(MAX_INT, size=self.population_size)
+
+                    if n_jobs > 1:
+                        # 按估计的代价把子代划分为多个批次，先完成的进程继续领取剩余批次
+                        costs = (np.ones(self.population_size) if gen == 0 else
+                                 _offspring_costs(self._programs[gen - 1], seeds, params))
+                        n_programs, starts = _partition_costs(costs, n_jobs * _BATCHES_PER_JOB)
+                    parallel_start = time()
+                    population = parallel(
+                        delayed(_parallel_evolve)(n_programs[i],
+                                                  parents,
+                                                  shared_dataset,
+                                                  seeds[starts[i]:starts[i + 1]],
+                                                  params)
+                        for i in range(len(n_programs)))
+                    parallel_time = time() - parallel_start
+
+                    # Reduce, maintaining order across different n_jobs
+                    population = _Population.concatenate(population)
+                    _share_clone_fitness(population)
+                    population.function_table = function_table
+                    population.program_params = program_params
+
+                    fitness = population.raw_fitness_
+                    length = population.length_
+
+                    # 惩罚系数
+                    parsimony_coefficient = None
+                    if self.parsimony_coefficient == 'auto':
+                        parsimony_coefficient = (np.cov(length, fitness)[1, 0] /
+                                                 np.var(length))
+                    if parsimony_coefficient is None:
+                        parsimony_coefficient = self.parsimony_coefficient
+                    population.fitness_ = fitness - parsimony_coefficient * length * self._metric.sign
+
+                    self._programs.append(population)
+
+                    # 去除没有进入下一代的父辈种群
+                    if not self.low_memory:
+                        _prune_ancestors(self._programs)
+                    elif gen > 0:
+                        # 在low_memory的情况下，去除所有
+                        self._programs[gen - 1] = None
+
+                    # 记录运行细节
+                    if self._metric.greater_is_better:
+                        best_program = population[np.argmax(fitness)]
+                    else:
+                        best_program = population[np.argmin(fitness)]
+
+                    self.run_details_['generation'].append(gen)
+                    self.run_details_['average_length'].append(np.mean(length))
+                    self.run_details_['average_fitness'].append(np.mean(fitness))
+                    self.run_details_['best_length'].append(best_program.length_)
+                    self.run_details_['best_fitness'].append(best_program.raw_fitness_)
+                    oob_fitness = np.nan
+                    if self.max_samples < 1.0:
+                        oob_fitness = best_program.oob_fitness_
+                    self.run_details_['best_oob_fitness'].append(oob_fitness)
+                    self.run_details_['fitness_reuse_rate'].append(population.n_fitness_reused / len(population))
+                    self.run_details_['clone_rate'].append(population.n_clones / len(population))
+                    self.run_details_['peak_buffer_bytes'].append(population.peak_buffer_bytes)
+                    # 各进程（或线程）的运行时间，其余时间为空闲
+                    busy = {}
+                    for worker, seconds in population.busy_times:
+                        busy[worker] = busy.get(worker, 0.) + seconds
+                    busy = [busy[worker] for worker in sorted(busy)]
+                    self.run_details_['worker_busy_time'].append(busy)
+                    self.run_details_['worker_utilization'].append(sum(busy) / (n_jobs * parallel_time))
+                    generation_time = time() - start_time
+                    self.run_details_['generation_time'].append(generation_time)
+
+                    if self.verbose:
+                        self._verbose_reporter(self.run_details_)
+
+                    # 是否进入停止条件
+                    if self._metric.greater_is_better:
+                        best_fitness = fitness[np.argmax(fitness)]
+                        if best_fitness >= self.stopping_criteria:
+                            break
+                    else:
+                        best_fitness = fitness[np.argmin(fitness)]
+                        if best_fitness <= self.stopping_criteria:
+                            break
+
+        if search_dtype != np.float64:
+            # 低精度搜索结束后，在float64上重新评估最优的hall_of_fame个程序，最终只从中选择
+            fitness = _rescore(self._programs[-1], hall_of_fame, X, dataset['target'], self._metric,
+                               self.shard_workers)
+            # 缓存中是低精度的中间结果
+            _worker_caches.clear()
 
         # 特征工程专属模块
         if isinstance(self, TransformerMixin):
@@ -747,20 +1629,32 @@ class BaseSymbolic(BaseEstimator, metaclass=ABCMeta):
             fitness = np.array(fitness)
             # 找出适应度最优的hall_of_fame个进入fitness
             if self._metric.greater_is_better:
-                hall_of_fame = fitness.argsort()[::-1][:self.hall_of_fame]
+                ranking = fitness.argsort()[::-1]
+            else:
+                ranking = fitness.argsort()
+            if self.fingerprint_size:
+                # 语义等价的程序只保留适应度最优的一个
+                representatives = {}
+                for i in ranking:
+                    representatives.setdefault(_fingerprint(self._programs[-1][i], dataset['probe']), i)
+                    if len(representatives) == self.hall_of_fame:
+                        break
+                hall_of_fame = np.array(list(representatives.values()))
             else:
-                hall_of_fame = fitness.argsort()[:self.hall_of_fame]
-            evaluation = np.array([gp.execute(X) for gp in
-                                   [self._programs[-1][i] for
-                                    i in hall_of_fame]])
-            if self.metric == 'spearman':
+                hall_of_fame = ranking[:self.hall_of_fame]
+            cache = _get_subtree_cache(params['_cache_token'],
+                                       int(self.subtree_cache_size * 2 ** 20))
+            programs = [self._programs[-1][i] for i in hall_of_fame]
+            with _panel_shards(programs[0], self.shard_workers) as shards:
+                evaluation = np.array([gp.execute(X, cache, shards=shards) for gp in programs])
+            if self.metric in ('spearman', 'mean rank ic'):
                 evaluation = np.apply_along_axis(rankdata, 1, evaluation)
 
             with np.errstate(divide='ignore', invalid='ignore'):
                 correlations = np.abs(np.corrcoef(evaluation))
             np.fill_diagonal(correlations, 0.)
-            components = list(range(self.hall_of_fame))
-            indices = list(range(self.hall_of_fame))
+            components = list(range(len(hall_of_fame)))
+            indices = list(range(len(hall_of_fame)))
             # Iteratively remove least fit individual of most correlated pair
             while len(components) > self.n_components:
                 # 去除hall_of_fame - n_components个高度相关特征
@@ -789,6 +1683,10 @@ class BaseSymbolic(BaseEstimator, metaclass=ABCMeta):
             else:
                 self._program = self._programs[-1][np.argmin(fitness)]
 
+        # 释放本进程中的子树缓存和适应度记录
+        _worker_caches.clear()
+        _worker_memos.clear()
+
         return self
 
 
@@ -817,9 +1715,23 @@ class SymbolicRegressor(BaseSymbolic, RegressorMixin):
                  category_features=None,
                  warm_start=False,
                  low_memory=False,
+                 subtree_cache_size=0,
+                 lineage_cache_size=0,
+                 racing_schedule=None,
+                 fingerprint_size=0,
+                 simplify=None,
+                 fuse_kernels=False,
+                 dtype='float64',
+                 n_islands=None,
+                 migration_interval=5,
+                 migration_size=1,
+                 migration_topology='ring',
                  n_jobs=1,
+                 backend='processes',
+                 shard_workers=None,
                  verbose=0,
                  data_type='section',
+                 panel_layout='long',
                  random_state=None):
         super(SymbolicRegressor, self).__init__(
             population_size=population_size,
@@ -844,10 +1756,24 @@ class SymbolicRegressor(BaseSymbolic, RegressorMixin):
             category_features=category_features,
             warm_start=warm_start,
             low_memory=low_memory,
+            subtree_cache_size=subtree_cache_size,
+            lineage_cache_size=lineage_cache_size,
+            racing_schedule=racing_schedule,
+            fingerprint_size=fingerprint_size,
+            simplify=simplify,
+            fuse_kernels=fuse_kernels,
+            dtype=dtype,
+            n_islands=n_islands,
+            migration_interval=migration_interval,
+            migration_size=migration_size,
+            migration_topology=migration_topology,
             n_jobs=n_jobs,
+            backend=backend,
+            shard_workers=shard_workers,
             verbose=verbose,
             random_state=random_state,
-            data_type=data_type)
+            data_type=data_type,
+            panel_layout=panel_layout)
 
     def __str__(self):
         """Overloads `print` output of the object to resemble a LISP tree."""
@@ -881,7 +1807,8 @@ class SymbolicRegressor(BaseSymbolic, RegressorMixin):
                              'n_features is %s.'
                              % (self.n_features_in_, n_features))
 
-        y = self._program.execute(X)
+        with _panel_shards(self._program, self.shard_workers) as shards:
+            y = self._program.execute(X, kernel_dir=_kernel_dir(self.fuse_kernels), shards=shards)
 
         return y
 
@@ -913,9 +1840,23 @@ class SymbolicClassifier(BaseSymbolic, ClassifierMixin):
                  category_features=None,
                  warm_start=False,
                  low_memory=False,
+                 subtree_cache_size=0,
+                 lineage_cache_size=0,
+                 racing_schedule=None,
+                 fingerprint_size=0,
+                 simplify=None,
+                 fuse_kernels=False,
+                 dtype='float64',
+                 n_islands=None,
+                 migration_interval=5,
+                 migration_size=1,
+                 migration_topology='ring',
                  n_jobs=1,
+                 backend='processes',
+                 shard_workers=None,
                  verbose=0,
                  data_type='section',
+                 panel_layout='long',
                  random_state=None):
         super(SymbolicClassifier, self).__init__(
             population_size=population_size,
@@ -942,9 +1883,23 @@ class SymbolicClassifier(BaseSymbolic, ClassifierMixin):
             category_features=category_features,
             warm_start=warm_start,
             low_memory=low_memory,
+            subtree_cache_size=subtree_cache_size,
+            lineage_cache_size=lineage_cache_size,
+            racing_schedule=racing_schedule,
+            fingerprint_size=fingerprint_size,
+            simplify=simplify,
+            fuse_kernels=fuse_kernels,
+            dtype=dtype,
+            n_islands=n_islands,
+            migration_interval=migration_interval,
+            migration_size=migration_size,
+            migration_topology=migration_topology,
             n_jobs=n_jobs,
+            backend=backend,
+            shard_workers=shard_workers,
             verbose=verbose,
             data_type=data_type,
+            panel_layout=panel_layout,
             random_state=random_state)
 
     def __str__(self):
@@ -969,7 +1924,8 @@ class SymbolicClassifier(BaseSymbolic, ClassifierMixin):
                              'n_features is %s.'
                              % (self.n_features_in_, n_features))
 
-        scores = self._program.execute(X)
+        with _panel_shards(self._program, self.shard_workers) as shards:
+            scores = self._program.execute(X, kernel_dir=_kernel_dir(self.fuse_kernels), shards=shards)
         proba = self._transformer(scores)
         proba = np.vstack([1 - proba, proba]).T
         return proba
@@ -1008,9 +1964,23 @@ class SymbolicTransformer(BaseSymbolic, TransformerMixin):
                  category_features=None,
                  warm_start=False,
                  low_memory=False,
+                 subtree_cache_size=0,
+                 lineage_cache_size=0,
+                 racing_schedule=None,
+                 fingerprint_size=0,
+                 simplify=None,
+                 fuse_kernels=False,
+                 dtype='float64',
+                 n_islands=None,
+                 migration_interval=5,
+                 migration_size=1,
+                 migration_topology='ring',
                  n_jobs=1,
+                 backend='processes',
+                 shard_workers=None,
                  verbose=0,
                  data_type='section',
+                 panel_layout='long',
                  random_state=None):
         super(SymbolicTransformer, self).__init__(
             population_size=population_size,
@@ -1038,9 +2008,23 @@ class SymbolicTransformer(BaseSymbolic, TransformerMixin):
             category_features=category_features,
             warm_start=warm_start,
             low_memory=low_memory,
+            subtree_cache_size=subtree_cache_size,
+            lineage_cache_size=lineage_cache_size,
+            racing_schedule=racing_schedule,
+            fingerprint_size=fingerprint_size,
+            simplify=simplify,
+            fuse_kernels=fuse_kernels,
+            dtype=dtype,
+            n_islands=n_islands,
+            migration_interval=migration_interval,
+            migration_size=migration_size,
+            migration_topology=migration_topology,
             n_jobs=n_jobs,
+            backend=backend,
+            shard_workers=shard_workers,
             verbose=verbose,
             data_type=data_type,
+            panel_layout=panel_layout,
             random_state=random_state)
 
     def __len__(self):
@@ -1084,7 +2068,13 @@ class SymbolicTransformer(BaseSymbolic, TransformerMixin):
                              'n_features is %s.'
                              % (self.n_features_in_, n_features))
 
-        X_new = np.array([gp.execute(X) for gp in self._best_programs]).T
+        # 最优个体间共享的子树只计算一次
+        cache = None
+        if self.subtree_cache_size:
+            cache = _SubtreeCache(int(self.subtree_cache_size * 2 ** 20))
+        kernel_dir = _kernel_dir(self.fuse_kernels)
+        with _panel_shards(self._best_programs[0], self.shard_workers) as shards:
+            X_new = np.array([gp.execute(X, cache, kernel_dir, shards) for gp in self._best_programs]).T
 
         return X_new
 
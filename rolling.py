@@ -0,0 +1,373 @@
+# -*- coding: utf-8 -*-
+"""
+-------------------------------------------------
+# @Project  :gplearnplus
+# @File     :rolling
+# @Date     :2026/10/18 0018 14:05
+# @Author   :Junzhe Huang
+# @Email    :acejasonhuang@163.com
+# @Software :PyCharm
+-------------------------------------------------
+"""
+#####
+# 滚动窗口时序函数，单次调用复杂度O(n)，与example中逐窗口重算的版本结果一致
+# 1. 单调队列：ts_min, ts_max, ts_argmin, ts_argmax, MIDPOINT
+# 2. 滑动矩：ts_stddev, ts_corr, BETA, LINEARREG_SLOPE, MA, KAMA
+# 3. 有序窗口：ts_rank
+#
+# 所有函数都提供分段版本，面板数据中一次调用处理全部个股
+###
+import numba as nb
+import numpy as np
+
+from . import functions
+
+__all__ = ['ts_min', 'ts_max', 'ts_argmin', 'ts_argmax', 'ts_rank', 'ts_stddev', 'ts_corr',
+           'BETA', 'LINEARREG_SLOPE', 'MIDPOINT', 'MA', 'KAMA']
+
+# 滑动累计量每隔_RESYNC步按窗口重新计算，避免浮点误差累积
+_RESYNC = 1024
+# 滑动累计量不足其舍入误差量级的该倍数时精度不足，按窗口重新计算，恰为0时已是精确值
+_DEGENERATE = 1e-6
+
+
+def _segment(kernel):
+    # (X, d)函数的分段版本
+    @nb.jit(nopython=True, nogil=True)
+    def _segment_kernel(offsets, X, d):
+        res = np.empty(len(X), dtype=np.float64)
+        for i in range(len(offsets) - 1):
+            res[offsets[i]:offsets[i + 1]] = kernel(X[offsets[i]:offsets[i + 1]], d)
+        return res
+    return _segment_kernel
+
+
+def _segment_pair(kernel):
+    # (X, Y, d)函数的分段版本
+    @nb.jit(nopython=True, nogil=True)
+    def _segment_kernel(offsets, X, Y, d):
+        res = np.empty(len(X), dtype=np.float64)
+        for i in range(len(offsets) - 1):
+            res[offsets[i]:offsets[i + 1]] = kernel(X[offsets[i]:offsets[i + 1]],
+                                                    Y[offsets[i]:offsets[i + 1]], d)
+        return res
+    return _segment_kernel
+
+
+@nb.jit(nopython=True, nogil=True)
+def _window_size(n, d):
+    d = n - 1 if d >= n else d
+    return max(d, 1)
+
+
+@nb.jit(nopython=True, nogil=True)
+def _handle_nan(X):
+    # 与example.handle_nan一致：向前填充，并返回nan的个数
+    X = np.copy(X)
+    _temp = np.nan
+    na_len = 0
+    for i in range(len(X)):
+        if np.isnan(X[i]):
+            X[i] = _temp
+            na_len += 1
+        else:
+            _temp = X[i]
+    return X, na_len
+
+
+#### MONOTONIC DEQUE ####
+
+@nb.jit(nopython=True, nogil=True)
+def _rolling_extreme(X, d, is_max, return_index):
+    # 单调队列求窗口内的nan忽略极值，或首个极值（窗口中有nan时为首个nan）的位置
+    n = len(X)
+    res = np.full(n, np.nan)
+    deque = np.empty(n, dtype=np.int64)
+    nans = np.empty(n, dtype=np.int64)
+    head, tail = 0, 0
+    nan_head, nan_tail = 0, 0
+    for i in range(n):
+        while head < tail and deque[head] <= i - d:
+            head += 1
+        while nan_head < nan_tail and nans[nan_head] <= i - d:
+            nan_head += 1
+        x = X[i]
+        if np.isnan(x):
+            nans[nan_tail] = i
+            nan_tail += 1
+        else:
+            # 保留相等的较早元素，使队首为首个极值
+            while head < tail and ((X[deque[tail - 1]] < x) if is_max else (X[deque[tail - 1]] > x)):
+                tail -= 1
+            deque[tail] = i
+            tail += 1
+        if i >= d - 1:
+            if return_index:
+                if nan_head < nan_tail:
+                    res[i] = nans[nan_head] - (i - d + 1)
+                elif head < tail:
+                    res[i] = deque[head] - (i - d + 1)
+            elif head < tail:
+                res[i] = X[deque[head]]
+    return res
+
+
+@nb.jit(nopython=True, nogil=True)
+def _ts_min(X, d):
+    return _rolling_extreme(X, _window_size(len(X), d), False, False)
+
+
+@nb.jit(nopython=True, nogil=True)
+def _ts_max(X, d):
+    return _rolling_extreme(X, _window_size(len(X), d), True, False)
+
+
+@nb.jit(nopython=True, nogil=True)
+def _ts_argmin(X, d):
+    return _rolling_extreme(X, _window_size(len(X), d), False, True)
+
+
+@nb.jit(nopython=True, nogil=True)
+def _ts_argmax(X, d):
+    return _rolling_extreme(X, _window_size(len(X), d), True, True)
+
+
+@nb.jit(nopython=True, nogil=True)
+def _MIDPOINT(X, d):
+    d = _window_size(len(X), d)
+    return (_rolling_extreme(X, d, True, False) + _rolling_extreme(X, d, False, False)) / 2
+
+
+#### RUNNING MOMENTS ####
+
+@nb.jit(nopython=True, nogil=True)
+def _moments_add(state, x, y):
+    # state: 样本数, x均值, y均值, x离差平方和, y离差平方和, 交叉离差和,
+    # 以及自上次重算以来x, y离差平方和的舍入误差量级（除以机器精度）
+    state[0] += 1
+    dx = x - state[1]
+    dy = y - state[2]
+    state[1] += dx / state[0]
+    state[2] += dy / state[0]
+    state[3] += dx * (x - state[1])
+    state[4] += dy * (y - state[2])
+    state[5] += dx * (y - state[2])
+    state[6] += abs(dx) * (abs(x) + abs(state[1]))
+    state[7] += abs(dy) * (abs(y) + abs(state[2]))
+
+
+@nb.jit(nopython=True, nogil=True)
+def _moments_remove(state, x, y):
+    if state[0] <= 1:
+        state[:] = 0.
+        return
+    state[0] -= 1
+    dx = x - state[1]
+    dy = y - state[2]
+    state[1] -= dx / state[0]
+    state[2] -= dy / state[0]
+    state[3] -= dx * (x - state[1])
+    state[4] -= dy * (y - state[2])
+    state[5] -= dx * (y - state[2])
+    state[6] += abs(dx) * (abs(x) + abs(state[1]))
+    state[7] += abs(dy) * (abs(y) + abs(state[2]))
+
+
+_MODE_STD, _MODE_CORR, _MODE_BETA = 0, 1, 2
+
+
+@nb.jit(nopython=True, nogil=True)
+def _moments_degenerate(state, mode):
+    # 窗口离差平方和相对舍入误差量级过小，需要按窗口重新计算，只有相关系数用到y的离差平方和
+    if state[0] <= 1:
+        return False
+    if state[3] != 0. and state[3] <= _DEGENERATE * state[6]:
+        return True
+    return mode == _MODE_CORR and state[4] != 0. and state[4] <= _DEGENERATE * state[7]
+
+
+@nb.jit(nopython=True, nogil=True)
+def _moments_value(state, n_nan, mode):
+    # 由窗口的矩计算结果，单个样本的离差为0
+    n = state[0]
+    if mode == _MODE_BETA and n_nan > 0:
+        return np.nan
+    if n == 0:
+        return np.nan
+    var_x = max(state[3], 0.) if n > 1 else 0.
+    var_y = max(state[4], 0.) if n > 1 else 0.
+    cov = state[5] if var_x > 0 and var_y > 0 else 0.
+    if mode == _MODE_STD:
+        return np.sqrt(var_x / n)
+    if mode == _MODE_CORR:
+        if n <= 2 or var_x == 0 or var_y == 0:
+            return np.nan
+        return cov / np.sqrt(var_x * var_y)
+    return cov / (var_x if var_x > 0.001 else 0.001)
+
+
+@nb.jit(nopython=True, nogil=True)
+def _rolling_moments(X, Y, d, mode):
+    # 滑动更新窗口内x, y均非nan的样本的矩，并统计窗口内含nan的样本数
+    n = len(X)
+    res = np.full(n, np.nan)
+    state = np.zeros(8)
+    nan_count = 0
+    for i in range(n):
+        if np.isnan(X[i]) or np.isnan(Y[i]):
+            nan_count += 1
+        else:
+            _moments_add(state, X[i], Y[i])
+        if i >= d:
+            if np.isnan(X[i - d]) or np.isnan(Y[i - d]):
+                nan_count -= 1
+            else:
+                _moments_remove(state, X[i - d], Y[i - d])
+            if i % _RESYNC == 0 or _moments_degenerate(state, mode):
+                state[:] = 0.
+                for j in range(i - d + 1, i + 1):
+                    if not (np.isnan(X[j]) or np.isnan(Y[j])):
+                        _moments_add(state, X[j], Y[j])
+        if i >= d - 1:
+            res[i] = _moments_value(state, nan_count, mode)
+    return res
+
+
+@nb.jit(nopython=True, nogil=True)
+def _ts_stddev(X, d):
+    return _rolling_moments(X, np.zeros(len(X)), _window_size(len(X), d), _MODE_STD)
+
+
+@nb.jit(nopython=True, nogil=True)
+def _ts_corr(X, Y, d):
+    return _rolling_moments(X, Y, _window_size(len(X), d), _MODE_CORR)
+
+
+@nb.jit(nopython=True, nogil=True)
+def _BETA(X, Y, d):
+    return _rolling_moments(X, Y, _window_size(len(X), d), _MODE_BETA)
+
+
+@nb.jit(nopython=True, nogil=True)
+def _LINEARREG_SLOPE(X, d):
+    # 窗口内的位置序号与全局序号只差常数，离差相同
+    return _rolling_moments(X, np.arange(len(X)).astype(np.float64), _window_size(len(X), d), _MODE_BETA)
+
+
+@nb.jit(nopython=True, nogil=True)
+def _MA(X, d):
+    d = _window_size(len(X), d)
+    X, _l = _handle_nan(X)
+    X = X[_l:]
+    res = np.full(len(X) + _l, np.nan)
+    if len(X) < d:
+        return res
+    s = 0.
+    for i in range(len(X)):
+        s += X[i]
+        if i >= d:
+            s -= X[i - d]
+            if i % _RESYNC == 0:
+                s = np.sum(X[i - d + 1:i + 1])
+        if i >= d - 1:
+            res[_l + i] = s / d
+    return res
+
+
+@nb.jit(nopython=True, nogil=True)
+def _KAMA(X, d):
+    d = _window_size(len(X), d)
+    X, _l = _handle_nan(X)
+    X = X[_l:]
+    res = np.full(len(X) + _l, np.nan)
+    if len(X) < d:
+        return res
+    _af = 2 / (2 + 1)
+    _as = 2 / (30 + 1)
+    # 最近d个一阶差分绝对值之和，及自上次重算以来加入的差分绝对值之和
+    sum_roc = 0.
+    for k in range(1, d):
+        sum_roc += abs(X[k] - X[k - 1])
+    total_roc = sum_roc
+    for i in range(d, len(X)):
+        sum_roc += abs(X[i] - X[i - 1])
+        total_roc += abs(X[i] - X[i - 1])
+        if i > d:
+            sum_roc -= abs(X[i - d] - X[i - d - 1])
+            # 窗口内差分之和相对累计量过小时只剩滑动误差，按窗口重新计算
+            if i % _RESYNC == 0 or (sum_roc != 0. and sum_roc <= _DEGENERATE * total_roc):
+                sum_roc = np.sum(np.abs(np.diff(X[i - d: i + 1])))
+                total_roc = sum_roc
+        period_roc = X[i] - X[i - d]
+        _er = 1.0 if ((period_roc >= sum_roc) or (sum_roc == 0)) else abs(period_roc / sum_roc)
+        _at = (_er * (_af - _as) + _as) ** 2
+        res[_l + i] = _at * X[i] + (1 - _at) * (res[_l + i - 1] if i != d else X[i - 1])
+    return res
+
+
+#### ORDERED WINDOW ####
+
+@nb.jit(nopython=True, nogil=True)
+def _ts_rank(X, d):
+    # 窗口内非nan值保持有序，插入和删除用二分查找定位
+    n = len(X)
+    d = _window_size(n, d)
+    res = np.full(n, np.nan)
+    window = np.empty(d)
+    m = 0
+    for i in range(n):
+        if i >= d and not np.isnan(X[i - d]):
+            pos = np.searchsorted(window[:m], X[i - d])
+            for k in range(pos, m - 1):
+                window[k] = window[k + 1]
+            m -= 1
+        x = X[i]
+        if not np.isnan(x):
+            pos = np.searchsorted(window[:m], x)
+            for k in range(m, pos, -1):
+                window[k] = window[k - 1]
+            window[pos] = x
+            m += 1
+        if i >= d - 1:
+            # nan排在最后
+            if np.isnan(x):
+                res[i] = 1.
+            else:
+                res[i] = np.searchsorted(window[:m], x, side='right') / d
+    return res
+
+
+_number = {'vector': {'number': (None, None)}}
+_window = {'scalar': {'int': (3, 30)}}
+
+ts_min = functions.make_function(function=_ts_min, name='ts_min', arity=2, function_type='time_series',
+                                 param_type=[_number, _window], segment_function=_segment(_ts_min), thread_safe=True)
+ts_max = functions.make_function(function=_ts_max, name='ts_max', arity=2, function_type='time_series',
+                                 param_type=[_number, _window], segment_function=_segment(_ts_max), thread_safe=True)
+ts_argmin = functions.make_function(function=_ts_argmin, name='ts_argmin', arity=2, function_type='time_series',
+                                    param_type=[_number, _window], segment_function=_segment(_ts_argmin),
+                                    thread_safe=True)
+ts_argmax = functions.make_function(function=_ts_argmax, name='ts_argmax', arity=2, function_type='time_series',
+                                    param_type=[_number, _window], segment_function=_segment(_ts_argmax),
+                                    thread_safe=True)
+ts_rank = functions.make_function(function=_ts_rank, name='ts_rank', arity=2, function_type='time_series',
+                                  param_type=[_number, _window], segment_function=_segment(_ts_rank), thread_safe=True)
+ts_stddev = functions.make_function(function=_ts_stddev, name='ts_stddev', arity=2, function_type='time_series',
+                                    param_type=[_number, _window], segment_function=_segment(_ts_stddev),
+                                    thread_safe=True)
+ts_corr = functions.make_function(function=_ts_corr, name='ts_corr', arity=3, function_type='time_series',
+                                  param_type=[_number, _number, _window], segment_function=_segment_pair(_ts_corr),
+                                  thread_safe=True)
+BETA = functions.make_function(function=_BETA, name='BETA', arity=3, function_type='time_series',
+                               param_type=[_number, _number, _window], segment_function=_segment_pair(_BETA),
+                               thread_safe=True)
+LINEARREG_SLOPE = functions.make_function(function=_LINEARREG_SLOPE, name='LINEARREG_SLOPE', arity=2,
+                                          function_type='time_series', param_type=[_number, _window],
+                                          segment_function=_segment(_LINEARREG_SLOPE), thread_safe=True)
+MIDPOINT = functions.make_function(function=_MIDPOINT, name='MIDPOINT', arity=2, function_type='time_series',
+                                   param_type=[_number, _window], segment_function=_segment(_MIDPOINT),
+                                   thread_safe=True)
+MA = functions.make_function(function=_MA, name='MA', arity=2, function_type='time_series',
+                             param_type=[_number, _window], segment_function=_segment(_MA), thread_safe=True)
+KAMA = functions.make_function(function=_KAMA, name='KAMA', arity=2, function_type='time_series',
+                               param_type=[_number, _window], segment_function=_segment(_KAMA), thread_safe=True)
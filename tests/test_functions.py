@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+"""
+-------------------------------------------------
+# @Project  :gplearnplus
+# @File     :test_functions
+# @Date     :2026/10/19 0019 11:30
+# @Author   :Junzhe Huang
+# @Email    :acejasonhuang@163.com
+# @Software :PyCharm
+-------------------------------------------------
+"""
+#####
+# 面板数据辅助结构的测试
+###
+import threading
+import time
+
+import numpy as np
+from numpy.testing import assert_array_equal
+
+from gplearnplus.functions import _PanelLayout
+
+
+def _layout(n_dates=20, n_securities=5, cls=_PanelLayout):
+    dates = np.repeat(np.arange(n_dates), n_securities)
+    securities = np.tile(np.arange(n_securities), n_dates)
+    # 打乱样本顺序，稠密布局与长表的行不同
+    order = np.random.RandomState(0).permutation(len(dates))
+    return cls(dates[order], securities[order])
+
+
+def test_panel_layout_to_dense():
+    """Check the dense layout of a shuffled panel and its round trip."""
+    layout = _layout()
+    X = np.random.RandomState(1).normal(size=(layout.n_samples, 3))
+    X_dense = layout.to_dense(X)
+    assert X_dense.shape == (layout.n_cells, 3)
+    assert_array_equal(X_dense[layout.cells], X)
+    assert layout.to_dense(X) is X_dense
+    assert_array_equal(layout.to_long(X_dense[:, 2]), X[:, 2])
+
+
+class _PreemptedLayout(_PanelLayout):
+    # 每次写入属性后让出线程，模拟在发布结果的中途被打断
+    def __setattr__(self, name, value):
+        super().__setattr__(name, value)
+        time.sleep(1e-4)
+
+
+def test_panel_layout_to_dense_threads():
+    """Check that threads converting different arrays always get their own result."""
+    layout = _layout(cls=_PreemptedLayout)
+    rng = np.random.RandomState(2)
+    arrays = [rng.normal(size=(layout.n_samples, 3)) for _ in range(3)]
+    errors = []
+
+    def _convert(k):
+        for i in range(50):
+            j = (k + i // 2) % len(arrays)
+            X_dense = layout.to_dense(arrays[j])
+            if X_dense is None or not np.array_equal(X_dense[layout.cells], arrays[j]):
+                errors.append(j)
+
+    threads = [threading.Thread(target=_convert, args=(k,)) for k in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert not errors
@@ -0,0 +1,249 @@
+# -*- coding: utf-8 -*-
+"""
+-------------------------------------------------
+# @Project  :gplearnplus
+# @File     :test_genetic
+# @Date     :2026/10/18 0018 22:10
+# @Author   :Junzhe Huang
+# @Email    :acejasonhuang@163.com
+# @Software :PyCharm
+-------------------------------------------------
+"""
+#####
+# 估计器的测试
+###
+import numpy as np
+import pandas as pd
+import pytest
+from numpy.testing import assert_allclose, assert_array_equal
+
+from gplearnplus import rolling
+from gplearnplus.functions import make_function
+from gplearnplus.genetic import SymbolicRegressor, SymbolicTransformer
+
+
+def test_float32_search_rescored_in_float64():
+    """Check that the finalists of a float32 search are re-scored in float64."""
+    rng = np.random.RandomState(0)
+    X = rng.uniform(-3, 3, size=(500, 3))
+    y = X[:, 0] ** 2 + np.sin(X[:, 1]) * X[:, 2]
+    est = SymbolicRegressor(population_size=200, generations=3, dtype='float32',
+                            function_set=['add', 'sub', 'mul', 'div', 'sin'], random_state=0)
+    est.fit(X, y)
+    population = est._programs[-1]
+    weight = np.ones(len(y))
+    direct = np.array([program.raw_fitness(X, y, weight) for program in population])
+    search = np.array([program.raw_fitness(X.astype(np.float32), y, weight) for program in population])
+    # 重新评估后的适应度与float64上直接计算的结果完全一致
+    assert_array_equal(population.raw_fitness_, direct)
+    assert est._program.raw_fitness_ == est._program.raw_fitness(X, y, weight)
+    # float32搜索阶段的适应度与之接近
+    assert_allclose(search, direct, rtol=1e-4)
+
+
+def test_float32_search_transformer_finalists():
+    """Check that only the hall of fame of a float32 search is re-scored."""
+    rng = np.random.RandomState(1)
+    X = rng.uniform(-3, 3, size=(500, 3))
+    y = X[:, 0] ** 2 + np.sin(X[:, 1]) * X[:, 2]
+    est = SymbolicTransformer(population_size=200, generations=3, hall_of_fame=20, n_components=5,
+                              dtype='float32', function_set=['add', 'sub', 'mul', 'div', 'sin'],
+                              random_state=0)
+    est.fit(X, y)
+    population = est._programs[-1]
+    weight = np.ones(len(y))
+    direct = np.array([program.raw_fitness(X, y, weight) for program in population])
+    rescored = population.raw_fitness_ == direct
+    assert rescored.sum() >= 20
+    for program in est._best_programs:
+        assert program.raw_fitness_ == program.raw_fitness(X, y, weight)
+    # 其余程序保留float32搜索阶段的适应度
+    finite = np.isfinite(direct) & ~rescored
+    assert_allclose(population.raw_fitness_[finite], direct[finite], rtol=1e-4, atol=1e-5)
+
+
+def _demean(x):
+    # 截面去均值，不处理nan
+    return x - np.mean(x)
+
+
+def _panel(n_dates=60, n_securities=12, drop=0):
+    rng = np.random.RandomState(0)
+    df = pd.DataFrame(rng.normal(size=(n_dates * n_securities, 3)), columns=list('abc'))
+    df['date'] = np.repeat(np.arange(n_dates), n_securities)
+    df['security'] = np.tile(np.arange(n_securities), n_dates)
+    y = df['a'].values + 0.5 * df['b'].values + rng.normal(size=len(df))
+    if drop:
+        keep = np.sort(rng.choice(len(df), len(df) - drop, replace=False))
+        df, y = df.iloc[keep].reset_index(drop=True), y[keep]
+    return df, y
+
+
+def _panel_estimator(**params):
+    demean = make_function(function=_demean, name='demean', arity=1, function_type='section',
+                           param_type=[{'vector': {'number': (None, None)}}])
+    return SymbolicRegressor(population_size=100, generations=3, random_state=0, metric='mean ic',
+                             data_type='panel', time_series_index='date', security_index='security',
+                             feature_names=list('abc'), stopping_criteria=1.,
+                             function_set=['add', 'sub', 'mul', rolling.MA, rolling.ts_stddev, demean],
+                             const_range=(3, 10), **params)
+
+
+def test_panel_layout_dense_matches_long():
+    """Check that the dense and long layouts evolve the same programs on a balanced panel."""
+    df, y = _panel()
+    long = _panel_estimator(panel_layout='long').fit(df.copy(), y)
+    dense = _panel_estimator(panel_layout='dense').fit(df.copy(), y)
+    assert str(long._program) == str(dense._program)
+    for long_population, dense_population in zip(long._programs, dense._programs):
+        assert_allclose(long_population.raw_fitness_, dense_population.raw_fitness_, rtol=1e-10)
+    assert_allclose(long.predict(df[list('abc')].values), dense.predict(df[list('abc')].values), rtol=1e-10)
+
+
+def test_panel_layout_dense_unbalanced():
+    """Check that the dense layout rejects an unbalanced panel, which the long layout fits."""
+    df, y = _panel(drop=5)
+    _panel_estimator(panel_layout='long').fit(df.copy(), y)
+    with pytest.raises(ValueError, match='unbalanced'):
+        _panel_estimator(panel_layout='dense').fit(df.copy(), y)
+
+
+def test_racing_eliminated_not_memoized():
+    """Check that programs eliminated by racing get their true fitness when they reappear."""
+    rng = np.random.RandomState(2)
+    X = rng.uniform(-3, 3, size=(400, 3))
+    y = X[:, 0] ** 2 + np.sin(X[:, 1]) * X[:, 2]
+    # 繁殖比例较高，被淘汰的程序经常原样出现在下一代
+    est = SymbolicRegressor(population_size=100, generations=5, tournament_size=2,
+                            racing_schedule=[(0.3, 0.5)], p_crossover=0.2, p_subtree_mutation=0.05,
+                            p_hoist_mutation=0.05, p_point_mutation=0.05,
+                            function_set=['add', 'sub', 'mul', 'div', 'sin'], random_state=3)
+    est.fit(X, y)
+    weight = np.ones(len(y))
+    eliminated = set()
+    n_reappeared = 0
+    for previous, population in zip(est._programs[:-1], est._programs[1:]):
+        eliminated |= {str(program) for program, flag in zip(previous, previous.eliminated)
+                       if program is not None and flag}
+        for program, flag in zip(population, population.eliminated):
+            if program is None or flag:
+                continue
+            # 之前被淘汰、这一代晋级的程序在全部数据上重新计算适应度
+            n_reappeared += str(program) in eliminated
+            assert program.raw_fitness_ == program.raw_fitness(X, y, weight)
+    assert n_reappeared > 0
+
+
+def test_fingerprint_clones_independent_of_n_jobs():
+    """Check that clones get the same fitness whatever the number of jobs."""
+    rng = np.random.RandomState(3)
+    X = rng.uniform(-3, 3, size=(400, 3))
+    y = X[:, 0] ** 2 + np.sin(X[:, 1]) * X[:, 2]
+    fitness = []
+    for n_jobs in (1, 2):
+        est = SymbolicRegressor(population_size=200, generations=4, fingerprint_size=64, n_jobs=n_jobs,
+                                function_set=['add', 'sub', 'mul', 'div', 'neg', 'abs'], random_state=0)
+        est.fit(X, y)
+        assert sum(est.run_details_['clone_rate']) > 0
+        fitness.append(np.concatenate([population.raw_fitness_ for population in est._programs]))
+    assert_array_equal(fitness[0], fitness[1])
+
+
+def _islands_estimator(**params):
+    params = dict(dict(population_size=100, n_islands=2, migration_interval=2, migration_size=3,
+                       function_set=['add', 'sub', 'mul', 'div', 'sin'], random_state=0), **params)
+    return SymbolicRegressor(**params)
+
+
+def test_islands_fit():
+    """Check an island-model fit across processes, with migrations and out-of-bag fitness."""
+    rng = np.random.RandomState(4)
+    X = rng.uniform(-3, 3, size=(300, 3))
+    y = X[:, 0] ** 2 + np.sin(X[:, 1]) * X[:, 2]
+    fits = [_islands_estimator(generations=5, max_samples=0.8, n_jobs=n_jobs).fit(X, y) for n_jobs in (1, 2)]
+    est = fits[1]
+    # 中间代的种群不保存
+    assert len(est._programs) == 5
+    assert all(population is None for population in est._programs[:-1])
+    assert np.all(np.isfinite(est.run_details_['best_oob_fitness']))
+    assert np.isfinite(est._program.oob_fitness_)
+    assert np.all(np.isfinite(est.predict(X)))
+    # 岛屿在不同进程中时通过文件迁移，结果与单进程相同
+    assert_array_equal(est._programs[-1].raw_fitness_, fits[0]._programs[-1].raw_fitness_)
+    assert_array_equal(est._programs[-1].oob_fitness_, fits[0]._programs[-1].oob_fitness_)
+    assert_array_equal(est.predict(X), fits[0].predict(X))
+    # 不迁移时各岛屿独立进化，结果不同
+    isolated = _islands_estimator(generations=5, max_samples=0.8, migration_size=0).fit(X, y)
+    assert not np.array_equal(isolated._programs[-1].raw_fitness_, est._programs[-1].raw_fitness_)
+
+
+def test_islands_genealogy():
+    """Check that the parents of island programs index the whole previous generation."""
+    rng = np.random.RandomState(4)
+    X = rng.uniform(-3, 3, size=(300, 3))
+    y = X[:, 0] ** 2 + np.sin(X[:, 1]) * X[:, 2]
+    est = _islands_estimator(generations=3, n_jobs=2, p_crossover=0.5, p_subtree_mutation=0.1,
+                             p_hoist_mutation=0.1, p_point_mutation=0.1).fit(X, y)
+    # 续训一代，上一次fit的最后一代保存了完整的种群
+    est.set_params(generations=4, warm_start=True).fit(X, y)
+    previous, population = est._programs[-2:]
+    islands = np.repeat([0, 1], 50)
+    n_reproduced = 0
+    for i, program in enumerate(population):
+        genome = program.parents
+        parent = previous[genome['parent_idx']]
+        assert parent is not None
+        # 没有迁移时父代来自同一岛屿
+        assert islands[genome['parent_idx']] == islands[i]
+        if genome['method'] == 'Reproduction':
+            assert str(program) == str(parent)
+            n_reproduced += 1
+        if 'donor_idx' in genome:
+            assert previous[genome['donor_idx']] is not None
+    assert n_reproduced > 0
+    # 没有后代的程序被剪除
+    referenced = population.genealogy.reference_counts(np.arange(len(population)), len(previous)) > 0
+    assert_array_equal(previous._alive, referenced)
+    assert_array_equal(est.predict(X), est._program.execute(X))
+
+
+def _check_links(programs):
+    # 每一代存活的程序都能找到上一代的父代，上一代存活的程序都有后代
+    for previous, population in zip(programs[:-1], programs[1:]):
+        if previous is None or population is None:
+            continue
+        referenced = np.zeros(len(previous), dtype=bool)
+        for program in population:
+            if program is None:
+                continue
+            for key in ('parent_idx', 'donor_idx'):
+                if key in program.parents:
+                    assert previous[program.parents[key]] is not None
+                    referenced[program.parents[key]] = True
+        assert_array_equal(previous._alive, referenced)
+
+
+def test_prune_ancestors_links():
+    """Check that pruning keeps the parents of surviving programs, across warm starts and islands."""
+    rng = np.random.RandomState(5)
+    X = rng.uniform(-3, 3, size=(300, 3))
+    y = X[:, 0] ** 2 + np.sin(X[:, 1]) * X[:, 2]
+    est = SymbolicRegressor(population_size=60, generations=4, function_set=['add', 'sub', 'mul', 'div', 'sin'],
+                            random_state=0)
+    est.fit(X, y)
+    assert est._programs[-1]._alive.all()
+    assert not all(population._alive.all() for population in est._programs[:-1])
+    _check_links(est._programs)
+    est.set_params(generations=6, warm_start=True).fit(X, y)
+    _check_links(est._programs)
+    assert_array_equal(est.predict(X), est._program.execute(X))
+    # 岛屿模型的中间代不保存，剪除在这些代停止
+    est.set_params(generations=9, n_islands=2, migration_interval=1).fit(X, y)
+    assert [population is None for population in est._programs] == [False] * 6 + [True] * 2 + [False]
+    alive = [population._alive.copy() for population in est._programs[:6]]
+    est.set_params(generations=11, n_islands=1).fit(X, y)
+    assert len(est._programs) == 11
+    _check_links(est._programs)
+    for population, before in zip(est._programs[:6], alive):
+        assert_array_equal(population._alive, before)
+    assert_array_equal(est.predict(X), est._program.execute(X))
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+"""
+-------------------------------------------------
+# @Project  :gplearnplus
+# @File     :test_kernel
+# @Date     :2026/10/19 0019 10:40
+# @Author   :Junzhe Huang
+# @Email    :acejasonhuang@163.com
+# @Software :PyCharm
+-------------------------------------------------
+"""
+#####
+# 融合内核与内核缓存目录的测试
+###
+import os
+
+import numpy as np
+import pytest
+from numpy.testing import assert_allclose
+
+from gplearnplus import _kernel
+from gplearnplus.genetic import SymbolicRegressor
+
+pytest.importorskip('numba')
+
+
+def test_fused_kernels_match_execute(tmp_path):
+    """Check that programs give the same output with and without fused kernels."""
+    rng = np.random.RandomState(0)
+    X = rng.uniform(-3, 3, size=(300, 4))
+    y = X[:, 0] ** 2 + np.sin(X[:, 1]) * X[:, 2]
+    est = SymbolicRegressor(population_size=100, generations=2, low_memory=True,
+                            function_set=['add', 'sub', 'mul', 'div', 'sqrt', 'log', 'neg', 'inv', 'abs',
+                                          'max', 'min', 'sin'],
+                            random_state=0)
+    est.fit(X, y)
+    # 包含nan和接近0的值，覆盖保护除法和nan的比较
+    X[::17, 0] = np.nan
+    X[::13, 1] = 1e-4
+    kernel_dir = str(tmp_path / 'kernels')
+    for program in est._programs[-1]:
+        with np.errstate(all='ignore'):
+            expected = program.execute(X)
+            fused = program.execute(X, kernel_dir=kernel_dir)
+        # 超越函数与numpy的结果可能只在最后几位不同
+        assert_allclose(fused, expected, rtol=1e-12, atol=1e-12)
+    assert any(name.endswith('.py') for name in os.listdir(kernel_dir))
+
+
+@pytest.mark.skipif(not hasattr(os, 'getuid'), reason='ownership checks need os.getuid')
+def test_kernel_dir_private(tmp_path):
+    """Check that a new kernel cache directory is only accessible by its owner."""
+    directory = str(tmp_path / 'private')
+    _kernel._check_kernel_dir(directory)
+    assert os.stat(directory).st_mode & 0o777 == 0o700 & ~_umask()
+
+
+@pytest.mark.skipif(not hasattr(os, 'getuid'), reason='ownership checks need os.getuid')
+@pytest.mark.parametrize('mode', [0o770, 0o777])
+def test_kernel_dir_writable_by_others(tmp_path, mode):
+    """Check that a kernel cache directory writable by others is refused."""
+    directory = tmp_path / 'shared'
+    directory.mkdir()
+    directory.chmod(mode)
+    with pytest.raises(PermissionError, match='not writable by others'):
+        _kernel._check_kernel_dir(str(directory))
+    assert str(directory) not in _kernel._checked_dirs
+
+
+@pytest.mark.skipif(not hasattr(os, 'getuid'), reason='ownership checks need os.getuid')
+def test_kernel_dir_foreign_owner(tmp_path, monkeypatch):
+    """Check that a kernel cache directory owned by another user is refused."""
+    directory = tmp_path / 'foreign'
+    directory.mkdir(mode=0o700)
+    # 以另一个用户的身份检查
+    monkeypatch.setattr(_kernel.os, 'getuid', lambda: directory.stat().st_uid + 1)
+    with pytest.raises(PermissionError, match='owned by the current user'):
+        _kernel._check_kernel_dir(str(directory))
+    assert str(directory) not in _kernel._checked_dirs
+
+
+def _umask():
+    umask = os.umask(0)
+    os.umask(umask)
+    return umask
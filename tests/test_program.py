@@ -0,0 +1,224 @@
+# -*- coding: utf-8 -*-
+"""
+-------------------------------------------------
+# @Project  :gplearnplus
+# @File     :test_program
+# @Date     :2026/10/18 0018 23:20
+# @Author   :Junzhe Huang
+# @Email    :acejasonhuang@163.com
+# @Software :PyCharm
+-------------------------------------------------
+"""
+#####
+# 程序执行相关的测试
+###
+import os
+import sys
+import threading
+
+import numpy as np
+import pytest
+from numpy.testing import assert_allclose, assert_array_equal
+
+# example.py导入同目录下的functions模块
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from gplearnplus import example, rolling
+from gplearnplus._cache import _SubtreeCache, _get_subtree_cache
+from gplearnplus._program import _Program
+from gplearnplus.fitness import _fitness_map
+from gplearnplus.functions import _PanelLayout, _function_map, make_function
+from gplearnplus.genetic import SymbolicRegressor, _panel_shards
+
+
+def _population(random_state=0, **params):
+    # 一代演化后的程序，用作执行测试的样本
+    rng = np.random.RandomState(random_state)
+    X = rng.uniform(-3, 3, size=(300, 4))
+    y = X[:, 0] ** 2 + np.sin(X[:, 1]) * X[:, 2]
+    est = SymbolicRegressor(population_size=100, generations=2, low_memory=True,
+                            function_set=['add', 'sub', 'mul', 'div', 'sin', 'cos', 'log', 'sqrt', 'neg'],
+                            random_state=random_state, **params)
+    est.fit(X, y)
+    return X, est._programs[-1]
+
+
+def test_subtree_cache_execute():
+    """Check that programs give the same output with and without the subtree cache."""
+    X, population = _population()
+    cache = _SubtreeCache(2 ** 24)
+    expected = [program.execute(X) for program in population]
+    # 第二遍执行时大部分子树来自缓存
+    for _ in range(2):
+        for program, y_pred in zip(population, expected):
+            assert_array_equal(program.execute(X, cache), y_pred)
+    assert cache.hits > 0
+
+
+def test_subtree_cache_eviction():
+    """Check that the cache stays within its memory budget."""
+    cache = _SubtreeCache(3 * 800)
+    for i in range(5):
+        assert cache.put('s%d' % i, np.full(100, float(i)))
+        assert cache.n_bytes <= cache.max_bytes
+    # 最早的结果先被淘汰
+    assert len(cache) == 3
+    assert 's0' not in cache and 's1' not in cache
+    assert_array_equal(cache.get('s4'), 4.)
+    # 超过整个预算的结果不保存
+    assert not cache.put('large', np.zeros(400))
+    assert 'large' not in cache
+    # 最近使用的结果保留
+    cache.get('s2')
+    cache.put('s5', np.zeros(100))
+    assert 's2' in cache and 's3' not in cache
+
+
+def test_subtree_cache_isolation():
+    """Check that fits and threads do not share cached results."""
+    first = _get_subtree_cache('first', 2 ** 20)
+    assert _get_subtree_cache('first', 2 ** 20) is first
+    first.put('X0', np.zeros(10))
+    second = _get_subtree_cache('second', 2 ** 20)
+    assert second is not first
+    assert 'X0' not in second
+    caches = []
+    thread = threading.Thread(target=lambda: caches.append(_get_subtree_cache('second', 2 ** 20)))
+    thread.start()
+    thread.join()
+    assert caches[0] is not second
+    assert _get_subtree_cache('second', 0) is None
+
+
+def test_subtree_cache_fit():
+    """Check that the subtree cache does not change the result of a fit."""
+    _, population = _population(subtree_cache_size=0)
+    _, cached = _population(subtree_cache_size=16)
+    assert_array_equal(population.raw_fitness_, cached.raw_fitness_)
+    assert_array_equal(population.codes, cached.codes)
+
+
+def test_lineage_cache_fit():
+    """Check that the lineage cache is off by default and does not change the result of a fit."""
+    assert SymbolicRegressor().lineage_cache_size == 0
+    _, population = _population(lineage_cache_size=0)
+    _, cached = _population(lineage_cache_size=16)
+    assert_array_equal(population.raw_fitness_, cached.raw_fitness_)
+    assert_array_equal(population.codes, cached.codes)
+
+
+def _program(nodes, simplify=None):
+    # 由节点列表构建时序程序，字符串为特征，函数名取自_function_map
+    functions = [_function_map[name] for name in ('add', 'sub', 'mul', 'div', 'neg', 'abs', 'max', 'min')]
+    functions.append(example.delay)
+    names = {function.name: function for function in functions}
+    arities = {}
+    for function in functions:
+        arities.setdefault(function.arity, []).append(function)
+    program = [names.get(node, node) if isinstance(node, str) else node for node in nodes]
+    return _Program(function_dict={'number': functions, 'category': []}, arities=arities, init_depth=(2, 4),
+                    init_method='grow', n_features=3, const_range=(-1., 1.), metric=_fitness_map['mse'],
+                    p_point_replace=0.05, parsimony_coefficient=0.001, random_state=None,
+                    data_type='time_series', cat_var_number=0, simplify=simplify, program=program)
+
+
+def _nonfinite_data():
+    rng = np.random.RandomState(0)
+    X = rng.normal(size=(60, 3))
+    X[::7, 0] = np.nan
+    X[::5, 1] = np.inf
+    X[::11, 1] = -np.inf
+    X[3::13, 2] = 0.
+    return X
+
+
+SIMPLIFY_CASES = [
+    # 交换律
+    (['add', '1', '0'], ['add', '0', '1'], 'add(X0, X1)'),
+    (['mul', 'add', '2', '0', 'sub', '1', '0'], ['mul', 'sub', '1', '0', 'add', '0', '2'],
+     'mul(add(X0, X2), sub(X1, X0))'),
+    # 对合
+    (['add', 'neg', 'neg', '0', '1'], None, 'add(X0, X1)'),
+    # 幂等
+    (['abs', 'abs', '1'], None, 'abs(X1)'),
+    (['add', 'max', '1', '1', 'min', '2', '2'], None, 'add(X1, X2)'),
+    # 自身取值只用于常数，x为nan或inf时sub(x, x)和div(x, x)不是常数
+    (['add', 'sub', '1', '1', 'div', '1', '1'], None, 'add(div(X1, X1), sub(X1, X1))'),
+    # 复合
+    (['delay', 'delay', '0', 5, 7], None, 'delay(X0, 12)'),
+]
+
+
+@pytest.mark.parametrize('nodes, equivalent, expected', SIMPLIFY_CASES)
+def test_simplify_rules(nodes, equivalent, expected):
+    """Check the simplified form of programs and that their output is unchanged."""
+    X = _nonfinite_data()
+    original = _program(nodes)
+    stored = _program(nodes, simplify='store')
+    assert str(stored) == expected
+    with np.errstate(all='ignore'):
+        y_pred = original.execute(X)
+        assert_array_equal(_program(nodes, simplify='execute').execute(X), y_pred)
+        assert_array_equal(stored.execute(X), y_pred)
+    if equivalent is not None:
+        # 等价的公式化简为同一形式
+        assert str(_program(equivalent, simplify='store')) == expected
+
+
+def test_simplify_compose_out_of_range():
+    """Check that composed int parameters only leave their range when executed."""
+    X = _nonfinite_data()
+    nodes = ['add', 'delay', 'delay', '0', 20, 25, '1']
+    # 保存的公式需要保持合法，超出范围时不复合
+    assert str(_program(nodes, simplify='store')) == 'add(X1, delay(delay(X0, 20), 25))'
+    with np.errstate(all='ignore'):
+        assert_array_equal(_program(nodes, simplify='execute').execute(X), _program(nodes).execute(X))
+
+
+def _demean(x):
+    return x - np.mean(x)
+
+
+def _panel_program(nodes, dates, securities, panel_layout=None):
+    # 由节点列表构建面板程序，窗口最长30天
+    demean = make_function(function=_demean, name='demean', arity=1, function_type='section',
+                           param_type=[{'vector': {'number': (None, None)}}], thread_safe=True)
+    functions = [_function_map['add'], _function_map['mul'], rolling.MA, rolling.ts_stddev, demean]
+    names = {function.name: function for function in functions}
+    arities = {}
+    for function in functions:
+        arities.setdefault(function.arity, []).append(function)
+    program = [names.get(node, node) if isinstance(node, str) else node for node in nodes]
+    return _Program(function_dict={'number': functions, 'category': []}, arities=arities, init_depth=(2, 4),
+                    init_method='grow', n_features=3, const_range=(3, 30), metric=_fitness_map['mse'],
+                    p_point_replace=0.05, parsimony_coefficient=0.001, random_state=None, data_type='panel',
+                    cat_var_number=0, security_data=securities, time_series_data=dates,
+                    panel_layout=panel_layout, program=program)
+
+
+SHARDED_PROGRAMS = [
+    ['MA', 'demean', '0', 20],
+    ['demean', 'ts_stddev', '1', 30],
+    ['mul', 'ts_stddev', 'demean', '1', 15, 'MA', '2', 12],
+    ['add', 'MA', 'mul', '0', '2', 25, 'demean', 'MA', 'demean', '2', 10],
+]
+
+
+@pytest.mark.parametrize('nodes', SHARDED_PROGRAMS)
+@pytest.mark.parametrize('layout', ['long', 'dense'])
+def test_sharded_execute(nodes, layout):
+    """Check that sharded execution matches plain execution with windows longer than a shard."""
+    n_dates, n_securities = 60, 5
+    rng = np.random.RandomState(0)
+    dates = np.repeat(np.arange(n_dates), n_securities)
+    securities = np.tile(np.arange(n_securities), n_dates)
+    # 长表按日期排列，同一个股的样本不连续
+    X = rng.normal(size=(len(dates), 3))
+    panel_layout = _PanelLayout(dates, securities) if layout == 'dense' else None
+    program = _panel_program(nodes, dates, securities, panel_layout)
+    expected = program.execute(X)
+    assert np.isfinite(expected).sum() > len(X) / 3
+    # 8个线程时每片截面最多8个日期，短于时序窗口
+    with _panel_shards(program, 8) as shards:
+        assert max(local.n_groups for _, local in shards.shards['section']) <= 8
+        assert_allclose(program.execute(X, shards=shards), expected, rtol=1e-12, equal_nan=True)
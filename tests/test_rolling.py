@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+"""
+-------------------------------------------------
+# @Project  :gplearnplus
+# @File     :test_rolling
+# @Date     :2026/10/18 0018 21:30
+# @Author   :Junzhe Huang
+# @Email    :acejasonhuang@163.com
+# @Software :PyCharm
+-------------------------------------------------
+"""
+#####
+# 滚动窗口函数与example中逐窗口计算版本的一致性测试，窗口3到30
+###
+
+import os
+import sys
+
+import numpy as np
+import pytest
+from numpy.testing import assert_allclose, assert_array_equal
+
+# example.py导入同目录下的functions模块
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from gplearnplus import example, rolling
+
+WINDOWS = [3, 4, 5, 10, 20, 30]
+NAN_FRACTIONS = [0., 0.1, 0.5]
+
+
+def _series(n, nan_fraction, seed):
+    rng = np.random.RandomState(seed)
+    X = rng.randn(n)
+    Y = 0.5 * X + rng.randn(n)
+    X[rng.uniform(size=n) < nan_fraction] = np.nan
+    return X, Y
+
+
+def _naive_corr(X, Y, d):
+    # 按窗口内x, y均非nan的样本计算相关系数
+    res = np.full(len(X), np.nan)
+    for i in range(d - 1, len(X)):
+        x, y = X[i - d + 1:i + 1], Y[i - d + 1:i + 1]
+        valid = ~(np.isnan(x) | np.isnan(y))
+        if valid.sum() > 2:
+            res[i] = np.corrcoef(x[valid], y[valid])[0, 1]
+    return res
+
+
+@pytest.mark.parametrize('name', ['ts_min', 'ts_max', 'ts_argmax', 'ts_stddev', 'MIDPOINT', 'MA', 'KAMA',
+                                  'LINEARREG_SLOPE'])
+@pytest.mark.parametrize('nan_fraction', NAN_FRACTIONS)
+def test_rolling_matches_example(name, nan_fraction):
+    """Check the rolling kernels against the window by window versions."""
+    X, _ = _series(600, nan_fraction, 0)
+    for d in WINDOWS:
+        assert_allclose(getattr(rolling, '_' + name)(X, d), getattr(example, '_' + name)(X, d),
+                        rtol=1e-7, atol=1e-12, err_msg='d=%d' % d)
+
+
+@pytest.mark.parametrize('nan_fraction', NAN_FRACTIONS)
+def test_rolling_pairs_match_example(nan_fraction):
+    """Check ts_corr and BETA against the naive versions."""
+    X, Y = _series(600, nan_fraction, 1)
+    for d in WINDOWS:
+        assert_allclose(rolling._BETA(X, Y, d), example._BETA(X, Y, d), rtol=1e-7, atol=1e-12)
+        assert_allclose(rolling._ts_corr(X, Y, d), _naive_corr(X, Y, d), rtol=1e-7, atol=1e-12)
+        if nan_fraction == 0:
+            assert_allclose(rolling._ts_corr(X, Y, d), example._ts_corr(X, Y, d), rtol=1e-7, atol=1e-12)
+
+
+@pytest.mark.parametrize('nan_fraction', NAN_FRACTIONS)
+def test_rolling_argmin(nan_fraction):
+    """Check that ts_argmin is the argmax of the negated series."""
+    X, _ = _series(600, nan_fraction, 2)
+    for d in WINDOWS:
+        assert_array_equal(rolling._ts_argmin(X, d), example._ts_argmax(-X, d))
+
+
+def test_rolling_rank():
+    """Check ts_rank against the naive version on data without ties or nan."""
+    X, _ = _series(600, 0., 3)
+    for d in WINDOWS:
+        assert_allclose(rolling._ts_rank(X, d), example._ts_rank(X, d))
+
+
+def test_rolling_stddev_degenerate_windows():
+    """Check that windows without dispersion give exactly zero."""
+    X, _ = _series(3000, 0., 4)
+    # 单个样本的窗口
+    assert_array_equal(rolling._ts_stddev(X, 1)[1:], 0.)
+    # 除一个样本外均为nan的窗口
+    sparse = np.full(3000, np.nan)
+    sparse[::7] = X[::7]
+    for d in (3, 5):
+        expected = example._ts_stddev(sparse, d)
+        result = rolling._ts_stddev(sparse, d)
+        assert_array_equal(result[expected == 0], 0.)
+        assert_allclose(result, expected, rtol=1e-7, atol=1e-12)
+    # 经过大幅波动之后的常数窗口，以及跨越定期重算的位置
+    X[1000:1100] = 0.
+    X[1500:2500] = 3.7
+    for d in WINDOWS:
+        expected = example._ts_stddev(X, d)
+        result = rolling._ts_stddev(X, d)
+        assert_array_equal(result[1000 + d - 1:1100], 0.)
+        assert_array_equal(result[1500 + d - 1:2500], 0.)
+        assert_allclose(result, expected, rtol=1e-7, atol=1e-12)
+
+
+def test_rolling_stddev_small_dispersion():
+    """Check the precision on windows of small dispersion around a large level."""
+    rng = np.random.RandomState(5)
+    X = 100. + np.cumsum(rng.randn(3000))
+    X[rng.uniform(size=3000) < 0.3] = np.nan
+    X[::50] += 1e-6 * rng.randn(60)
+    for d in WINDOWS:
+        assert_allclose(rolling._ts_stddev(X, d), example._ts_stddev(X, d), rtol=1e-7, atol=1e-12)
+
+
+@pytest.mark.parametrize('name', ['ts_min', 'ts_argmin', 'ts_rank', 'ts_stddev', 'MA', 'KAMA'])
+def test_rolling_segments(name):
+    """Check that segment kernels equal one call per group."""
+    X, _ = _series(900, 0.1, 6)
+    offsets = np.array([0, 250, 260, 600, 900])
+    kernel = getattr(rolling, '_' + name)
+    expected = np.concatenate([kernel(X[offsets[i]:offsets[i + 1]], 10) for i in range(len(offsets) - 1)])
+    assert_allclose(rolling._segment(kernel)(offsets, X, 10), expected)
@@ -83,3 +83,40 @@ def _partition_estimators(n_estimators, n_jobs):
     starts = np.cumsum(n_estimators_per_job)
 
     return n_jobs, n_estimators_per_job.tolist(), [0] + starts.tolist()
+
+
+# 按估计代价将连续的任务划分为若干批
+# 返回 每批任务数， 累计任务数
+def _partition_costs(costs, n_batches):
+    """Partition contiguous tasks into batches of about equal total cost.
+
+    Parameters
+    ----------
+    costs : array-like, shape = [n_tasks]
+        The estimated cost of each task.
+
+    n_batches : int
+        The number of batches, each batch gets at least one task.
+
+    Returns
+    -------
+    n_tasks_per_batch : list of int
+        The number of tasks of each batch.
+
+    starts : list of int
+        The index of the first task of each batch, followed by n_tasks.
+
+    """
+    costs = np.asarray(costs, dtype=np.float64)
+    n_batches = min(n_batches, len(costs))
+    if not np.sum(costs) > 0:
+        costs = np.ones(len(costs))
+    cumulative = np.cumsum(costs)
+    starts = [0]
+    for k in range(1, n_batches):
+        start = int(np.searchsorted(cumulative, cumulative[-1] * k / n_batches))
+        # 每批至少一个任务
+        start = min(max(start, starts[-1] + 1), len(costs) - (n_batches - k))
+        starts.append(start)
+    starts.append(len(costs))
+    return np.diff(starts).tolist(), starts